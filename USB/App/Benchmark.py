@@ -0,0 +1,509 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" Benchmarks, run from the USB directory: python -m App.Benchmark [stream] """
+from __future__ import unicode_literals, print_function
+
+import glob, io, json, os, signal, sys, threading, time
+from App import TinyG2Parser, GcodeFile, GcodeFilter
+
+
+def getStatusStream(count=100000):
+    """ Lines as sent by a TinyG2 streaming a job: one footer per G-code
+        line, status reports every few lines and queue reports """
+    stream = []
+    for i in range(count):
+        if i % 4 == 0:
+            stream.append('{"sr":{"line":%d,"posx":%.3f,"posy":%.3f,"posz":-1.000,'
+                          '"vel":1200.00,"feed":1200.00,"stat":5}}\n' % (i, i * 0.01, i * 0.02))
+        elif i % 4 == 1:
+            stream.append('{"qr":%d}\n' % (i % 28))
+        else:
+            stream.append('{"r":{},"f":[1,0,%d]}\n' % (10 + i % 20))
+    return stream
+
+def readStream(path):
+    with io.open(path, encoding="utf-8", errors="replace") as f:
+        return [l for l in f if l.strip()]
+
+def benchClassifier(stream):
+    """ Lines per second: json.loads on every line (previous onSerialRead)
+        against TinyG2Parser prefix dispatch with a qr subscriber """
+    start = time.time()
+    for line in stream:
+        try:
+            d = json.loads(line)
+        except ValueError:
+            TinyG2Parser.getDataTxt([], line)
+        else:
+            if "r" in d:
+                TinyG2Parser.getDataDic([], TinyG2Parser.dickey["r"], d["r"])
+    full = len(stream) / (time.time() - start)
+    parser = TinyG2Parser.Parser()
+    parser.subscribe("qr", lambda qr: None)
+    start = time.time()
+    for line in stream:
+        parser.parse(line)
+    fast = len(stream) / (time.time() - start)
+    print("classifier: {} lines, json.loads {:.0f} lines/s, prefix dispatch {:.0f} lines/s (x{:.1f})"
+          .format(len(stream), full, fast, fast / full))
+
+def benchFilter(paths, names=GcodeFilter.getStages(), precision=4):
+    """ Bytes saved on the wire by the preprocessing stages """
+    for path in paths:
+        pipeline = GcodeFilter.Pipeline(names, precision)
+        start = time.time()
+        with GcodeFile.GcodeFile(path) as f:
+            for line in pipeline.process(f.getLines()):
+                pass
+        print("filter {}: {} in {:.3f}s".format(os.path.basename(path),
+              pipeline.statistics, time.time() - start))
+
+def benchRealtime(count=200, size=256, rate=1000000):
+    """ Real time command to wire latency on a pty while the writer streams
+        G-code at rate bytes/s (None: as fast as the pty takes it, then the
+        pty buffer is always full and latency is the time to drain it,
+        whatever the writer does). The device side is a
+        forked process, so it doesn't share the interpreter lock with the
+        writer (needs PySide and pyserial). """
+    import pty, serial, tty
+    from PySide import QtCore
+    from App import PySerialMetrics, PySerialWriter
+
+    class State(QtCore.QObject):
+        metrics = PySerialMetrics.Metrics()
+        def writerErrorMsg(self, e):
+            print("writer error: {}".format(e))
+
+    master, slave = pty.openpty()
+    tty.setraw(master)
+    rfd, wfd = os.pipe()
+    if os.fork() == 0:
+        # Device: report each real time command received
+        os.close(slave)
+        try:
+            data = os.read(master, 65536)
+            while data:
+                for i in range(data.count(b"!")):
+                    os.write(wfd, b"!")
+                data = os.read(master, 65536)
+        except OSError:
+            pass
+        finally:
+            os._exit(0)
+    os.close(master)
+    port = serial.Serial(os.ttyname(slave), dsrdtr=True, rtscts=True)
+    writer = PySerialWriter.Writer(State(), port, "\n", size)
+    threading.Thread(target=writer.run).start()
+    stop = threading.Event()
+    def stream():
+        i, sent, start = 0, 0, time.time()
+        while not stop.is_set() and writer.put("G1X{}Y{}".format(i % 100, i % 50)):
+            i += 1
+            sent += 10
+            if rate is not None and sent > rate * (time.time() - start):
+                time.sleep(0.001)
+    streamer = threading.Thread(target=stream)
+    streamer.daemon = True
+    streamer.start()
+    latencies, writes = [], []
+    for i in range(count):
+        time.sleep(0.01)
+        start = time.time()
+        writes.append(writer.writeNow("!"))
+        os.read(rfd, 1)
+        latencies.append(time.time() - start)
+    stop.set()
+    writer.close()
+    port.close()
+    os.close(slave)
+    os.wait()
+    for name, values in (("write", writes), ("wire", latencies)):
+        values.sort()
+        print("realtime {}: {} commands streaming at {} B/s, latency median {:.3f} ms, "
+              "p99 {:.3f} ms, max {:.3f} ms".format(name, count, rate, values[count // 2] * 1000,
+              values[int(count * 0.99)] * 1000, values[-1] * 1000))
+
+
+def benchDualPort(count=100, shared=False, stream=True):
+    """ Control channel round trip ({"qr":null} to its footer) while the
+        data channel streams G-code on a second pty as fast as the device
+        side acknowledges it. Channels are read by one reactor if shared,
+        else by a reactor each (as with DualPort). The device side is a
+        forked process (needs PySide and pyserial). """
+    import pty, select, serial, tty
+    from PySide import QtCore
+    from App import PySerialMetrics, PySerialReactor, PySerialWriter, TinyG2Parser
+
+    class Proxy(object):
+        def getReadMode(self, obj):
+            return "Ring"
+
+    class Machine(QtCore.QObject):
+        ctrlStart = QtCore.Signal()
+        ctrlStop = QtCore.Signal()
+        serialRead = QtCore.Signal(object)
+        serialReadBatch = QtCore.Signal(list)
+        serialParsed = QtCore.Signal(list)
+        def __init__(self):
+            QtCore.QObject.__init__(self)
+            self.run = True
+            self.parser = TinyG2Parser.Parser()
+            self.dataParser = TinyG2Parser.Parser()
+        def getParser(self):
+            return self.parser
+        def getDataParser(self):
+            return self.dataParser
+        def getCharEndOfLine(self):
+            return "\n"
+        def getBatchDelay(self):
+            return 0.016
+        def getBatchSize(self):
+            return 256
+
+    class State(QtCore.QObject):
+        serialRead = QtCore.Signal(object)
+        serialReadBatch = QtCore.Signal(list)
+        serialClose = QtCore.Signal()
+        serialError = QtCore.Signal()
+        def __init__(self, machine, port, ctrl):
+            QtCore.QObject.__init__(self)
+            self.obj = Proxy()
+            self.obj.Proxy = Proxy()
+            self.obj.Proxy.Serial = port
+            self.metrics = PySerialMetrics.Metrics()
+            self.parent = machine
+            self.ctrl = ctrl
+        def machine(self):
+            return self.parent
+        def isCtrlChannel(self):
+            return self.ctrl
+        def startThreadMsg(self):
+            pass
+        def doThreadClose(self):
+            self.obj.Proxy.Serial.close()
+        def errorThreadMsg(self, e):
+            print("reactor error: {}".format(e))
+        writerErrorMsg = errorThreadMsg
+
+    ptys = [pty.openpty(), pty.openpty()]
+    for master, slave in ptys:
+        tty.setraw(master)
+    device = os.fork()
+    if device == 0:
+        # Device: answer the control requests and acknowledge each data line
+        try:
+            masters = [master for master, slave in ptys]
+            for master, slave in ptys:
+                os.close(slave)
+            while True:
+                for fd in select.select(masters, [], [])[0]:
+                    data = os.read(fd, 65536)
+                    if fd == masters[0]:
+                        os.write(fd, b'{"r":{"qr":28},"f":[1,0,11]}\n' * data.count(b"\n"))
+                    else:
+                        os.write(fd, b'{"r":{},"f":[1,0,8]}\n' * data.count(b"\n"))
+        except OSError:
+            pass
+        finally:
+            os._exit(0)
+    machine = Machine()
+    ports, states = [], []
+    for (master, slave), ctrl in zip(ptys, (True, False)):
+        os.close(master)
+        ports.append(serial.Serial(os.ttyname(slave), dsrdtr=True, rtscts=True))
+        states.append(State(machine, ports[-1], ctrl))
+    reactors = [PySerialReactor.Reactor()]
+    reactors.append(reactors[0] if shared else PySerialReactor.Reactor())
+    for reactor, state in zip(reactors, states):
+        reactor.register(state)
+    replied = threading.Event()
+    machine.parser.subscribe("r", lambda r: replied.set())
+    acked = [0]
+    def onFooter(r):
+        acked[0] += 1
+    machine.dataParser.subscribe("r", onFooter)
+    writer = PySerialWriter.Writer(states[1], ports[1], "\n", 256)
+    threading.Thread(target=writer.run).start()
+    stop = threading.Event()
+    def streamer():
+        i = 0
+        while not stop.is_set() and writer.put("G1X{}Y{}".format(i % 100, i % 50)):
+            i += 1
+    if stream:
+        thread = threading.Thread(target=streamer)
+        thread.daemon = True
+        thread.start()
+    latencies = []
+    start = time.time()
+    for i in range(count):
+        time.sleep(0.01)
+        replied.clear()
+        t = time.time()
+        ports[0].write(b'{"qr":null}\n')
+        replied.wait(1)
+        latencies.append(time.time() - t)
+    elapsed = time.time() - start
+    stop.set()
+    writer.close()
+    machine.run = False
+    for reactor in reactors:
+        reactor.wakeup()
+        reactor.waitForDone(machine, 5)
+    for master, slave in ptys:
+        os.close(slave)
+    # The device may be blocked writing acknowledgements nobody reads
+    os.kill(device, signal.SIGTERM)
+    os.waitpid(device, 0)
+    latencies.sort()
+    print("dual port {}{}: control round trip median {:.3f} ms, p99 {:.3f} ms, "
+          "max {:.3f} ms, data {:.0f} lines/s".format("shared reactor" if shared else "reactor each",
+          "" if stream else " (idle)", latencies[count // 2] * 1000,
+          latencies[int(count * 0.99)] * 1000, latencies[-1] * 1000, acked[0] / elapsed))
+
+
+def benchSimulator(paths, rate=0, window=24):
+    """ Lines per second through the tinyg2sim:// device (rate 0: moves are
+        executed at once) with window lines sent and not acknowledged """
+    import serial
+    for path in paths:
+        port = serial.serial_for_url("tinyg2sim://bench?sr=0&rate={}".format(rate), timeout=1)
+        port.readline()
+        pipeline = GcodeFilter.Pipeline(GcodeFilter.getStages(), 4)
+        pending, buffer, count = 0, b"", 0
+        start = time.time()
+        with GcodeFile.GcodeFile(path) as f:
+            for i, line in pipeline.process(f.getLines()):
+                port.write(line + b"\n")
+                pending += 1
+                count += 1
+                while pending >= window:
+                    buffer += port.read(max(1, port.in_waiting))
+                    pending -= buffer.count(b"\n")
+                    buffer = buffer[buffer.rfind(b"\n") + 1:]
+        while pending > 0:
+            buffer += port.read(max(1, port.in_waiting))
+            pending -= buffer.count(b"\n")
+            buffer = buffer[buffer.rfind(b"\n") + 1:]
+        elapsed = time.time() - start
+        port.close()
+        print("simulator {}: {} lines in {:.3f}s, {:.0f} lines/s".format(
+              os.path.basename(path), count, elapsed, count / elapsed))
+
+
+def benchLoop(url="loop://", total=1 << 24):
+    """ MB/s through a loop:// port (or the second endpoint of a crossed
+        pair) with a writer thread and a reader sized on in_waiting """
+    import serial
+    port = serial.serial_for_url(url, timeout=0.05)
+    peer = port
+    if url.endswith("/0"):
+        peer = serial.serial_for_url(url[:-1] + "1", timeout=0.05)
+    chunk = b"G1X10.000Y20.000Z-1.000\n" * 40
+    def write():
+        sent = 0
+        while sent < total:
+            peer.write(chunk)
+            sent += len(chunk)
+    writer = threading.Thread(target=write)
+    start = time.time()
+    writer.start()
+    received, reads = 0, 0
+    while received < total:
+        received += len(port.read(max(1, port.in_waiting)))
+        reads += 1
+    elapsed = time.time() - start
+    writer.join()
+    for p in set([port, peer]):
+        p.close()
+    print("loop {}: {:.1f} MB/s, {:.0f} bytes per read".format(
+          url, received / elapsed / 1e6, float(received) / reads))
+
+
+def benchReceive(total=1 << 25):
+    """ CPU time per MB to receive and split lines from a pty, written as
+        fast as possible by a forked process: serial.read(in_waiting) with
+        bytes split (previous reactor path) against read_available_into a
+        ReceiveRing split in place (needs PySide for the reactor module) """
+    import pty, select, serial, tty
+    from App import PySerialReactor
+    line = b'{"sr":{"line":1234,"posx":12.345,"posy":23.456,"posz":-1.000,"stat":5}}\n'
+
+    def copying(port):
+        buf, count = b"", 0
+        while True:
+            select.select([port.fileno()], [], [])
+            buf += port.read(max(1, port.in_waiting))
+            lines = buf.split(b"\n")
+            buf = lines.pop()
+            count += len(lines)
+            for l in lines:
+                (l + b"\n").decode("utf-8", "replace")
+            if count * len(line) >= total:
+                return
+
+    def ring(port):
+        ring, count = PySerialReactor.ReceiveRing(), 0
+        while True:
+            select.select([port.fileno()], [], [])
+            ring.fill(port)
+            count += len(ring.split(b"\n"))
+            if count * len(line) >= total:
+                return
+
+    for name, reader in (("read copy", copying), ("ring", ring)):
+        master, slave = pty.openpty()
+        tty.setraw(master)
+        port = serial.Serial(os.ttyname(slave), dsrdtr=True, rtscts=True)
+        writer = os.fork()
+        if writer == 0:
+            os.close(slave)
+            try:
+                chunk = line * 1000
+                for i in range(total // len(chunk) + 1):
+                    os.write(master, chunk)
+            except OSError:
+                pass
+            finally:
+                os._exit(0)
+        os.close(master)
+        times, start = os.times(), time.time()
+        reader(port)
+        cpu = sum(os.times()[:2]) - sum(times[:2])
+        elapsed = time.time() - start
+        port.close()
+        os.close(slave)
+        os.kill(writer, signal.SIGTERM)
+        os.waitpid(writer, 0)
+        print("receive {}: {:.1f} MB/s, {:.1f} ms CPU per MB".format(
+              name, total / elapsed / 1e6, cpu * 1000 / (total / 1e6)))
+
+
+def benchReadMode(total=1 << 20, rate=1000000, chunk=16, size=64):
+    """ System calls per MB to receive status lines on a pty, written at rate
+        bytes/s in chunk bytes pieces like an UART FIFO: timed serial.read
+        (previous SerialReader), select with in_waiting sized reads, select
+        with ReceiveRing reads and the VMin mode (tty waking up the reader
+        with size bytes waiting). Calls are counted at the os/select/fcntl
+        level of serialposix. """
+    import pty, select, serial, termios, tty
+    from serial import serialposix
+    from App import PySerialReactor
+    line = b'{"sr":{"line":1234,"posx":12.345,"posy":23.456,"posz":-1.000,"stat":5}}\n'
+    calls = [0]
+
+    class Counting(object):
+        def __init__(self, module, *names):
+            self.module, self.names = module, names
+        def __getattr__(self, name):
+            attr = getattr(self.module, name)
+            if name not in self.names:
+                return attr
+            def counted(*args):
+                calls[0] += 1
+                return attr(*args)
+            return counted
+
+    def timed(port, fd):
+        received = 0
+        while received < total:
+            received += len(port.read(io.DEFAULT_BUFFER_SIZE))
+
+    def inWaiting(port, fd):
+        received = 0
+        while received < total:
+            calls[0] += 1
+            select.select([fd], [], [])
+            received += len(port.read(max(1, port.in_waiting)))
+
+    def ring(port, fd, timeout=None):
+        ring, received = PySerialReactor.ReceiveRing(), 0
+        while received < total:
+            calls[0] += 1
+            select.select([fd], [], [], timeout)
+            received += ring.fill(port)
+            ring.split(b"\n")
+
+    def vmin(port, fd):
+        attr = termios.tcgetattr(fd)
+        attr[6][termios.VMIN] = size
+        attr[6][termios.VTIME] = 0
+        termios.tcsetattr(fd, termios.TCSANOW, attr)
+        ring(port, fd, port.timeout)
+
+    modules = serialposix.os, serialposix.select, serialposix.fcntl, serialposix.readv
+    serialposix.os = Counting(os, "read")
+    serialposix.select = Counting(select, "select")
+    serialposix.fcntl = Counting(serialposix.fcntl, "ioctl")
+    serialposix.readv = Counting(serialposix, "readv").__getattr__("readv")
+    try:
+        for name, reader in (("timed read", timed), ("in_waiting", inWaiting),
+                             ("ring", ring), ("vmin {}".format(size), vmin)):
+            master, slave = pty.openpty()
+            tty.setraw(master)
+            port = serial.Serial(os.ttyname(slave), timeout=0.05, dsrdtr=True, rtscts=True)
+            writer = os.fork()
+            if writer == 0:
+                os.close(slave)
+                try:
+                    data, start = line * (total // len(line) + 2), time.time()
+                    for i in range(0, len(data), chunk):
+                        os.write(master, data[i:i + chunk])
+                        delay = start + (i + chunk) / float(rate) - time.time()
+                        if delay > 0:
+                            time.sleep(delay)
+                except OSError:
+                    pass
+                finally:
+                    os._exit(0)
+            os.close(master)
+            calls[0] = 0
+            reader(port, port.fileno())
+            count = calls[0]
+            port.close()
+            os.close(slave)
+            os.kill(writer, signal.SIGTERM)
+            os.waitpid(writer, 0)
+            print("read {}: {:.0f} system calls per MB".format(
+                  name, count / (total / 1e6)))
+    finally:
+        serialposix.os, serialposix.select, serialposix.fcntl, serialposix.readv = modules
+
+
+if __name__ == "__main__":
+    stream = readStream(sys.argv[1]) if len(sys.argv) > 1 else getStatusStream()
+    benchClassifier(stream)
+    examples = os.path.join(os.path.dirname(__file__), "..", "Examples", "*.ncc")
+    benchFilter(sorted(glob.glob(examples)))
+    benchSimulator(sorted(glob.glob(examples)))
+    benchLoop()
+    benchLoop("loop://bench/0")
+    try:
+        benchRealtime()
+        benchDualPort(stream=False)
+        benchDualPort(shared=True)
+        benchDualPort()
+        benchReceive()
+        benchReadMode()
+    except ImportError as e:
+        print("realtime: skipped ({})".format(e))
@@ -54,7 +54,7 @@ class DocumentObserver(QtCore.QObject):
         if Script.getObjectType(obj) == "App::UsbPool" and\
            obj.Proxy.Machine.isRunning():
             obj.Proxy.Machine.halt()
-            obj.Proxy.Machine.pool.waitForDone()
+            obj.Proxy.Machine.waitForDone()
 
     def slotChangedObject(self, obj, prop):
         pass
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" Disk cache of preprocessed G-code jobs """
+from __future__ import unicode_literals
+
+import glob, hashlib, io, json, mmap, os, struct, threading
+from App import GcodeFile
+
+
+index = struct.Struct(b"<Q")
+chunk = 1 << 24
+
+
+def getHash(path):
+    """ Content hash of the file (sha1) """
+    h = hashlib.sha1()
+    with io.open(path, "rb") as f:
+        for data in iter(lambda: f.read(chunk), b""):
+            h.update(data)
+    return h.hexdigest()
+
+
+class SourceJob(object):
+    """ Job preprocessed on the fly, without cache """
+
+    def __init__(self, path, pipeline):
+        self.file = GcodeFile.GcodeFile(path)
+        self.pipeline = pipeline
+        self.total = len(self.file)
+        self.cached = False
+
+    def getLines(self, start=0):
+        return self.pipeline.process(self.file.getLines(start), start)
+
+    def close(self, done=False):
+        self.file.close()
+
+
+class RecordingJob(SourceJob):
+    """ Job preprocessed on the fly and recorded in the cache: the entry is
+        only published if the whole file went through (close(True)). """
+
+    def __init__(self, cache, key, digest, path, pipeline):
+        SourceJob.__init__(self, path, pipeline)
+        self.cache = cache
+        self.key = key
+        self.digest = digest
+        self.suffix = ".{}-{}.tmp".format(os.getpid(), threading.current_thread().ident)
+        self.data = io.open(cache.getPath(key, ".nc") + self.suffix, "wb")
+        self.map = io.open(cache.getPath(key, ".map") + self.suffix, "wb")
+        self.done = False
+
+    def getLines(self, start=0):
+        if start:
+            # A partial run can't be recorded
+            for i, line in SourceJob.getLines(self, start):
+                yield i, line
+            return
+        for i, line in SourceJob.getLines(self):
+            self.data.write(line + b"\n")
+            self.map.write(index.pack(i))
+            yield i, line
+        self.done = True
+
+    def close(self, done=False):
+        SourceJob.close(self)
+        self.data.close()
+        self.map.close()
+        s = self.pipeline.statistics
+        meta = {"total": self.total, "hash": self.digest,
+                "statistics": [s.linesIn, s.linesOut, s.bytesIn, s.bytesOut]}
+        for ext in (".nc", ".map"):
+            path = self.cache.getPath(self.key, ext)
+            try:
+                if done and self.done:
+                    os.rename(path + self.suffix, path)
+                else:
+                    os.remove(path + self.suffix)
+            except OSError:
+                pass
+        if done and self.done:
+            with io.open(self.cache.getPath(self.key, ".json"), "wb") as f:
+                f.write(json.dumps(meta).encode("utf-8"))
+            self.cache.evict()
+
+
+class CachedJob(object):
+    """ Job read back from the cache: no preprocessing, the line index of the
+        cached file is built once and kept with it. """
+
+    def __init__(self, cache, key, pipeline):
+        with io.open(cache.getPath(key, ".json"), "rb") as f:
+            meta = json.loads(f.read().decode("utf-8"))
+        self.total = meta["total"]
+        s = pipeline.statistics
+        s.linesIn, s.linesOut, s.bytesIn, s.bytesOut = meta["statistics"]
+        self.file = GcodeFile.GcodeFile(cache.getPath(key, ".nc"))
+        self.mapfile = io.open(cache.getPath(key, ".map"), "rb")
+        size = os.fstat(self.mapfile.fileno()).st_size
+        self.map = mmap.mmap(self.mapfile.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.cached = True
+        cache.touch(key)
+
+    def getIndex(self, line):
+        return index.unpack_from(self.map, line * index.size)[0]
+
+    def findLine(self, start):
+        """ First cached line coming from file line start or after """
+        low, high = 0, len(self.file)
+        while low < high:
+            middle = (low + high) // 2
+            if self.getIndex(middle) < start:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def getLines(self, start=0):
+        first = self.findLine(start) if start else 0
+        for i, line in enumerate(self.file.getLines(first), first):
+            yield self.getIndex(i), bytes(line).rstrip(b"\r\n")
+
+    def close(self, done=False):
+        self.file.close()
+        if self.map is not None:
+            self.map.close()
+        self.mapfile.close()
+
+
+class JobCache(object):
+    """ Preprocessed jobs keyed by file content hash plus preprocessing
+        settings, evicted least recently used first above size bytes.
+        The hash of a file is remembered with its size and mtime so it
+        is only computed again when the file changes: the hashes are read
+        once, written when one is added, and those of files without a job
+        left in the cache are dropped on eviction. """
+
+    def __init__(self, folder, size):
+        self.folder = folder
+        self.size = size
+        self.lock = threading.Lock()
+        self.hashes = None      # path: [size, mtime (ns), hash]
+        self.registry = os.path.join(folder, "hashes.json")
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    def getPath(self, key, ext):
+        return os.path.join(self.folder, key + ext)
+
+    def getHashes(self):
+        """ Hashes of the files, read on first use (lock held) """
+        if self.hashes is None:
+            self.hashes = {}
+            try:
+                with io.open(self.registry, "rb") as f:
+                    self.hashes = json.loads(f.read().decode("utf-8"))
+            except (IOError, OSError, ValueError):
+                pass
+        return self.hashes
+
+    def saveHashes(self):
+        with io.open(self.registry, "wb") as f:
+            f.write(json.dumps(self.hashes).encode("utf-8"))
+
+    def getFileHash(self, path):
+        st = os.stat(path)
+        stat = [st.st_size, int(st.st_mtime * 1e9)]
+        with self.lock:
+            hashes = self.getHashes()
+            if path in hashes and hashes[path][:2] == stat:
+                return hashes[path][2]
+        digest = getHash(path)
+        with self.lock:
+            hashes[path] = stat + [digest]
+            self.saveHashes()
+        return digest
+
+    def getKey(self, digest, pipeline):
+        key = "{}:{}".format(digest, pipeline.getKey())
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def open(self, path, pipeline):
+        if self.size <= 0:
+            return SourceJob(path, pipeline)
+        digest = self.getFileHash(path)
+        key = self.getKey(digest, pipeline)
+        if os.path.exists(self.getPath(key, ".json")):
+            try:
+                return CachedJob(self, key, pipeline)
+            except (IOError, OSError, ValueError, KeyError):
+                self.remove(key)
+        return RecordingJob(self, key, digest, path, pipeline)
+
+    def getEntries(self):
+        entries = []
+        for meta in glob.glob(os.path.join(self.folder, "*.json")):
+            key = os.path.splitext(os.path.basename(meta))[0]
+            if key == "hashes":
+                continue
+            files = glob.glob(self.getPath(key, ".*"))
+            size = sum(os.path.getsize(f) for f in files if not f.endswith(".tmp"))
+            entries.append((os.path.getmtime(meta), size, key))
+        return sorted(entries)
+
+    def touch(self, key):
+        os.utime(self.getPath(key, ".json"), None)
+
+    def remove(self, key):
+        for f in glob.glob(self.getPath(key, ".*")):
+            if not f.endswith(".tmp"):
+                try:
+                    os.remove(f)
+                except OSError:
+                    pass
+
+    def getDigests(self, entries):
+        """ File hashes of the cached jobs """
+        digests = set()
+        for mtime, size, key in entries:
+            try:
+                with io.open(self.getPath(key, ".json"), "rb") as f:
+                    digests.add(json.loads(f.read().decode("utf-8"))["hash"])
+            except (IOError, OSError, ValueError, KeyError):
+                pass
+        return digests
+
+    def evict(self):
+        with self.lock:
+            entries = self.getEntries()
+            total = sum(size for mtime, size, key in entries)
+            while entries and total > self.size:
+                mtime, size, key = entries.pop(0)
+                self.remove(key)
+                total -= size
+            hashes = self.getHashes()
+            digests = self.getDigests(entries)
+            pruned = [p for p, value in hashes.items() if value[2] not in digests]
+            if pruned:
+                for path in pruned:
+                    del hashes[path]
+                self.saveHashes()
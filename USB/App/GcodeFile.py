@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" Memory mapped G-code file with a line offset index """
+from __future__ import unicode_literals
+
+import io, mmap, os, struct, tempfile
+from App import GcodeModal
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    buffer
+except NameError:
+    # Python 3
+    def getView(data, start, end):
+        return memoryview(data)[start:end]
+else:
+    # Python 2: mmap has no memoryview support
+    def getView(data, start, end):
+        return buffer(data, start, end - start)
+
+
+header = struct.Struct(b"<8sQQQ")   # magic, file size, file mtime (ns), count
+offset = struct.Struct(b"<Q")
+chunk = 1 << 24
+
+
+def getMtime(path):
+    return int(os.stat(path).st_mtime * 1e9)
+
+def findLines(data, start, end):
+    """ Offsets of the lines beginning in data[start:end] (after a newline) """
+    if numpy is not None:
+        a = numpy.frombuffer(data[start:end], dtype=numpy.uint8)
+        return (numpy.flatnonzero(a == 10) + (start + 1)).astype("<u8").tobytes()
+    offsets = []
+    i = data.find(b"\n", start, end)
+    while i != -1:
+        offsets.append(i + 1)
+        i = data.find(b"\n", i + 1, end)
+    return struct.pack(b"<%dQ" % len(offsets), *offsets)
+
+
+class FileIndex(object):
+    """ Index of a file written once next to it (or in a temporary file if
+        the folder is read only) and memory mapped afterwards. It is built
+        again when the file size or mtime change. """
+
+    magic = None
+    ext = None
+
+    def __init__(self, path, data, size):
+        self.file = self.open(path, data, size)
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.count = header.unpack_from(self.map, 0)[3]
+
+    def open(self, path, data, size):
+        mtime = getMtime(path)
+        try:
+            f = io.open(path + self.ext, "rb")
+            m, s, t, count = header.unpack(f.read(header.size))
+            if m == self.magic and s == size and t == mtime:
+                return f
+            f.close()
+        except (IOError, OSError, struct.error):
+            pass
+        try:
+            f = io.open(path + self.ext, "w+b")
+        except (IOError, OSError):
+            f = tempfile.TemporaryFile()
+        f.write(header.pack(self.magic, size, mtime, 0))
+        count = self.build(f, data, size)
+        f.seek(0)
+        f.write(header.pack(self.magic, size, mtime, count))
+        f.flush()
+        return f
+
+    def build(self, f, data, size):
+        """ Write the index after the header and return its count """
+        raise NotImplementedError
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+class LineIndex(FileIndex):
+    """ Offsets (little endian uint64) of each line start plus the file size """
+
+    magic = b"USBIDX1\0"
+    ext = ".idx"
+
+    def build(self, f, data, size):
+        count = 0
+        if size:
+            f.write(offset.pack(0))
+            count = 1
+        for start in range(0, size, chunk):
+            offsets = findLines(data, start, min(start + chunk, size))
+            f.write(offsets)
+            count += len(offsets) // offset.size
+        # A last line without end of line still ends at file size
+        if size and data[size-1:size] != b"\n":
+            f.write(offset.pack(size))
+            count += 1
+        return max(0, count - 1)
+
+    def getOffset(self, line):
+        return offset.unpack_from(self.map, header.size + line * offset.size)[0]
+
+
+class ModalIndex(FileIndex):
+    """ Modal state checkpoints: the state before line k * every, so the
+        state of any line is rebuilt from at most every lines. """
+
+    magic = b"USBMOD2\0"
+    ext = ".mod"
+    every = 10000
+
+    def __init__(self, path, data, size, index):
+        self.index = index
+        FileIndex.__init__(self, path, data, size)
+
+    def build(self, f, data, size):
+        state = GcodeModal.ModalState()
+        count = 0
+        for line in range(0, self.index.count, self.every):
+            f.write(state.pack())
+            count += 1
+            end = min(line + self.every, self.index.count)
+            state.update(data[self.index.getOffset(line):self.index.getOffset(end)])
+        return count
+
+    def getState(self, line, data):
+        """ Modal state before line (0 based) """
+        k = min(line // self.every, self.count - 1)
+        if k < 0:
+            return GcodeModal.ModalState()
+        size = GcodeModal.ModalState.record.size
+        state = GcodeModal.ModalState.unpack(self.map, header.size + k * size)
+        state.update(data[self.index.getOffset(k * self.every):self.index.getOffset(line)])
+        return state
+
+
+class GcodeFile(object):
+    """ G-code file read through mmap: building the index costs O(file) once,
+        then any line is reached in constant time as a zero-copy slice. """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = io.open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.index = LineIndex(path, self.map, size)
+        # Modal checkpoints are only built (or read) on resume
+        self.modal = None
+
+    def __len__(self):
+        return self.index.count
+
+    def getLine(self, line):
+        """ Zero-copy view of line (0 based) with its end of line """
+        return getView(self.map, self.index.getOffset(line), self.index.getOffset(line + 1))
+
+    def getLines(self, start=0):
+        for line in range(start, len(self)):
+            yield self.getLine(line)
+
+    def getModalState(self, line):
+        """ Modal state before line (0 based) """
+        if self.modal is None:
+            self.modal = ModalIndex(self.path, self.map, len(self.map), self.index)
+        return self.modal.getState(min(line, len(self)), self.map)
+
+    def close(self):
+        self.index.close()
+        if self.modal is not None:
+            self.modal.close()
+        if len(self.map):
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
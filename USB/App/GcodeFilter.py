@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" G-code preprocessing stages run between the file and the uploader """
+from __future__ import unicode_literals
+
+import re
+
+
+comment = re.compile(br"\([^)]*\)|;.*$")
+number = re.compile(br"(?<![A-Za-z])[Nn]\s*\d+")
+space = re.compile(br"\s+")
+word = re.compile(br"([A-Za-z])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+
+motions = (0.0, 1.0, 2.0, 3.0)
+# Other motion group G codes: threading, probing and canned cycles
+cycles = (33.0, 38.2, 38.3, 38.4, 38.5, 73.0, 76.0,
+          80.0, 81.0, 82.0, 83.0, 84.0, 85.0, 86.0, 87.0, 88.0, 89.0)
+# Non modal G codes using axis words for something else than a move
+nonmodals = (4.0, 10.0, 28.0, 28.1, 30.0, 30.1, 53.0, 92.0, 92.1, 92.2, 92.3)
+rounded = b"XYZABCIJKUVWRF"
+
+
+# Each stage is a generator yielding exactly one line (may be empty) for
+# each line received: the pipeline can then number lines from the file.
+
+def stripComments(lines):
+    """ (parenthesised) and ; comments, % program markers """
+    for line in lines:
+        line = comment.sub(b"", line)
+        yield b"" if line.strip() == b"%" else line
+
+def stripLineNumbers(lines):
+    """ N-words (block numbers) """
+    for line in lines:
+        yield number.sub(b"", line)
+
+def compactWhitespace(lines):
+    """ Spaces are not significant in G-code """
+    for line in lines:
+        yield space.sub(b"", line)
+
+def dropModal(lines):
+    """ Motion G-word or F-word repeating the current modal state """
+    motion, feed, inverse = None, None, False
+    for line in lines:
+        words = [(w[0].upper(), float(w[1])) for w in word.findall(line)]
+        gcodes = [v for k, v in words if k == b"G"]
+        if 93.0 in gcodes or 94.0 in gcodes:
+            inverse = 93.0 in gcodes
+        if any(g in nonmodals for g in gcodes) or b"#" in line or b"[" in line:
+            # Passed through untracked (G53 G0 sets the motion, expressions
+            # are not evaluated): the next line keeps all its words
+            motion, feed = None, None
+            yield line
+            continue
+        current = [g for g in gcodes if g in motions]
+        drop = []
+        if len(current) == 1 and current[0] == motion:
+            drop.append((b"G", motion))
+        if current:
+            motion = current[-1]
+        elif any(g in cycles for g in gcodes):
+            motion = None
+        feeds = [v for k, v in words if k == b"F"]
+        if feeds:
+            if feeds[-1] == feed and not inverse:
+                drop.append((b"F", feed))
+            feed = feeds[-1]
+        if drop:
+            def replace(m):
+                if (m.group(1).upper(), float(m.group(2))) in drop:
+                    return b""
+                return m.group(0)
+            line = word.sub(replace, line)
+        yield line
+
+def roundNumbers(lines, precision=4):
+    """ Axis, offset and feed values rounded to precision decimals """
+    def replace(m):
+        if m.group(1).upper() not in rounded:
+            return m.group(0)
+        value = "{:.{}f}".format(float(m.group(2)), precision)
+        if "." in value:
+            value = value.rstrip("0").rstrip(".")
+        if value in ("-0", ""):
+            value = "0"
+        return m.group(1) + value.encode("ascii")
+    for line in lines:
+        yield word.sub(replace, line)
+
+
+stages = (("Comments", stripComments),
+          ("LineNumbers", stripLineNumbers),
+          ("Whitespace", compactWhitespace),
+          ("Modal", dropModal),
+          ("Round", roundNumbers))
+
+def getStages():
+    return [name for name, stage in stages]
+
+
+class Statistics(object):
+
+    def __init__(self):
+        self.linesIn = 0
+        self.linesOut = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+
+    def getSaved(self):
+        return self.bytesIn - self.bytesOut
+
+    def getRatio(self):
+        return 100.0 * self.getSaved() / self.bytesIn if self.bytesIn else 0.0
+
+    def __str__(self):
+        msg = "{} -> {} lines, {} -> {} bytes ({} bytes saved, {:.1f}%)"
+        return msg.format(self.linesIn, self.linesOut, self.bytesIn,
+                          self.bytesOut, self.getSaved(), self.getRatio())
+
+
+class Pipeline(object):
+    """ Chain of the enabled stages, applied in the stages order.
+        process() yields (file line index, line without end of line) and
+        drops lines left empty. Bytes are counted without end of line. """
+
+    def __init__(self, names, precision=4):
+        self.names = [name for name, stage in stages if name in names]
+        self.precision = precision
+        self.statistics = Statistics()
+
+    def getKey(self):
+        """ Settings identity (used to cache preprocessed jobs) """
+        return "{}:{}".format(",".join(self.names), self.precision)
+
+    def count(self, lines):
+        for line in lines:
+            line = bytes(line).rstrip(b"\r\n")
+            self.statistics.linesIn += 1
+            self.statistics.bytesIn += len(line)
+            yield line
+
+    def process(self, lines, start=0):
+        lines = self.count(lines)
+        for name, stage in stages:
+            if name not in self.names:
+                continue
+            if stage is roundNumbers:
+                lines = stage(lines, self.precision)
+            else:
+                lines = stage(lines)
+        for index, line in enumerate(lines, start):
+            line = line.strip()
+            if line:
+                self.statistics.linesOut += 1
+                self.statistics.bytesOut += len(line)
+                yield index, line
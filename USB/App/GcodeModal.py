@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" G-code modal state tracking for resume from line """
+from __future__ import unicode_literals
+
+import re, struct
+from App import GcodeFilter
+
+
+# Comments are matched (and ignored) so words inside them don't count, line
+# ends so the words of a block are applied together
+scan = re.compile(br"(\n)|\([^)\n]*\)|;[^\n]*|([GgMmFfSsXxYyZz])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+# Words of a move, arc offsets alone making a full circle
+move = re.compile(br"\([^)\n]*\)|;[^\n]*|([GgXxYyZzIiJjKkRr])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+
+gcodes = {20.0: "units", 21.0: "units",
+          90.0: "distance", 91.0: "distance",
+          54.0: "offset", 55.0: "offset", 56.0: "offset",
+          57.0: "offset", 58.0: "offset", 59.0: "offset",
+          17.0: "plane", 18.0: "plane", 19.0: "plane",
+          0.0: "motion", 1.0: "motion", 2.0: "motion", 3.0: "motion", 80.0: "motion",
+          93.0: "feedmode", 94.0: "feedmode"}
+mcodes = {3.0: "spindle", 4.0: "spindle", 5.0: "spindle",
+          7.0: "coolant", 8.0: "coolant", 9.0: "coolant"}
+# Non modal codes: axis words that aren't a move, or leave the position unknown
+ignored = (4.0, 10.0)
+lost = (28.0, 28.1, 30.0, 30.1, 53.0, 92.1, 92.2, 92.3)
+axes = ("x", "y", "z")
+unknown = -1.0
+nan = float("nan")
+
+
+def getNumber(value):
+    return "{:.6f}".format(value).rstrip("0").rstrip(".")
+
+def isKnown(value):
+    return value == value
+
+
+class ModalState(object):
+    """ Modal groups and position needed to restart a program in the middle:
+        a group is unknown (-1) until a word of its group has been read. """
+
+    fields = ("units", "distance", "offset", "plane", "motion",
+              "feedmode", "feed", "speed", "spindle", "coolant",
+              "x", "y", "z", "top")
+    record = struct.Struct(b"<%dd" % len(fields))
+
+    def __init__(self, values=None):
+        if values is None:
+            # Positions (mm, work coordinates) are nan until known, top
+            # being the highest Z reached: the program clearance height
+            values = (unknown,) * (len(self.fields) - 4) + (nan,) * 4
+        for field, value in zip(self.fields, values):
+            setattr(self, field, value)
+
+    def getValues(self):
+        return tuple(getattr(self, f) for f in self.fields)
+
+    def pack(self):
+        return self.record.pack(*self.getValues())
+
+    @classmethod
+    def unpack(cls, data, offset=0):
+        return cls(cls.record.unpack_from(data, offset))
+
+    def update(self, data):
+        """ Apply the blocks of data (one or more lines) """
+        words = []
+        for eol, letter, value in scan.findall(data):
+            if eol:
+                self.apply(words)
+                words = []
+            elif letter:
+                words.append((letter.upper(), float(value)))
+        self.apply(words)
+
+    def apply(self, words):
+        """ Apply the words of a block """
+        moves, nonmodal = {}, None
+        for letter, value in words:
+            if letter == b"G":
+                if value in ignored or value in lost or value == 92.0:
+                    nonmodal = value
+                field = gcodes.get(value)
+                if field == "offset" and value != self.offset:
+                    # Same place, other coordinates
+                    self.x = self.y = self.z = nan
+            elif letter == b"M":
+                field = mcodes.get(value)
+            elif letter == b"F":
+                field = "feed"
+            elif letter == b"S":
+                field = "speed"
+            else:
+                moves[letter.decode("ascii").lower()] = value
+                continue
+            if field is not None:
+                setattr(self, field, value)
+        if nonmodal in lost:
+            self.x = self.y = self.z = nan
+            return
+        if not moves or nonmodal in ignored:
+            return
+        scale = 25.4 if self.units == 20.0 else 1.0
+        if nonmodal == 92.0:
+            for axis, value in moves.items():
+                setattr(self, axis, value * scale)
+        elif self.motion in (0.0, 1.0, 2.0, 3.0):
+            for axis, value in moves.items():
+                if self.distance == 91.0:
+                    value = getattr(self, axis) + value * scale
+                else:
+                    value *= scale
+                setattr(self, axis, value)
+        if isKnown(self.z) and not self.top >= self.z:
+            self.top = self.z
+
+    def getPreamble(self):
+        """ Lines restoring this state before its next line. Positioning is
+            done in G90: a rapid to the clearance height (top), to the X Y
+            position, then the spindle and coolant are turned on before the
+            plunge to the Z position (at F if known). G91 is re-applied
+            afterwards. Only G0, G1 and G80 are restored as motion mode: an
+            arc needs its words, G2 or G3 is added to the first resumed move
+            by getLines(). The positioning is skipped while Z is unknown (after G28, G53, G92.x,
+            a work offset change or in G91 from an unknown start). """
+        lines = []
+        words = ["G" + getNumber(getattr(self, f)) for f in ("units", "offset", "plane")
+                 if getattr(self, f) != unknown]
+        lines.append(" ".join(words + ["G90", "G94"]))
+        scale = 25.4 if self.units == 20.0 else 1.0
+        # The tool may be in the material: no X Y move below a known height
+        positioned = isKnown(self.top) and isKnown(self.z)
+        if positioned:
+            lines.append("G0 Z" + getNumber(self.top / scale))
+            words = ["{}{}".format(a.upper(), getNumber(getattr(self, a) / scale))
+                     for a in ("x", "y") if isKnown(getattr(self, a))]
+            if words:
+                lines.append("G0 " + " ".join(words))
+        words = []
+        if self.speed != unknown:
+            words.append("S" + getNumber(self.speed))
+        if self.spindle != unknown:
+            words.append("M" + getNumber(self.spindle))
+        if words:
+            lines.append(" ".join(words))
+        if self.coolant != unknown:
+            lines.append("M" + getNumber(self.coolant))
+        if positioned:
+            z = "Z" + getNumber(self.z / scale)
+            # The feed is in units per minute here, even in G93
+            if self.feed != unknown and self.feedmode != 93.0:
+                lines.append("G1 " + z + " F" + getNumber(self.feed))
+            else:
+                lines.append("G0 " + z)
+        elif self.feed != unknown and self.feedmode != 93.0:
+            lines.append("F" + getNumber(self.feed))
+        words = ["G" + getNumber(getattr(self, f)) for f in ("distance", "feedmode")
+                 if getattr(self, f) in (91.0, 93.0)]
+        if self.motion in (0.0, 1.0, 80.0):
+            words.append("G" + getNumber(self.motion))
+        if words:
+            lines.append(" ".join(words))
+        return lines
+
+    def getLines(self, lines):
+        """ Resumed (index, line) following the preamble: in G2/G3 the plunge
+            left G1 as motion mode, the arc G-word (on an earlier line or
+            dropped by the Modal stage) is added back to the first move """
+        arc = self.motion in (2.0, 3.0)
+        for i, line in lines:
+            if arc:
+                words = [(l.upper(), float(v)) for l, v in move.findall(line) if l]
+                g = [v for l, v in words if l == b"G"]
+                if any(v in GcodeFilter.motions or v in GcodeFilter.cycles for v in g):
+                    arc = False
+                elif any(l != b"G" for l, v in words) and \
+                        not any(v in ignored or v in lost or v == 92.0 for v in g):
+                    line = ("G" + getNumber(self.motion) + " ").encode("ascii") + line
+                    arc = False
+            yield i, line
+
+    def __str__(self):
+        return " ".join(self.getPreamble())
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" Toolpath preview of a whole G-code file: chunks of lines are parsed in
+    a process pool and moves resolved, arcs tessellated, with numpy arrays """
+from __future__ import unicode_literals
+
+from PySide import QtCore
+import math, multiprocessing, os, sys, threading
+from multiprocessing.pool import ThreadPool
+from App import GcodeFile, GcodeModal, PathIndex
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+groups = ("motion", "plane", "units", "distance", "offset")
+defaults = (GcodeModal.unknown, 17.0, 21.0, 90.0, 54.0)     # after a machine reset
+skipped = (4.0, 10.0, 28.0, 30.0, 92.0)     # non modal codes whose words aren't a move
+axes = b"XYZIJKR"
+# Rows of a chunk: line, the modal groups (unknown before the first word of
+# the chunk), G53, then X Y Z I J K R as written (nan if missing)
+columns = 1 + len(groups) + 1 + len(axes)
+wordColumn = len(groups) + 2
+none, absolute, relative = 0, 1, 2
+planes = {17.0: (0, 1, 2), 18.0: (2, 0, 1), 19.0: (1, 2, 0)}
+powers = 10.0 ** numpy.arange(-30, 31) if numpy is not None else None
+
+
+def getLast(mask):
+    """ Index of the last True up to each position (-1 before the first) """
+    return numpy.maximum.accumulate(numpy.where(mask, numpy.arange(len(mask)), -1))
+
+def getWords(data):
+    """ Letters (upper case, a line end being a newline) and values of the
+        words of data, comments and blanks ignored, without a Python loop:
+        a number is the sum of its digits times their power of ten """
+    a = numpy.frombuffer(data + b"\n", numpy.uint8)
+    keep = (a != 32) & (a != 9) & (a != 13)
+    if b"(" in data or b";" in data:
+        lines = getLast(a == 10)
+        close = numpy.concatenate(([-1], getLast(a == 41)[:-1]))
+        opened = getLast(a == 40)
+        keep &= ~(((opened > close) & (opened > lines)) | (getLast(a == 59) > lines))
+    c = a[keep]
+    u = c & 0xDF
+    separator = ((u >= 65) & (u <= 90)) | (c == 10)
+    starts = numpy.flatnonzero(separator)
+    token = numpy.cumsum(separator) - 1
+    digits = numpy.flatnonzero((c >= 48) & (c <= 57) & (token >= 0))
+    dots = numpy.concatenate((starts[1:], [len(c)]))
+    i = numpy.flatnonzero(c == 46)
+    dots[token[i]] = i
+    at = dots[token[digits]]
+    power = at - digits - 1 + (digits > at)
+    weights = (c[digits] - 48) * powers[numpy.clip(power, -30, 30) + 30]
+    values = numpy.bincount(token[digits], weights, len(starts))
+    i = numpy.flatnonzero(c == 45)
+    values[numpy.unique(token[i][token[i] >= 0])] *= -1
+    letters = numpy.where(c[starts] == 10, 10, u[starts])
+    return letters, values
+
+def parseChunk(args):
+    """ Rows of the blocks of lines start to end of a file that may move, and
+        the last value of each modal group in these lines """
+    path, start, end = args
+    with GcodeFile.GcodeFile(path) as f:
+        data = f.map[f.index.getOffset(start):f.index.getOffset(end)]
+    letters, values = getWords(data)
+    eol = letters == 10
+    line = numpy.cumsum(eol) - eol
+    count = int(eol.sum())
+    rows = numpy.full((count, columns), numpy.nan)
+    rows[:, 0] = numpy.arange(start, start + count)
+    for i, axis in enumerate(bytearray(axes)):
+        word = letters == axis
+        rows[line[word], wordColumn + i] = values[word]
+    g = letters == 71
+    lines, codes = line[g], numpy.round(values[g], 1)
+    state = []
+    for i, group in enumerate(groups):
+        word = numpy.isin(codes, [k for k, v in GcodeModal.gcodes.items() if v == group])
+        column = numpy.full(count, GcodeModal.unknown)
+        column[lines[word]] = codes[word]
+        known = getLast(column != GcodeModal.unknown)
+        rows[:, 1 + i] = numpy.where(known < 0, GcodeModal.unknown, column[known])
+        state.append(rows[-1, 1 + i] if count else GcodeModal.unknown)
+    machine = numpy.zeros(count, numpy.bool_)
+    machine[lines[codes == 53.0]] = True
+    rows[:, wordColumn - 1] = machine
+    skip = numpy.zeros(count, numpy.bool_)
+    skip[lines[numpy.isin(codes, skipped)]] = True
+    words = ~numpy.isnan(rows[:, wordColumn:]).all(axis=1)
+    return rows[words & ~skip], tuple(state)
+
+def getPython():
+    """ Python interpreter to start workers with: in FreeCAD sys.executable
+        is usually the FreeCAD binary """
+    executable = sys.executable or ""
+    if os.path.basename(executable).lower().startswith("python"):
+        return executable
+    if sys.platform == "win32":
+        names = ["python.exe"]
+    else:
+        names = ["python{}.{}".format(*sys.version_info[:2]), "python{}".format(sys.version_info[0])]
+    for folder in (sys.exec_prefix, os.path.join(sys.exec_prefix, "bin")):
+        for name in names:
+            path = os.path.join(folder, name)
+            if os.path.isfile(path):
+                return path
+    return None
+
+def getPool(processes):
+    """ Worker processes started from a clean interpreter (forkserver, or
+        spawn): never fork, FreeCAD runs Qt threads. Without start methods
+        (Python 2) or interpreter, a thread pool: numpy releases the GIL on
+        large arrays. """
+    python = getPython()
+    if python is not None and hasattr(multiprocessing, "get_context"):
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        try:
+            context.set_executable(python)
+            return context.Pool(processes)
+        except (OSError, ValueError, ImportError):
+            pass
+    return ThreadPool(processes)
+
+def getChunks(count, processes, size=100000):
+    """ Line ranges: a few chunks per process, at most size lines """
+    size = max(1000, min(size, int(math.ceil(count / float(max(1, processes * 4))))))
+    return [(start, min(start + size, count)) for start in range(0, count, size)]
+
+def getMoves(rows, offsets, origin=54.0):
+    """ Moves of rows whose modal groups are known: motion, plane, X Y Z in
+        mm relative to the origin work offset, X Y Z kinds and I J K R in mm """
+    motion, plane, units, distance, offset = rows[:, 1:wordColumn - 1].T
+    machine = rows[:, wordColumn - 1] > 0
+    words = rows[:, wordColumn:]
+    moved = ~numpy.isnan(words[:, :3]).all(axis=1)
+    arc = ((motion == 2.0) | (motion == 3.0)) & ~numpy.isnan(words[:, 3:]).all(axis=1)
+    valid = numpy.isin(motion, (0.0, 1.0, 2.0, 3.0)) & (moved | arc)
+    rows, motion, plane, machine, words = (rows[valid], motion[valid], plane[valid],
+                                           machine[valid], words[valid])
+    scale = numpy.where(units[valid] == 20.0, 25.4, 1.0)[:, None]
+    words = words * scale
+    table = numpy.array([offsets.get(k, (0.0, 0.0, 0.0)) for k in range(54, 60)], numpy.float64)
+    base = table[int(origin) - 54]
+    shift = table[numpy.clip(offset[valid].astype(int) - 54, 0, 5)] - base
+    shift[machine] = -base
+    missing = numpy.isnan(words[:, :3])
+    incremental = ((distance[valid] == 91.0) & ~machine)[:, None]
+    kinds = numpy.where(missing, none, numpy.where(incremental, relative, absolute))
+    values = numpy.where(missing, 0.0, numpy.where(incremental, words[:, :3], words[:, :3] + shift))
+    return rows[:, 0].astype(numpy.int64), motion, plane, values, kinds, words[:, 3:]
+
+def resolve(values, kinds, start):
+    """ End positions of moves, the first one from start: a relative
+        coordinate adds to the last absolute one of its axis """
+    count = len(values)
+    deltas = numpy.where(kinds == relative, values, 0.0).cumsum(axis=0)
+    last = numpy.where(kinds == absolute, numpy.arange(count)[:, None], -1)
+    last = numpy.maximum.accumulate(last, axis=0)
+    bases = numpy.take_along_axis(values - deltas, numpy.maximum(last, 0), axis=0)
+    return numpy.where(last < 0, numpy.asarray(start)[None, :], bases) + deltas
+
+def getArcs(starts, ends, motions, codes, arcs, tolerance, limit):
+    """ Points of arcs (counts per arc, points from the first step to the
+        end), the three coordinates being permuted to the plane axes """
+    count = len(starts)
+    axes = numpy.array([planes[p] for p in (17.0, 18.0, 19.0)])[codes.astype(int) - 17]
+    rows = numpy.arange(count)[:, None]
+    s, e = starts[rows, axes], ends[rows, axes]
+    ijk = numpy.nan_to_num(arcs[:, :3])[rows, axes]
+    radius = arcs[:, 3]
+    ccw = motions == 3.0
+    center = s[:, :2] + ijk[:, :2]
+    # Radius format: center on the side given by direction and sign of R
+    r = ~numpy.isnan(radius)
+    if r.any():
+        chord = e[r, :2] - s[r, :2]
+        length = numpy.hypot(chord[:, 0], chord[:, 1])
+        safe = numpy.where(length > 0, length, 1.0)
+        h = numpy.sqrt(numpy.maximum(radius[r] ** 2 - (length / 2) ** 2, 0.0))
+        side = numpy.where(ccw[r], 1.0, -1.0) * numpy.sign(radius[r])
+        normal = numpy.column_stack((-chord[:, 1], chord[:, 0])) / safe[:, None]
+        center[r] = (s[r, :2] + e[r, :2]) / 2 + normal * (side * h)[:, None]
+    a = s[:, :2] - center
+    b = e[:, :2] - center
+    size = numpy.hypot(a[:, 0], a[:, 1])
+    sweep = numpy.arctan2(b[:, 1], b[:, 0]) - numpy.arctan2(a[:, 1], a[:, 0])
+    two = 2 * math.pi
+    sweep = numpy.where(ccw, numpy.mod(sweep, two), -numpy.mod(-sweep, two))
+    # Same start and end is a full circle
+    sweep = numpy.where(numpy.abs(sweep) < 1e-9, numpy.where(ccw, two, -two), sweep)
+    step = 2 * numpy.arccos(numpy.clip(1 - tolerance / numpy.maximum(size, 1e-12), -1.0, 1.0))
+    counts = numpy.clip(numpy.ceil(numpy.abs(sweep) / numpy.maximum(step, 1e-6)), 1, limit).astype(numpy.int64)
+    arc = numpy.repeat(numpy.arange(count), counts)
+    t = (numpy.arange(counts.sum()) - numpy.repeat(counts.cumsum() - counts, counts) + 1)
+    t = t / counts[arc].astype(numpy.float64)
+    angle = numpy.arctan2(a[arc, 1], a[arc, 0]) + t * sweep[arc]
+    points = numpy.empty((len(arc), 3))
+    points[:, 0] = center[arc, 0] + size[arc] * numpy.cos(angle)
+    points[:, 1] = center[arc, 1] + size[arc] * numpy.sin(angle)
+    points[:, 2] = s[arc, 2] + t * (e[arc, 2] - s[arc, 2])
+    # Back to X Y Z, the arc end being exact
+    out = numpy.empty_like(points)
+    out[numpy.arange(len(arc))[:, None], axes[arc]] = points
+    last = counts.cumsum() - 1
+    out[last] = ends
+    return counts, out
+
+
+class Preview(object):
+    """ Toolpath of a G-code file: points is a polyline (float32) starting at
+        the start position, lines the source line (0 based) of each point,
+        the segment ending at a point belonging to its line. Rapid moves
+        are flagged by rapids. Arcs are tessellated within tolerance (mm).
+        Points are in the work coordinates of the first offset the program
+        moves in (origin), like the status report positions (posx...) while
+        it runs: the other work offsets and G53 moves are placed from their
+        offsets (mm, {54.0: (x, y, z)}) relative to it. """
+
+    def __init__(self, path, offsets=None, start=(0.0, 0.0, 0.0), tolerance=0.01,
+                 processes=None, limit=4096):
+        if numpy is None:
+            raise ImportError("G-code preview needs numpy")
+        self.path = path
+        self.offsets = offsets or {}
+        self.origin = None
+        self.tolerance = max(tolerance, 1e-4)
+        self.limit = limit
+        self.position = numpy.array(start, numpy.float64)
+        self.parts = [(numpy.array([start], numpy.float32), numpy.array([-1], numpy.int64),
+                       numpy.zeros(1, numpy.bool_))]
+        with GcodeFile.GcodeFile(path) as f:
+            # Builds the line index read by the workers
+            count = len(f)
+        processes = processes or multiprocessing.cpu_count()
+        self.build(getChunks(count, processes), processes)
+        points, lines, rapids = zip(*self.parts)
+        self.points = numpy.concatenate(points)
+        self.lines = numpy.concatenate(lines)
+        self.rapids = numpy.concatenate(rapids)
+        self.index = None
+        del self.parts
+
+    def build(self, chunks, processes):
+        pool = None
+        if processes > 1 and len(chunks) > 1:
+            pool = getPool(processes)
+        mapper = pool.imap if pool is not None else map
+        state = numpy.array(defaults)
+        try:
+            for rows, last in mapper(parseChunk, [(self.path, s, e) for s, e in chunks]):
+                # Modal groups unknown in a chunk come from the previous ones
+                known = rows[:, 1:wordColumn - 1]
+                rows[:, 1:wordColumn - 1] = numpy.where(known == GcodeModal.unknown, state, known)
+                last = numpy.array(last)
+                state = numpy.where(last == GcodeModal.unknown, state, last)
+                if self.origin is None and len(rows):
+                    self.origin = rows[0, 1 + groups.index("offset")]
+                self.addMoves(*getMoves(rows, self.offsets, self.origin or 54.0))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def addMoves(self, lines, motions, codes, values, kinds, arcs):
+        """ Points of moves, continuing from the last position """
+        if not len(lines):
+            return
+        ends = resolve(values, kinds, self.position)
+        starts = numpy.vstack((self.position[None, :], ends[:-1]))
+        self.position = ends[-1]
+        counts = numpy.ones(len(lines), numpy.int64)
+        arc = (motions == 2.0) | (motions == 3.0)
+        if arc.any():
+            steps, arcPoints = getArcs(starts[arc], ends[arc], motions[arc], codes[arc],
+                                       arcs[arc], self.tolerance, self.limit)
+            counts[arc] = steps
+        begin = counts.cumsum() - counts
+        points = numpy.empty((counts.sum(), 3))
+        points[begin[~arc]] = ends[~arc]
+        if arc.any():
+            at = numpy.repeat(begin[arc], steps) + (numpy.arange(steps.sum()) -
+                                                    numpy.repeat(steps.cumsum() - steps, steps))
+            points[at] = arcPoints
+        self.parts.append((points.astype(numpy.float32), numpy.repeat(lines, counts),
+                           numpy.repeat(motions == 0.0, counts)))
+
+    def __len__(self):
+        return len(self.points)
+
+    def getBounds(self):
+        return self.points.min(axis=0), self.points.max(axis=0)
+
+    def getIndex(self):
+        """ Spatial index of the segments, built once """
+        if self.index is None:
+            self.index = PathIndex.SegmentIndex(self.points)
+        return self.index
+
+    def pick(self, point):
+        """ Line (0 based), its byte offset in the file and the distance of
+            the segment nearest to point, None without segment """
+        found = self.getIndex().query(point)
+        if found is None:
+            return None
+        i, distance = found
+        line = int(self.lines[i])
+        with GcodeFile.GcodeFile(self.path) as f:
+            offset = f.index.getOffset(line)
+        return line, offset, distance
+
+
+class Previewer(QtCore.QObject):
+    """ Build a Preview in the global thread pool: callback(preview, error)
+        is called in the GUI thread. A preview requested while another is
+        being built is built once that one is done. """
+
+    ready = QtCore.Signal(object, object)
+
+    def __init__(self, callback):
+        QtCore.QObject.__init__(self)
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.busy = False
+        self.request = None
+        self.ready.connect(self.onReady, QtCore.Qt.QueuedConnection)
+
+    def update(self, path, **kwargs):
+        with self.lock:
+            self.request = (path, kwargs)
+            if self.busy:
+                return
+            self.busy = True
+        QtCore.QThreadPool.globalInstance().start(PreviewUpdate(self))
+
+    def take(self):
+        with self.lock:
+            request, self.request = self.request, None
+            if request is None:
+                self.busy = False
+            return request
+
+    @QtCore.Slot(object, object)
+    def onReady(self, preview, error):
+        self.callback(preview, error)
+
+
+class PreviewUpdate(QtCore.QRunnable):
+
+    def __init__(self, previewer):
+        QtCore.QRunnable.__init__(self)
+        self.previewer = previewer
+
+    def run(self):
+        """ Build the last requested preview until none is left """
+        request = self.previewer.take()
+        while request is not None:
+            path, kwargs = request
+            try:
+                preview = Preview(path, **kwargs)
+                preview.getIndex()
+                self.previewer.ready.emit(preview, None)
+            except Exception as e:
+                self.previewer.ready.emit(None, e)
+            request = self.previewer.take()
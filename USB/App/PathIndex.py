@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" Spatial index of the segments of a polyline, to find the segment (and
+    its G-code line) nearest to a picked point """
+from __future__ import unicode_literals
+
+import math
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def getDistances(points, starts, ends):
+    """ Distances of points to segments (vectorized) """
+    ab = ends - starts
+    ap = points - starts
+    l2 = (ab * ab).sum(axis=1)
+    t = numpy.clip((ap * ab).sum(axis=1) / numpy.where(l2 > 0, l2, 1.0), 0.0, 1.0)
+    d = ap - ab * t[:, None]
+    return numpy.sqrt((d * d).sum(axis=1))
+
+
+def getCodes(cells):
+    """ Morton (Z-order) codes of cells (21 bits per axis): the cells of a
+        coarser grid, 2 ** j cells wide, are contiguous ranges of codes """
+    codes = numpy.zeros(len(cells), numpy.int64)
+    for axis in range(3):
+        v = cells[:, axis].astype(numpy.int64) & 0x1FFFFF
+        v = (v | (v << 32)) & 0x1F00000000FFFF
+        v = (v | (v << 16)) & 0x1F0000FF0000FF
+        v = (v | (v << 8)) & 0x100F00F00F00F00F
+        v = (v | (v << 4)) & 0x10C30C30C30C30C3
+        v = (v | (v << 2)) & 0x1249249249249249
+        codes |= v << axis
+    return codes
+
+
+class SegmentIndex(object):
+    """ Bounding box hierarchy over the segments of a polyline: segment i
+        goes from points[i-1] to points[i]. Segments are sorted by the Morton
+        code of their midpoint, leaf consecutive ones in a leaf box, and a
+        box of a level bounds fanout boxes of the level below. A query walks
+        the levels down, keeping the boxes nearer than the farthest corner
+        of the nearest one: it only reads the segments around the pick,
+        whatever its distance to the path. """
+
+    leaf = 16   # segments per leaf box
+    fanout = 8  # boxes per box of the level above
+
+    def __init__(self, points):
+        if numpy is None:
+            raise ImportError("Segment index needs numpy")
+        self.points = numpy.asarray(points, numpy.float64)
+        count = len(self)
+        starts, ends = self.points[:-1], self.points[1:]
+        self.lows, self.highs = [], []
+        if not count:
+            return
+        low = self.points.min(axis=0)
+        extent = max(float((self.points.max(axis=0) - low).max()), 1e-12)
+        cells = numpy.floor(((starts + ends) / 2 - low) * (((1 << 21) - 1) / extent))
+        self.order = numpy.argsort(getCodes(cells.astype(numpy.int64)), kind="mergesort")
+        lows = numpy.minimum(starts, ends)[self.order]
+        highs = numpy.maximum(starts, ends)[self.order]
+        at = numpy.arange(0, count, self.leaf)
+        while True:
+            lows = numpy.minimum.reduceat(lows, at)
+            highs = numpy.maximum.reduceat(highs, at)
+            self.lows.insert(0, lows)
+            self.highs.insert(0, highs)
+            if len(lows) == 1:
+                break
+            at = numpy.arange(0, len(lows), self.fanout)
+
+    def __len__(self):
+        return max(0, len(self.points) - 1)
+
+    def getSegments(self, leaves):
+        """ Segments of leaves, sorted """
+        first = leaves * self.leaf
+        counts = numpy.minimum(first + self.leaf, len(self)) - first
+        at = numpy.repeat(first - counts.cumsum() + counts, counts) + numpy.arange(int(counts.sum()))
+        return self.order[at]
+
+    def getNearest(self, segments, point):
+        starts, ends = self.points[segments], self.points[segments + 1]
+        distances = getDistances(point[None, :], starts, ends)
+        i = int(distances.argmin())
+        return int(segments[i]) + 1, float(distances[i])
+
+    def query(self, point):
+        """ Index (1 based, the end point of the segment) and distance of the
+            segment nearest to point, None for a polyline without segment """
+        if not len(self):
+            return None
+        point = numpy.asarray(point, numpy.float64)
+        nodes = numpy.zeros(1, numpy.int64)
+        for level, (lows, highs) in enumerate(zip(self.lows, self.highs)):
+            if level:
+                nodes = (self.fanout * nodes[:, None] + numpy.arange(self.fanout)).ravel()
+                nodes = nodes[nodes < len(lows)]
+            low, high = lows[nodes], highs[nodes]
+            near = numpy.maximum(numpy.maximum(low - point, point - high), 0.0)
+            near = numpy.sqrt((near * near).sum(axis=1))
+            far = numpy.maximum(numpy.abs(point - low), numpy.abs(point - high))
+            bound = numpy.sqrt((far * far).sum(axis=1)).min()
+            if level == len(self.lows) - 1:
+                # The segments of the nearest leaf give a closer bound
+                bound = self.getNearest(self.getSegments(nodes[near.argmin():][:1]), point)[1]
+            nodes = nodes[near <= bound]
+        return self.getNearest(self.getSegments(nodes), point)
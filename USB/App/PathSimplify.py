@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" Toolpath simplification: streaming Douglas-Peucker levels of detail of a
+    PositionStore, computed off the GUI thread """
+from __future__ import unicode_literals
+
+from PySide import QtCore
+import FreeCAD, math, threading
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def getDistances(points, first, last):
+    """ Distances of points[first+1:last] to the segment first-last """
+    if numpy is not None:
+        a, b = points[first], points[last]
+        ab = b - a
+        p = points[first + 1:last] - a
+        l2 = float(numpy.dot(ab, ab))
+        if l2 > 0:
+            t = numpy.clip(p.dot(ab) / l2, 0.0, 1.0)
+            p = p - numpy.outer(t, ab)
+        return numpy.sqrt((p * p).sum(axis=1))
+    a, b = points[first], points[last]
+    ab = [b[i] - a[i] for i in range(3)]
+    l2 = sum(v * v for v in ab)
+    distances = []
+    for q in points[first + 1:last]:
+        p = [q[i] - a[i] for i in range(3)]
+        if l2 > 0:
+            t = min(1.0, max(0.0, sum(p[i] * ab[i] for i in range(3)) / l2))
+            p = [p[i] - t * ab[i] for i in range(3)]
+        distances.append(math.sqrt(sum(v * v for v in p)))
+    return distances
+
+def simplify(points, tolerance):
+    """ Sorted indices of the points kept by Douglas-Peucker (first and last
+        are always kept) """
+    count = len(points)
+    if count < 3:
+        return list(range(count))
+    keep, stack = [0, count - 1], [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distances = getDistances(points, first, last)
+        if numpy is not None:
+            i = int(distances.argmax())
+        else:
+            i = distances.index(max(distances))
+        if distances[i] > tolerance:
+            i += first + 1
+            keep.append(i)
+            stack.append((first, i))
+            stack.append((i, last))
+    return sorted(keep)
+
+def concatenate(parts):
+    if numpy is not None:
+        parts = [p for p in parts if len(p)]
+        return numpy.concatenate(parts) if parts else numpy.empty((0, 3), numpy.float32)
+    return [p for part in parts for p in part]
+
+def thin(points, size):
+    """ At most size points: every n-th point and the last one """
+    count = len(points)
+    if size < 2 or count <= size:
+        return points
+    step = int(math.ceil((count - 1) / float(size - 1)))
+    if numpy is not None:
+        return numpy.concatenate((points[:-1:step], points[-1:]))
+    return points[:-1:step] + points[-1:]
+
+
+class Simplifier(object):
+    """ Simplify a growing store by blocks: a block is simplified once it is
+        complete, its last point starting the next block, and the raw points
+        of the incomplete block follow the simplified ones. The store keeps
+        the raw points. As every block keeps its first point, there are at
+        least len(store) / block points whatever the tolerance: a floored
+        simplifier keeps its points so that they can be thinned instead. """
+
+    block = 4096    # raw points per simplified block
+
+    def __init__(self, store, tolerance):
+        self.store = store
+        self.tolerance = tolerance
+        self.reset()
+
+    def reset(self):
+        self.anchor = 0     # store index of the first point not simplified
+        self.count = 0      # simplified points
+        self.floored = False
+        self.parts = []     # simplified points, kept once floored
+
+    def update(self):
+        """ Points simplified since the last update """
+        parts = []
+        count = len(self.store)
+        while count - self.anchor > self.block:
+            stop = self.anchor + self.block + 1
+            points = self.store.getPoints(self.anchor, stop)
+            keep = simplify(points, self.tolerance)[:-1]
+            if numpy is not None:
+                parts.append(points[keep])
+            else:
+                parts.append([points[i] for i in keep])
+            self.count += len(keep)
+            self.anchor = stop - 1
+        if self.floored:
+            self.parts.extend(parts)
+        return parts
+
+    def floor(self, parts):
+        """ The tolerance no longer lowers the count: keep the points """
+        self.floored = True
+        self.parts = list(parts)
+
+    def getTail(self):
+        """ Raw points of the incomplete block """
+        return self.store.getPoints(self.anchor)
+
+
+class Level(object):
+    """ Change of a level: points to write from index start (the new
+        simplified points and the raw tail), count points in all. A reset
+        level is written again from 0. """
+
+    def __init__(self, start, points, count, reset=False):
+        self.start = start
+        self.points = points
+        self.count = count
+        self.reset = reset
+
+
+class Levels(QtCore.QObject):
+    """ Levels of detail of a store, tolerance growing by factor from one
+        level to the next. update() runs the simplifiers in the global thread
+        pool, callback(levels, bounds) is called in the GUI thread with the
+        change (Level) of every level and the bounds of the path: each update
+        only costs the points added since the last one. A level over
+        maxPoints is simplified again with twice its tolerance, until doubling
+        no longer lowers its count: the level is then thinned by stride. """
+
+    ready = QtCore.Signal(list, list)
+
+    def __init__(self, store, tolerance, callback, count=3, factor=8):
+        QtCore.QObject.__init__(self)
+        self.simplifiers = [Simplifier(store, tolerance * factor ** i) for i in range(count)]
+        self.store = store
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.busy = False
+        self.again = False
+        self.closed = False
+        self.maxPoints = 0
+        self.bounds = []
+        self.bounded = 0    # store points in bounds
+        self.ready.connect(self.onReady, QtCore.Qt.QueuedConnection)
+
+    def update(self, maxPoints):
+        with self.lock:
+            self.maxPoints = maxPoints
+            if self.busy:
+                # Run again once the current update is done
+                self.again = True
+                return
+            self.busy = True
+        QtCore.QThreadPool.globalInstance().start(LevelsUpdate(self))
+
+    def close(self):
+        """ Updates still queued are not passed to the callback """
+        self.closed = True
+
+    def getLevels(self):
+        levels = []
+        for simplifier in self.simplifiers:
+            start = simplifier.count
+            parts = simplifier.update()
+            reset = False
+            while 1 < self.maxPoints < simplifier.count and not simplifier.floored:
+                count = simplifier.count
+                simplifier.tolerance *= 2
+                simplifier.reset()
+                reset, start, parts = True, 0, simplifier.update()
+                if simplifier.count >= count:
+                    simplifier.floor(parts)
+            tail = simplifier.getTail()
+            if simplifier.floored and 1 < self.maxPoints < simplifier.count + len(tail):
+                points = thin(concatenate(simplifier.parts + [tail]), self.maxPoints)
+                levels.append(Level(0, points, len(points), True))
+                continue
+            points = concatenate(parts + [tail])
+            levels.append(Level(start, points, simplifier.count + len(tail), reset))
+        return levels
+
+    def getBounds(self):
+        """ Bounds (low, high) of the store, updated with the new points """
+        points = self.store.getPoints(self.bounded)
+        self.bounded += len(points)
+        if len(points):
+            if numpy is not None:
+                bounds = [points.min(axis=0).tolist(), points.max(axis=0).tolist()]
+            else:
+                bounds = [[min(p[i] for p in points) for i in range(3)],
+                          [max(p[i] for p in points) for i in range(3)]]
+            if self.bounds:
+                bounds = [[min(a, b) for a, b in zip(self.bounds[0], bounds[0])],
+                          [max(a, b) for a, b in zip(self.bounds[1], bounds[1])]]
+            self.bounds = bounds
+        return self.bounds
+
+    @QtCore.Slot(list, list)
+    def onReady(self, levels, bounds):
+        if not self.closed:
+            self.callback(levels, bounds)
+
+    def levelsErrorMsg(self, e):
+        msg = "Error occurred in toolpath simplification: {}\n"
+        FreeCAD.Console.PrintError(msg.format(e))
+
+
+class LevelsUpdate(QtCore.QRunnable):
+
+    def __init__(self, levels):
+        QtCore.QRunnable.__init__(self)
+        self.levels = levels
+
+    def run(self):
+        """ Simplify the new points of every level """
+        levels = self.levels
+        while True:
+            try:
+                levels.ready.emit(levels.getLevels(), levels.getBounds())
+            except Exception as e:
+                levels.levelsErrorMsg(e)
+            with levels.lock:
+                if not levels.again:
+                    levels.busy = False
+                    return
+                levels.again = False
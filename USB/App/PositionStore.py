@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" Toolpath position store: chunked float32 rows, saved as a binary blob """
+from __future__ import unicode_literals
+
+import array, base64, time, zlib
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+typecode = str("f")     # native str on Python 2 and 3
+
+
+class PositionStore(object):
+    """ Positions (x, y, z[, a, b, c]) and their time (s since start) as
+        float32 rows in fixed size chunks: append is O(1), what is stored is
+        never copied nor moved, so numpy views of full chunks stay valid.
+        One writer thread (the reactor): count is updated last, readers only
+        see complete rows. Pickled (PropertyPythonObject) as a zlib
+        compressed base64 blob. """
+
+    chunk = 65536   # rows per chunk
+
+    def __init__(self, axes=3):
+        self.axes = axes
+        self.columns = axes + 1
+        self.start = time.time()
+        self.chunks = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def newChunk(self):
+        self.chunks.append(array.array(typecode, [0.0]) * (self.chunk * self.columns))
+
+    def append(self, position, t=None):
+        i = self.count % self.chunk
+        if i == 0 and self.count // self.chunk == len(self.chunks):
+            self.newChunk()
+        data, i = self.chunks[-1], i * self.columns
+        for j in range(self.axes):
+            data[i + j] = position[j]
+        data[i + self.axes] = (time.time() if t is None else t) - self.start
+        self.count += 1
+
+    def extend(self, positions):
+        for position in positions:
+            self.append(position, self.start)
+
+    def clear(self):
+        self.start = time.time()
+        self.chunks = []
+        self.count = 0
+
+    def getChunks(self, start=0, stop=None):
+        """ Flat float32 arrays of rows [start:stop], chunk by chunk """
+        stop = self.count if stop is None else min(stop, self.count)
+        while start < stop:
+            c, i = divmod(start, self.chunk)
+            end = min(stop - c * self.chunk, self.chunk)
+            yield self.chunks[c][i * self.columns:end * self.columns]
+            start = c * self.chunk + end
+
+    def getRows(self, start=0, stop=None):
+        """ Rows [start:stop] as a numpy (n, columns) float32 array, or a
+            list of lists without numpy """
+        if numpy is not None:
+            rows = [numpy.frombuffer(c, numpy.float32) for c in self.getChunks(start, stop)]
+            if not rows:
+                return numpy.empty((0, self.columns), numpy.float32)
+            return numpy.concatenate(rows).reshape(-1, self.columns)
+        rows = []
+        for c in self.getChunks(start, stop):
+            rows.extend(c[i:i + self.columns].tolist()
+                        for i in range(0, len(c), self.columns))
+        return rows
+
+    def getPoints(self, start=0, stop=None):
+        """ xyz of rows [start:stop] """
+        rows = self.getRows(start, stop)
+        if numpy is not None:
+            return rows[:, :3]
+        return [r[:3] for r in rows]
+
+    def __getstate__(self):
+        data = b"".join(c.tostring() if hasattr(c, "tostring") else c.tobytes()
+                        for c in self.getChunks())
+        return {"axes": self.axes,
+                "start": self.start,
+                "count": self.count,
+                "data": base64.b64encode(zlib.compress(data)).decode("ascii")}
+
+    def __setstate__(self, state):
+        self.__init__(state["axes"])
+        self.start = state["start"]
+        data = array.array(typecode)
+        raw = zlib.decompress(base64.b64decode(state["data"]))
+        if hasattr(data, "frombytes"):
+            data.frombytes(raw)
+        else:
+            data.fromstring(raw)
+        for i in range(0, len(data), self.chunk * self.columns):
+            self.newChunk()
+            part = data[i:i + self.chunk * self.columns]
+            self.chunks[-1][:len(part)] = part
+        self.count = state["count"]
+
+
+class PositionView(object):
+    """ Incremental view of a store: take() returns the points appended
+        since the last take and the store index of the first one """
+
+    def __init__(self, store):
+        self.store = store
+        self.index = 0
+
+    def getPending(self):
+        return len(self.store) - self.index
+
+    def take(self):
+        start, count = self.index, len(self.store)
+        self.index = count
+        return start, self.store.getPoints(start, count)
+
+    def reset(self):
+        self.index = 0
@@ -76,6 +76,17 @@ class PySerial:
                         "PySerial",
                         "Port, a number or a device name")
         obj.Port = b"loop://"
+        obj.addProperty("App::PropertyEnumeration",
+                        "ReadMode",
+                        "PySerial",
+                        "Read strategy of POSIX ports [Ring, InWaiting, VMin] (default Ring)")
+        obj.ReadMode = self.getReadModes()
+        obj.ReadMode = b"Ring"
+        obj.addProperty("App::PropertyInteger",
+                        "ReadMin",
+                        "PySerial",
+                        "Bytes waited for before waking up the reader in VMin mode (1..64)")
+        obj.ReadMin = 64
         obj.addProperty("App::PropertyBool",
                         "RtsCts",
                         "PySerial",
@@ -131,6 +142,9 @@ class PySerial:
     def getState(self):
         return [b"Close", b"Init", b"Open", b"Start", b"Run", b"Error"]
 
+    def getReadModes(self):
+        return [b"Ring", b"InWaiting", b"VMin"]
+
     def getDetails(self):
         return [b"Detail", b"Standart", b"VID:PID"]
 
@@ -254,6 +268,11 @@ class PySerial:
             return o.Proxy.Machine.Serials[o.Serials.index(obj)]
         return None
 
+    def getMetrics(self, obj):
+        """ Port counters snapshot: a dict for scripts """
+        state = self.getMachineState(obj)
+        return state.getMetrics() if state is not None else {}
+
     def isDataChannel(self, obj):
         if self.hasParent(obj):
             o = self.getParent(obj)
@@ -311,6 +330,10 @@ class PySerial:
         return None if obj.WriteTimeout < 0 else obj.WriteTimeout
     def getInterByteTimeout(self, obj):
         return None if obj.InterByteTimeout < 0 else obj.InterByteTimeout
+    def getReadMode(self, obj):
+        return getattr(obj, "ReadMode", "Ring")
+    def getReadMin(self, obj):
+        return max(1, min(255, getattr(obj, "ReadMin", 64)))
 
 
 FreeCAD.Console.PrintLog("Loading PySerial... done\n")
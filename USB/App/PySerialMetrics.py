@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" PySerial metrics: port counters and latency histograms """
+from __future__ import unicode_literals
+
+import math, sys, time
+
+
+def getClock():
+    """ Monotonic high resolution clock (s) and its name: perf_counter, or
+        on Python 2 the system monotonic clock through ctypes. time.time is
+        only used when neither is available: it may step, its name tells """
+    if hasattr(time, "perf_counter"):
+        return time.perf_counter, "perf_counter"
+    try:
+        import ctypes, ctypes.util
+        if sys.platform == "win32":
+            kernel32 = ctypes.windll.kernel32
+            frequency = ctypes.c_int64()
+            if not kernel32.QueryPerformanceFrequency(ctypes.byref(frequency)):
+                raise OSError("QueryPerformanceFrequency failed")
+            def clock():
+                counter = ctypes.c_int64()
+                kernel32.QueryPerformanceCounter(ctypes.byref(counter))
+                return counter.value / float(frequency.value)
+            return clock, "QueryPerformanceCounter"
+        class timespec(ctypes.Structure):
+            _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+        # CLOCK_MONOTONIC
+        identifier = 6 if sys.platform == "darwin" else 4 if "bsd" in sys.platform else 1
+        library = ctypes.util.find_library("rt") or ctypes.util.find_library("c")
+        gettime = ctypes.CDLL(library, use_errno=True).clock_gettime
+        gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        if gettime(identifier, ctypes.byref(timespec())) != 0:
+            raise OSError(ctypes.get_errno(), "clock_gettime failed")
+        def clock():
+            spec = timespec()
+            gettime(identifier, ctypes.byref(spec))
+            return spec.tv_sec + spec.tv_nsec * 1e-9
+        return clock, "clock_gettime"
+    except (AttributeError, ImportError, OSError, TypeError):
+        return time.time, "time"
+
+clock, clockName = getClock()
+monotonic = clockName != "time"
+
+
+class Histogram(object):
+    """ HDR style histogram: values are counted in buckets of constant
+        relative width (1/precision of their power of two), from unit up,
+        so recording is a dict increment whatever the range. Single writer
+        thread: readers only get a snapshot. """
+
+    def __init__(self, unit=1e-6, precision=32):
+        self.unit = unit
+        self.precision = precision
+        self.clear()
+
+    def clear(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = self.max = None
+
+    def getBucket(self, value):
+        m, e = math.frexp(max(value / self.unit, 1.0))
+        return e * self.precision + int((m - 0.5) * 2 * self.precision)
+
+    def getValue(self, bucket):
+        # Middle of the bucket
+        e, s = divmod(bucket, self.precision)
+        return math.ldexp(0.5 + (s + 0.5) / (2.0 * self.precision), e) * self.unit
+
+    def record(self, value):
+        bucket = self.getBucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def getPercentile(self, percent):
+        counts = sorted(self.counts.items())
+        if not counts:
+            return None
+        rank, seen = percent / 100.0 * sum(c for b, c in counts), 0
+        for bucket, count in counts:
+            seen += count
+            if seen >= rank:
+                break
+        return max(self.min, min(self.max, self.getValue(bucket)))
+
+    def snapshot(self):
+        count = self.count
+        return {"count": count,
+                "min": self.min,
+                "mean": self.total / count if count else None,
+                "p50": self.getPercentile(50),
+                "p90": self.getPercentile(90),
+                "p99": self.getPercentile(99),
+                "max": self.max}
+
+    def __str__(self):
+        s = self.snapshot()
+        if not s["count"]:
+            return "-"
+        ms = lambda v: "{:.3f}".format(v * 1000)
+        return "{} in ms: p50 {} p90 {} p99 {} max {}".format(
+               s["count"], ms(s["p50"]), ms(s["p90"]), ms(s["p99"]), ms(s["max"]))
+
+
+class Metrics(object):
+    """ Counters of a SerialState. Every counter has one writer thread (the
+        reactor for the read side, the writer for the write side, the GUI
+        thread for real time commands) so they are plain attributes, cheap
+        enough to stay on. Latency is from a write to the first line read
+        after it: the response time of request/response devices. """
+
+    names = ["RxBytes",
+             "RxLines",
+             "Reads",
+             "Wakeups",
+             "ParseErrors",
+             "TxBytes",
+             "TxLines",
+             "Realtime",
+             "QueueDepth",
+             "Latency"]
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.reset()
+
+    def reset(self):
+        self.rxBytes = 0
+        self.rxLines = 0
+        self.reads = 0
+        self.wakeups = 0
+        self.parseErrors = 0
+        self.txBytes = 0
+        self.txLines = 0
+        self.realtime = 0
+        self.sent = None
+        self.start = clock()
+        self.latency.clear()
+
+    def onWakeup(self):
+        """ The reactor thread woke up (poll return) while the port is open """
+        self.wakeups += 1
+
+    def onRead(self, size):
+        self.reads += 1
+        self.rxBytes += size
+
+    def onLines(self, count):
+        sent, self.sent = self.sent, None
+        if sent is not None:
+            self.latency.record(clock() - sent)
+        self.rxLines += count
+
+    def onWrite(self, size, lines):
+        if self.sent is None:
+            self.sent = clock()
+        self.txBytes += size
+        self.txLines += lines
+
+    def snapshot(self, queue=0):
+        """ Counters as a dict (for scripts), queue being the writer queue
+            depth """
+        return {"RxBytes": self.rxBytes,
+                "RxLines": self.rxLines,
+                "Reads": self.reads,
+                "Wakeups": self.wakeups,
+                "ParseErrors": self.parseErrors,
+                "TxBytes": self.txBytes,
+                "TxLines": self.txLines,
+                "Realtime": self.realtime,
+                "QueueDepth": queue,
+                "Latency": self.latency.snapshot(),
+                "Elapsed": clock() - self.start}
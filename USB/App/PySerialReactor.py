@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" PySerial I/O reactors: one thread reading every open control port and
+    one thread reading every open data only port """
+from __future__ import unicode_literals
+
+from PySide import QtCore
+import codecs, os, select, threading, time
+from App import UsbTrace
+
+
+class Poller(object):
+    """ Wait for readable descriptors (epoll when available, else select).
+        A pipe is always registered so other threads can wake up the loop. """
+
+    def __init__(self):
+        self.fds = set()
+        self.rfd, self.wfd = os.pipe()
+        self.epoll = select.epoll() if hasattr(select, "epoll") else None
+        if self.epoll is not None:
+            self.epoll.register(self.rfd, select.EPOLLIN)
+
+    def register(self, fd):
+        self.fds.add(fd)
+        if self.epoll is not None:
+            self.epoll.register(fd, select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP)
+
+    def unregister(self, fd):
+        self.fds.discard(fd)
+        if self.epoll is not None:
+            try:
+                self.epoll.unregister(fd)
+            except (IOError, OSError, ValueError):
+                pass
+
+    def wakeup(self):
+        os.write(self.wfd, b"w")
+
+    def poll(self, timeout):
+        if self.epoll is not None:
+            ready = [fd for fd, e in self.epoll.poll(-1 if timeout is None else timeout)]
+        else:
+            ready, _, _ = select.select([self.rfd] + list(self.fds), [], [], timeout)
+        if self.rfd in ready:
+            os.read(self.rfd, 4096)
+            ready.remove(self.rfd)
+        return ready
+
+
+class ReceiveRing(object):
+    """ Preallocated receive buffer: the port reads straight into its free
+        space (Serial.read_available_into) and the block of complete lines is
+        decoded from it without an intermediate bytes object, then split
+        into lines (each with its eol, which copies the text again). The
+        unfinished line is moved to the front when the end is reached. """
+
+    def __init__(self, size=65536):
+        self.data = bytearray(size)
+        self.view = memoryview(self.data)
+        self.start = self.end = 0
+
+    def fill(self, serial):
+        if self.end == len(self.data):
+            self.compact()
+        count = serial.read_available_into([self.view[self.end:]])
+        self.end += count
+        return count
+
+    def compact(self):
+        size = self.end - self.start
+        if size == len(self.data):
+            # Line longer than the ring: a bytearray with exported views
+            # can't be resized, use a bigger one
+            data = bytearray(2 * size)
+            data[:size] = self.data
+            self.data, self.view = data, memoryview(data)
+        else:
+            # Source and destination may overlap: copy the line first
+            self.data[:size] = bytes(self.view[self.start:self.end])
+        self.start, self.end = 0, size
+
+    def split(self, eol):
+        """ Complete lines decoded (with eol): the whole block of complete
+            lines is decoded at once from the ring, then split. """
+        i = self.data.rfind(eol, self.start, self.end)
+        if i == -1:
+            return []
+        i += len(eol)
+        text = codecs.utf_8_decode(self.view[self.start:i], "replace", True)[0]
+        self.start = i
+        if self.start == self.end:
+            self.start = self.end = 0
+        eol = text[-len(eol):]
+        lines = text.split(eol)
+        lines.pop()
+        return [l + eol for l in lines]
+
+
+class Channel(object):
+    """ Reactor side of a SerialState: port, end of line and pending bytes """
+
+    def __init__(self, state):
+        self.state = state
+        self.machine = state.machine()
+        self.serial = state.obj.Proxy.Serial
+        self.metrics = state.metrics
+        self.isCtrl = state.isCtrlChannel()
+        self.eol = self.machine.getCharEndOfLine().encode("utf-8")
+        self.buffer = b""
+        self.batch = []
+        self.updates = []
+        if self.isCtrl:
+            self.parser = self.machine.getParser()
+        else:
+            self.parser = self.machine.getDataParser()
+        self.deadline = None
+        self.batchDelay = self.machine.getBatchDelay()
+        self.batchSize = self.machine.getBatchSize()
+        try:
+            self.fd = self.serial.fileno()
+        except Exception:
+            # Url handler (loop://, spy://...) without file descriptor
+            self.fd = None
+        # Zero copy receive path of POSIX ports, unless InWaiting is asked
+        proxy = state.obj.Proxy
+        self.ring = None
+        self.readMin = None
+        self.lastRead = time.time()
+        if self.fd is not None and hasattr(self.serial, "read_available_into"):
+            mode = proxy.getReadMode(state.obj)
+            if mode != "InWaiting":
+                self.ring = ReceiveRing()
+            if mode == "VMin":
+                self.setReadMin(proxy.getReadMin(state.obj))
+
+    def setReadMin(self, size):
+        """ VMin mode: the tty only reports the port readable once size bytes
+            are waiting (VTIME must stay 0, else it reports the first byte),
+            so a stream is read in fewer and bigger reads (Linux cuts reads to
+            64 bytes when VMIN is over 64). The port stays non blocking: bytes
+            under the threshold are read on poll timeout. """
+        import termios
+        try:
+            attr = termios.tcgetattr(self.fd)
+            attr[6][termios.VMIN] = size
+            attr[6][termios.VTIME] = 0
+            termios.tcsetattr(self.fd, termios.TCSANOW, attr)
+        except termios.error:
+            return
+        self.readMin = size
+
+    def isPolled(self):
+        return self.fd is None
+
+    def isDelayed(self):
+        return self.readMin is not None
+
+    def getPollTimeout(self):
+        timeout = self.serial.timeout
+        return 0.05 if not timeout or timeout < 0 else timeout
+
+    def getReadTimeout(self, now):
+        """ Time left before reading the bytes under the VMin threshold """
+        if not self.isDelayed():
+            return None
+        return max(0, self.lastRead + self.getPollTimeout() - now)
+
+    def read(self):
+        if self.ring is not None:
+            self.lastRead = time.time()
+            self.metrics.onRead(self.ring.fill(self.serial))
+            return self.ring.split(self.eol)
+        if self.isPolled():
+            size = self.serial.in_waiting
+            if not size:
+                return []
+        else:
+            # A readable port with nothing waiting means a lost device:
+            # serial.read() will report it.
+            size = max(1, self.serial.in_waiting)
+        data = self.serial.read(size)
+        self.metrics.onRead(len(data))
+        self.buffer += data
+        lines = self.buffer.split(self.eol)
+        self.buffer = lines.pop()
+        return [(l + self.eol).decode("utf-8", "replace") for l in lines]
+
+    def start(self):
+        if self.isCtrl:
+            self.machine.ctrlStart.emit()
+        self.state.startThreadMsg()
+
+    def stop(self):
+        self.flush()
+        self.state.doThreadClose()
+        if self.isCtrl:
+            self.machine.ctrlStop.emit()
+        self.state.serialClose.emit()
+
+    def dispatch(self, lines):
+        if not lines:
+            return
+        self.metrics.onLines(len(lines))
+        # Data only channels stream: no per line signal, only batches
+        if self.isCtrl:
+            for line in lines:
+                self.state.serialRead.emit(line)
+                self.machine.serialRead.emit(line)
+        if self.parser is not None:
+            start = UsbTrace.tracer.now()
+            for line in lines:
+                self.updates.extend(self.parser.parse(line))
+            self.metrics.parseErrors = getattr(self.parser, "errors", 0)
+            if start is not None:
+                UsbTrace.tracer.complete("parse", "reactor", start, {"lines": len(lines)})
+        if not self.batch:
+            self.deadline = time.time() + self.batchDelay
+        self.batch.extend(lines)
+        if len(self.batch) >= self.batchSize or time.time() >= self.deadline:
+            self.flush()
+
+    def flush(self):
+        """ Send pending lines as one queued signal (one GUI event) """
+        if not self.batch:
+            return
+        start = UsbTrace.tracer.now()
+        batch, self.batch = self.batch, []
+        self.state.serialReadBatch.emit(batch)
+        if self.isCtrl:
+            self.machine.serialReadBatch.emit(batch)
+        if self.updates:
+            updates, self.updates = self.updates, []
+            self.machine.serialParsed.emit(updates)
+        if start is not None:
+            UsbTrace.tracer.complete("dispatch", "gui", start, {"lines": len(batch)})
+
+    def getFlushTimeout(self, now):
+        if not self.batch:
+            return None
+        return max(0, self.deadline - now)
+
+
+class ReactorLoop(QtCore.QRunnable):
+
+    def __init__(self, reactor):
+        QtCore.QRunnable.__init__(self)
+        self.reactor = reactor
+
+    def run(self):
+        """ Loop and read all registered PySerial """
+        self.reactor.loop()
+
+
+class Reactor(object):
+    """ Single thread multiplexing the reads of every open SerialState.
+        The thread is started on first register() and ends with the last
+        channel, so an idle FreeCAD session doesn't keep it running. """
+
+    def __init__(self):
+        self.pool = QtCore.QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self.poller = Poller()
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.pending = []
+        self.channels = []
+        self.running = False
+
+    def register(self, state):
+        with self.lock:
+            self.pending.append(state)
+            if not self.running:
+                self.running = True
+                self.pool.start(ReactorLoop(self))
+        self.poller.wakeup()
+
+    def wakeup(self):
+        self.poller.wakeup()
+
+    def isRegistered(self, machine):
+        return any(s.machine() is machine for s in self.pending) or\
+               any(c.machine is machine for c in self.channels)
+
+    def waitForDone(self, machine, timeout=None):
+        """ Wait for all channels of machine to be closed """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while self.isRegistered(machine):
+                if deadline is None:
+                    self.condition.wait()
+                elif deadline > time.time():
+                    self.condition.wait(deadline - time.time())
+                else:
+                    return False
+        return True
+
+    def loop(self):
+        try:
+            self.serve()
+        except Exception as e:
+            self.onFailure(e)
+
+    def serve(self):
+        while True:
+            channels, failed = [], []
+            with self.lock:
+                for state in self.pending:
+                    try:
+                        channels.append(Channel(state))
+                    except Exception as e:
+                        failed.append((state, e))
+                self.channels.extend(channels)
+                self.pending = []
+            for state, e in failed:
+                self.onStateError(state, e)
+            for channel in channels:
+                self.addChannel(channel)
+            for channel in list(self.channels):
+                if not channel.machine.run:
+                    self.removeChannel(channel)
+                    channel.stop()
+            with self.lock:
+                if not self.channels and not self.pending:
+                    self.running = False
+                    self.condition.notify_all()
+                    return
+            ready = self.poller.poll(self.getTimeout())
+            start = UsbTrace.tracer.now()
+            now = time.time()
+            for channel in list(self.channels):
+                channel.metrics.onWakeup()
+                if channel.isPolled() or channel.fd in ready or\
+                   channel.getReadTimeout(now) == 0:
+                    self.readChannel(channel)
+                if channel.getFlushTimeout(time.time()) == 0:
+                    channel.flush()
+            if start is not None:
+                UsbTrace.tracer.complete("wakeup", "reactor", start, {"ready": len(ready)})
+
+    def getTimeout(self):
+        now = time.time()
+        timeouts = [c.getPollTimeout() for c in self.channels if c.isPolled()]
+        timeouts += [c.getReadTimeout(now) for c in self.channels if c.isDelayed()]
+        timeouts += [c.getFlushTimeout(now) for c in self.channels if c.batch]
+        return min(timeouts) if timeouts else None
+
+    def addChannel(self, channel):
+        if not channel.isPolled():
+            self.poller.register(channel.fd)
+        try:
+            channel.start()
+        except Exception as e:
+            self.onError(channel, e)
+
+    def removeChannel(self, channel):
+        if not channel.isPolled():
+            self.poller.unregister(channel.fd)
+        with self.lock:
+            self.channels.remove(channel)
+            self.condition.notify_all()
+
+    def readChannel(self, channel):
+        try:
+            start = UsbTrace.tracer.now()
+            lines = channel.read()
+            if start is not None:
+                UsbTrace.tracer.complete("read", "reactor", start,
+                                {"port": channel.serial.name, "lines": len(lines)})
+            channel.dispatch(lines)
+        except Exception as e:
+            self.onError(channel, e)
+
+    def onError(self, channel, e):
+        self.removeChannel(channel)
+        self.onStateError(channel.state, e)
+
+    def onStateError(self, state, e):
+        state.errorThreadMsg(e)
+        state.serialError.emit()
+
+    def onFailure(self, e):
+        """ The loop failed outside a channel read: every channel gets the
+            error and the thread ends, so the next register() restarts it """
+        with self.lock:
+            channels, self.channels = self.channels, []
+            states, self.pending = self.pending, []
+            self.running = False
+            self.condition.notify_all()
+        for channel in channels:
+            if not channel.isPolled():
+                self.poller.unregister(channel.fd)
+            self.onStateError(channel.state, e)
+        for state in states:
+            self.onStateError(state, e)
+
+
+reactors = {}
+
+def getReactor(name="ctrl"):
+    if name not in reactors:
+        reactors[name] = Reactor()
+    return reactors[name]
+
+def register(state):
+    """ Read state with the reactor of its channel: a data channel streaming
+        on its own port doesn't delay the control channel """
+    getReactor("ctrl" if state.isCtrlChannel() else "data").register(state)
+
+def wakeup():
+    for reactor in list(reactors.values()):
+        reactor.wakeup()
+
+def waitForDone(machine, timeout=None):
+    return all([r.waitForDone(machine, timeout) for r in list(reactors.values())])
@@ -24,8 +24,9 @@
 """ PySerial StateMachine document object """
 from __future__ import unicode_literals
 
-import FreeCAD, serial, io, json
+import FreeCAD, serial, json
 from PySide import QtCore
+from App import PySerialMetrics, PySerialReactor, PySerialWriter, UsbTrace
 
 
 class SerialState(QtCore.QState):
@@ -34,13 +35,18 @@ class SerialState(QtCore.QState):
     serialClose = QtCore.Signal()
     serialError = QtCore.Signal()
     serialRead = QtCore.Signal(unicode)
+    serialReadBatch = QtCore.Signal(list)
     serialWrite = QtCore.Signal(unicode)
+    realtimeLatency = 0.005     # real time command latency warning (s)
 
     def __init__(self, parent=None):
         QtCore.QState.__init__(self, parent)
         self.setObjectName("Serial")
         self.obj = None
-        self.sio = None
+        self.writer = None
+        self.metrics = PySerialMetrics.Metrics()
+        # Only queue data in the emitting thread: the writer thread writes it
+        self.serialWrite.connect(self.onSerialWrite, QtCore.Qt.DirectConnection)
 
         Init = InitState(self)
         Init.setObjectName(b"Init")
@@ -54,7 +60,6 @@ class SerialState(QtCore.QState):
         Init.addTransition(self, b"serialOpen()", Open)
         Init.addTransition(self, b"serialClose()", Close)
         Init.addTransition(self, b"serialError()", Error)
-        Open.addTransition(SerialWriter(self.serialWrite[unicode]))
         Open.addTransition(self, b"serialClose()", Close)        
         Open.addTransition(self, b"serialError()", Error)
         self.setInitialState(Init)
@@ -84,11 +89,50 @@ class SerialState(QtCore.QState):
         return True
 
     def doSerialOpen(self):
-        eol = self.machine().getCharEndOfLine()
-        s = io.BufferedRWPair(self.obj.Proxy.Serial, self.obj.Proxy.Serial)
-        self.sio = io.TextIOWrapper(s, newline=eol)
         self.serialOpenMsg()
 
+    @QtCore.Slot(unicode)
+    def onSerialWrite(self, data):
+        # Writes outside of the Open state are ignored
+        writer = self.writer
+        if writer is not None:
+            writer.put(data)
+
+    def realtimeWrite(self, data):
+        # Real time commands only make sense in the Open state too
+        writer = self.writer
+        if writer is not None:
+            self.metrics.realtime += 1
+            self.realtimeMsg(data, writer.writeNow(data))
+
+    def startWriter(self):
+        machine = self.machine()
+        self.writer = PySerialWriter.Writer(self, self.obj.Proxy.Serial,
+                                            machine.getCharEndOfLine(),
+                                            machine.getWriteQueue())
+        if self.isCtrlChannel():
+            self.writer.tracer = machine.getTracer()
+        self.machine().startThread(self.writer)
+
+    def stopWriter(self):
+        writer, self.writer = self.writer, None
+        if writer is not None:
+            writer.close()
+
+    def getMetrics(self):
+        """ Snapshot of the port counters (see PySerialMetrics.Metrics) """
+        writer = self.writer
+        return self.metrics.snapshot(len(writer.queue) if writer is not None else 0)
+
+    def traceState(self, name):
+        if UsbTrace.tracer.enabled:
+            # Need to try: on close document obj already deleted
+            try:
+                port = self.obj.Name
+            except ReferenceError:
+                port = None
+            UsbTrace.tracer.instant(name, "state", {"port": port})
+
     def isOpen(self):
         return self.obj.Proxy.Serial.is_open
 
@@ -96,10 +140,10 @@ class SerialState(QtCore.QState):
         if self.isOpen():
             self.serialCloseMsg()
             self.obj.Proxy.Serial.close()
-        self.sio = None
 
     def doThreadClose(self):
         self.stopThreadMsg()
+        self.stopWriter()
         self.doSerialClose()
         self.resetExtra()
 
@@ -108,8 +152,10 @@ class SerialState(QtCore.QState):
         if not self.isUrl():
             self.obj.Proxy.Serial.close()
             self.obj.Proxy.Serial.open()
-        # Now it's shure to have signature
-        return self.sio.readline()
+        # Now it's shure to have signature. Read it unbuffered: the following
+        # bytes belong to the reactor
+        eol = self.machine().getCharEndOfLine().encode("utf-8")
+        return self.obj.Proxy.Serial.read_until(eol).decode("utf-8", "replace")
 
     def getPlugin(self):
         plugin, extra = b"UsbPool", {}
@@ -168,9 +214,17 @@ class SerialState(QtCore.QState):
         FreeCAD.Console.PrintError(msg.format(e))
 
     def writerErrorMsg(self, e):
-        msg = "Error occurred in SerialWriter process: {}\n"
+        msg = "Error occurred in UsbWriter thread process: {}\n"
         FreeCAD.Console.PrintError(msg.format(e))
 
+    def realtimeMsg(self, data, latency):
+        msg = "{} real time command {} written in {:.3f} ms\n"
+        msg = msg.format(self.obj.Label, repr(data), latency * 1000)
+        if latency > self.realtimeLatency:
+            FreeCAD.Console.PrintWarning(msg)
+        else:
+            FreeCAD.Console.PrintLog(msg)
+
     def startThreadMsg(self):
         msg = "{} UsbReader thread start on port {}... done\n"
         FreeCAD.Console.PrintLog(msg.format(self.obj.Name, self.obj.Proxy.Serial.name))
@@ -187,6 +241,7 @@ class SerialState(QtCore.QState):
 class InitState(QtCore.QState):
 
     def onEntry(self, e):
+        self.parentState().traceState(self.objectName())
         self.parentState().obj.State = b"{}".format(self.objectName())
         if self.parentState().trySerialOpen():
             if self.parentState().newPlugin():
@@ -203,13 +258,17 @@ class InitState(QtCore.QState):
 class OpenState(QtCore.QState):
 
     def onEntry(self, e):
+        self.parentState().traceState(self.objectName())
         self.parentState().obj.State = b"{}".format(self.objectName())        
-        self.machine().startThread(SerialReader(self.parentState()))
+        self.parentState().metrics.reset()
+        self.parentState().startWriter()
+        PySerialReactor.register(self.parentState())
 
 
 class CloseState(QtCore.QFinalState):
     
     def onEntry(self, e):
+        self.parentState().traceState(self.objectName())
         # Need to try: on close document serialClose is emited... 
         # and obj already deleted
         try:
@@ -221,50 +280,11 @@ class CloseState(QtCore.QFinalState):
 class ErrorState(QtCore.QFinalState):
     
     def onEntry(self, e):
+        self.parentState().traceState(self.objectName())
         self.parentState().obj.State = b"{}".format(self.objectName())
         self.machine().run = False
 
 
-class SerialWriter(QtCore.QSignalTransition):
-
-    def onTransition(self, e):
-        try:
-            state = self.sourceState().parentState()
-            state.sio.write(e.arguments()[0] + self.machine().getCharEndOfLine())
-            state.sio.flush()
-        except Exception as e:
-            state.writerErrorMsg(e)
-            state.serialError.emit()
-
-
-class SerialReader(QtCore.QRunnable):
-
-    def __init__(self, state):
-        QtCore.QRunnable.__init__(self)
-        self.state = state
-
-    def run(self):
-        """ Loop and read PySerial """
-        try:
-            isCtrl = self.state.isCtrlChannel()
-            if isCtrl:
-                self.state.machine().ctrlStart.emit()
-            self.state.startThreadMsg()
-            while self.state.machine().run:
-                line = self.state.sio.readline()
-                if len(line):
-                    self.state.serialRead.emit(line)
-                    if isCtrl:
-                        self.state.machine().serialRead.emit(line)
-            self.state.doThreadClose()
-            if isCtrl:
-                self.state.machine().ctrlStop.emit()
-            self.state.serialClose.emit()
-        except Exception as e:
-            self.state.errorThreadMsg(e)
-            self.state.serialError.emit()
-
-
 class RestartMachine(QtCore.QRunnable):
 
     def __init__(self, machine):
@@ -272,10 +292,11 @@ class RestartMachine(QtCore.QRunnable):
         self.machine = machine
 
     def run(self):
-        """ Wait for restart StateMachine """
+        """ Wait for StateMachine stop, then restart it with the new plugin """
         try:
-            while self.machine.isRunning():
-                pass
-            self.machine.restart.emit(self.machine.obj)
+            if self.machine.waitForStop(self.machine.stopTimeout):
+                self.machine.restart.emit(self.machine.obj)
+            else:
+                self.machine.stopTimeoutMsg("restart")
         except Exception as e:
             self.machine.machineErrorMsg(e)
\ No newline at end of file
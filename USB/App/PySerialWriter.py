@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" PySerial writer: one thread writing the queued commands of a port """
+from __future__ import unicode_literals
+
+from PySide import QtCore
+import collections, threading, time
+from App import UsbTrace
+
+
+def isGuiThread():
+    app = QtCore.QCoreApplication.instance()
+    return app is not None and QtCore.QThread.currentThread() == app.thread()
+
+
+class Writer(QtCore.QRunnable):
+    """ Write the commands queued by a SerialState on its own thread: all
+        commands queued while a write is pending go out in the next write.
+        Producers block while the queue holds size commands (backpressure:
+        the uploader thread is throttled this way), except the GUI thread
+        which is never blocked: its commands are always queued, so the queue
+        may grow past size with commands typed or sent from the GUI.
+        Real time commands (writeNow) skip the queue: they are written at once
+        from the calling thread, the controller handles them anywhere in the
+        stream. """
+
+    chunk = 4096    # max bytes per write
+
+    def __init__(self, state, serial, eol, size):
+        QtCore.QRunnable.__init__(self)
+        self.setAutoDelete(False)
+        self.state = state
+        self.serial = serial
+        self.eol = eol
+        self.separator = eol.encode("utf-8")
+        self.size = size
+        self.metrics = state.metrics
+        # Set by the control channel of plugins timing their commands
+        self.tracer = None
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.running = True
+        self.done = threading.Event()
+
+    def encode(self, data):
+        # Same end of line translation as the former TextIOWrapper
+        if self.eol != "\n":
+            data = data.replace("\n", self.eol)
+        return (data + self.eol).encode("utf-8")
+
+    def put(self, data):
+        """ Queue data, return False if the writer is stopped """
+        data = self.encode(data)
+        with self.condition:
+            if not isGuiThread():
+                while self.running and len(self.queue) >= self.size:
+                    self.condition.wait()
+            if not self.running:
+                return False
+            self.queue.append(data)
+            self.condition.notify_all()
+        return True
+
+    def get(self):
+        """ Queued data coalesced up to chunk bytes, b"" once stopped """
+        with self.condition:
+            while self.running and not self.queue:
+                self.condition.wait()
+            data, size = [], 0
+            while self.queue and size < self.chunk:
+                data.append(self.queue.popleft())
+                size += len(data[-1])
+            self.condition.notify_all()
+        return b"".join(data)
+
+    def getOutput(self):
+        try:
+            return self.serial.out_waiting
+        except (AttributeError, NotImplementedError, IOError, OSError):
+            # Url handlers may not know their output buffer
+            return 0
+
+    def waitOutput(self):
+        # Keep the driver output buffer short: a real time command written
+        # behind a full buffer would wait for all of it to go out
+        while self.running and self.getOutput() > self.chunk:
+            time.sleep(0.001)
+
+    def run(self):
+        """ Write queued data until closed """
+        try:
+            data = self.get()
+            while data:
+                self.waitOutput()
+                start = UsbTrace.tracer.now()
+                self.serial.write(data)
+                if start is not None:
+                    UsbTrace.tracer.complete("write", "writer", start, {"bytes": len(data)})
+                self.metrics.onWrite(len(data), data.count(self.separator))
+                if self.tracer is not None:
+                    self.tracer.onWrite(data.split(self.separator)[:-1])
+                data = self.get()
+        except Exception as e:
+            with self.condition:
+                self.running = False
+                self.queue.clear()
+                self.condition.notify_all()
+            self.state.writerErrorMsg(e)
+            self.state.serialError.emit()
+        finally:
+            self.done.set()
+
+    def writeNow(self, data):
+        """ Write data ahead of the queued data, return the latency (s) """
+        start = time.time()
+        if self.running:
+            self.serial.write(data.encode("utf-8"))
+            UsbTrace.tracer.instant("realtime", "writer", {"data": repr(data)})
+            if self.tracer is not None:
+                self.tracer.onRealtime(data)
+        return time.time() - start
+
+    def close(self, timeout=1.0):
+        """ Stop once the queued data is written (or after timeout) """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.done.wait(timeout)
@@ -25,7 +25,7 @@
 from __future__ import unicode_literals
 
 import FreeCAD, os
-from  App import UsbPool, TinyG2Machine
+from  App import UsbPool, TinyG2Machine, GcodeFilter, GcodeCache
 
 
 class Pool(UsbPool.Pool):
@@ -37,7 +37,9 @@ class Pool(UsbPool.Pool):
         self.Type = "App::UsbPool"
         for p in obj.PropertiesList:
             if obj.getGroupOfProperty(p) in ("Driver"):
-                if p not in ("Buffers", "Device", "Id", "Message", "Timeout", "UploadFile"):
+                if p not in ("Buffers", "CacheSize", "Device", "Id", "Message", "Pause",
+                             "Precision", "Preprocess", "ResumeLine", "Start", "Timeout",
+                             "UploadFile"):
                     obj.removeProperty(p)
         if "ReadOnly" in obj.getEditorMode("DualPort"):
             obj.setEditorMode("DualPort", 0)
@@ -49,6 +51,12 @@ class Pool(UsbPool.Pool):
                             "Driver",
                             "Upload file buffers to keep free")
             obj.Buffers = (5,0,28,1)
+        if "CacheSize" not in obj.PropertiesList:
+            obj.addProperty("App::PropertyIntegerConstraint",
+                            "CacheSize",
+                            "Driver",
+                            "Preprocessed upload files cache size (MB:0->100000, 0 disable)")
+            obj.CacheSize = (2048,0,100000,1)
         if "Id" not in obj.PropertiesList:
             obj.addProperty("App::PropertyString",
                             "Id",
@@ -59,6 +67,36 @@ class Pool(UsbPool.Pool):
                             "Message",
                             "Driver",
                             "Usb Device message")
+        if "Pause" not in obj.PropertiesList:
+            obj.addProperty("App::PropertyBool",
+                            "Pause",
+                            "Driver",
+                            "Pause/resume file upload")
+            obj.Pause = False
+        if "Precision" not in obj.PropertiesList:
+            obj.addProperty("App::PropertyIntegerConstraint",
+                            "Precision",
+                            "Driver",
+                            "Upload file decimals kept by Round preprocessing (0->8)")
+            obj.Precision = (4,0,8,1)
+        if "Preprocess" not in obj.PropertiesList:
+            obj.addProperty("App::PropertyStringList",
+                            "Preprocess",
+                            "Driver",
+                            "Upload file preprocessing ({})".format(", ".join(GcodeFilter.getStages())))
+            obj.Preprocess = [b"Comments", b"LineNumbers", b"Whitespace"]
+        if "ResumeLine" not in obj.PropertiesList:
+            obj.addProperty("App::PropertyInteger",
+                            "ResumeLine",
+                            "Driver",
+                            "Upload file line to resume from (0 from start, set on upload stop)")
+            obj.ResumeLine = 0
+        if "Start" not in obj.PropertiesList:
+            obj.addProperty("App::PropertyBool",
+                            "Start",
+                            "Driver",
+                            "Start/stop file upload")
+            obj.Start = False
         if "Timeout" not in obj.PropertiesList:
             obj.addProperty("App::PropertyIntegerConstraint",
                             "Timeout",
@@ -93,5 +131,39 @@ class Pool(UsbPool.Pool):
         obj.Id = extra["id"]
         obj.Message = extra["msg"]
 
+    def getPipeline(self, obj):
+        return GcodeFilter.Pipeline(obj.Preprocess, obj.Precision)
+
+    def getJobCache(self, obj):
+        """ The job cache, its folder being created once """
+        if getattr(self, "JobCache", None) is None:
+            folder = os.path.join(FreeCAD.getUserAppDataDir(), "USB", "Cache")
+            self.JobCache = GcodeCache.JobCache(folder, obj.CacheSize * 1024 * 1024)
+        self.JobCache.size = obj.CacheSize * 1024 * 1024
+        return self.JobCache
+
+    def getLatency(self, obj):
+        """ Command round trip latency per command type: a dict for scripts """
+        return self.Machine.tracer.snapshot()
+
+    def exportLatency(self, obj, path):
+        self.Machine.tracer.export(path)
+
+    def resume(self, obj, line=None):
+        """ Start upload at line (default ResumeLine) after its modal state """
+        if line is not None:
+            obj.ResumeLine = max(0, line)
+        obj.Start = True
+
+    def onChanged(self, obj, prop):
+        UsbPool.Pool.onChanged(self, obj, prop)
+        if prop == "Start":
+            if obj.Start:
+                self.Machine.startUpload()
+            else:
+                self.Machine.stopUpload()
+        if prop == "Pause":
+            self.Machine.pauseUpload(obj.Pause)
+
 
 FreeCAD.Console.PrintLog("Loading TinyG2... done\n")
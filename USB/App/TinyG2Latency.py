@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" TinyG2 command round trip latency: every command written on the control
+    channel is matched with its footer """
+from __future__ import unicode_literals
+
+import collections, json, re, threading
+from App import PySerialMetrics
+
+
+jsonKey = re.compile(br'^\s*\{\s*"(\w+)"')
+gcodeWord = re.compile(br'^\s*(?:[Nn]\d+\s*)?([GgMmTt])0*(\d+)')
+flushing = ("%", "\x18", "\x04")
+footerKey = re.compile(r'^\s*\{\s*"r"\s*:\s*\{\s*"(\w+)"')
+
+
+def getFooterKey(line):
+    """ First key of a footer response, None for a bare footer (G-code) """
+    m = footerKey.match(line)
+    return None if m is None else m.group(1)
+
+def getCommandType(line):
+    """ Command type of a written line: first JSON key, $ for text mode
+        settings, first G/M/T word for G-code """
+    m = jsonKey.match(line)
+    if m is not None:
+        return m.group(1).decode("ascii")
+    if line.lstrip().startswith(b"$"):
+        return "$"
+    m = gcodeWord.match(line)
+    if m is not None:
+        return (m.group(1) + m.group(2)).decode("ascii").upper()
+    return "gcode"
+
+
+class Tracer(object):
+    """ TinyG2 answers every command with a footer, in order: the writer
+        thread stamps the commands it writes (onWrite) and the reactor thread
+        matches each footer read with the oldest stamp (onFooter), recording
+        the round trip in a histogram per command type. A footer only
+        matches a command of its kind: a JSON command the key of its
+        response, a G-code line a bare footer. Older commands skipped by a
+        match got no footer and are dropped, so one lost response doesn't
+        shift the following samples. The stamps are cleared on real time
+        commands dropping queued commands (queue flush, reset, job kill).
+        Histograms only have the reactor thread as writer. The time in the
+        writer queue is not counted: it is host side, the round trip is
+        wire and controller. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        self.histograms = {}
+
+    def onWrite(self, lines):
+        now = PySerialMetrics.clock()
+        with self.lock:
+            for line in lines:
+                if line.strip():
+                    m = jsonKey.match(line)
+                    key = None if m is None else m.group(1).decode("ascii")
+                    self.pending.append((getCommandType(line), key, now))
+
+    def onRealtime(self, data):
+        # Queue flush, reset and job kill drop the queued commands
+        if any(c in data for c in flushing):
+            self.clear()
+
+    def onFooter(self, line=""):
+        now = PySerialMetrics.clock()
+        key = getFooterKey(line)
+        with self.lock:
+            for i, (kind, command, sent) in enumerate(self.pending):
+                # Text mode settings ($) answer with their own keys
+                if kind == "$" or command == key:
+                    break
+            else:
+                # Footer of a command written before the tracer (or a reset)
+                return
+            for j in range(i + 1):
+                self.pending.popleft()
+        histogram = self.histograms.get(kind)
+        if histogram is None:
+            histogram = self.histograms[kind] = PySerialMetrics.Histogram()
+        histogram.record(now - sent)
+
+    def clear(self):
+        """ Forget the commands waiting for a footer (controller reset) """
+        with self.lock:
+            self.pending.clear()
+
+    def reset(self):
+        self.clear()
+        self.histograms = {}
+
+    def snapshot(self):
+        return dict((k, h.snapshot()) for k, h in list(self.histograms.items()))
+
+    def export(self, path):
+        """ Write the histograms as JSON: snapshot and buckets (bucket value
+            in s, count) of every command type, and the clock used """
+        data = {"clock": PySerialMetrics.clockName}
+        for kind, histogram in list(self.histograms.items()):
+            data[kind] = histogram.snapshot()
+            data[kind]["buckets"] = [(histogram.getValue(b), c) for b, c
+                                     in sorted(histogram.counts.items())]
+        with open(path, "w") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
@@ -24,11 +24,41 @@
 """ TinyG2 StateMachine document object """
 from __future__ import unicode_literals
 
-from App import UsbPoolMachine, PySerialState
+from PySide import QtCore
+import FreeCAD
+from App import UsbPoolMachine, PySerialMetrics, PySerialState, TinyG2Latency, TinyG2Parser, TinyG2Upload
 
 
 class PoolMachine(UsbPoolMachine.PoolMachine):
 
+    uploadStart = QtCore.Signal()
+    uploadStop = QtCore.Signal()
+    uploadProgress = QtCore.Signal(int, int, float, int)
+    positionsAdded = QtCore.Signal(int)
+
+    # TinyG2 real time commands
+    feedhold = "!"
+    cycleStart = "~"
+    queueFlush = "%"
+    resetCommand = "\x18"
+
+    def __init__(self):
+        UsbPoolMachine.PoolMachine.__init__(self)
+        self.parser = TinyG2Parser.Parser()
+        self.dataParser = TinyG2Parser.Parser()
+        # Commands are timed on the control channel only
+        self.tracer = TinyG2Latency.Tracer()
+        self.parser.tracer = self.tracer
+        self.ctrlStart.connect(self.tracer.clear, QtCore.Qt.DirectConnection)
+        if not PySerialMetrics.monotonic:
+            self.latencyClockMsg()
+        # Status reports positions, stored in the reactor thread
+        self.positions = None
+        self.position = [0.0, 0.0, 0.0]
+        self.parser.subscribe("sr", self.onStatus)
+        self.uploader = None
+        self.uploadStop.connect(self.onUploadStop, QtCore.Qt.QueuedConnection)
+
     def setMachine(self, obj):
         self.obj = obj
         self.Serials[0].obj = obj.Serials[0]
@@ -37,3 +67,86 @@ class PoolMachine(UsbPoolMachine.PoolMachine):
             self.Serials[1].setParent(self.initialState())
         else:
             self.Serials[1].setParent(None)
+
+    def getParser(self):
+        return self.parser
+
+    def getDataParser(self):
+        return self.dataParser
+
+    def getTracer(self):
+        return self.tracer
+
+    def setPositions(self, positions):
+        """ PositionStore receiving the status report positions """
+        self.positions = positions
+
+    def onStatus(self, status):
+        sr = status.get("sr", {})
+        changed = False
+        for i, key in enumerate(("posx", "posy", "posz")):
+            if key in sr and sr[key] != self.position[i]:
+                self.position[i] = sr[key]
+                changed = True
+        positions = self.positions
+        if changed and positions is not None:
+            positions.append(self.position)
+            self.positionsAdded.emit(len(positions))
+
+    def startUpload(self):
+        if self.uploader is not None or not self.run:
+            return
+        self.uploader = TinyG2Upload.Uploader(self)
+        self.startThread(self.uploader)
+
+    def stopUpload(self):
+        if self.uploader is not None:
+            self.uploader.cancel()
+            # Stop the moves already planned too
+            self.realtimeWrite(self.feedhold)
+            self.realtimeWrite(self.queueFlush)
+
+    def pauseUpload(self, pause):
+        # Feedhold/resume first: the controller must react at once
+        self.realtimeWrite(self.feedhold if pause else self.cycleStart)
+        if self.uploader is not None:
+            self.uploader.setPause(pause)
+
+    def reset(self):
+        """ Controller reset (Ctrl-X) """
+        if self.uploader is not None:
+            self.uploader.cancel()
+        self.realtimeWrite(self.resetCommand)
+        # Commands not answered yet are lost
+        self.tracer.clear()
+
+    @QtCore.Slot()
+    def onUploadStop(self):
+        uploader, self.uploader = self.uploader, None
+        # Need to try: on close document obj already deleted
+        try:
+            if uploader is not None and self.obj.ResumeLine != uploader.resumeLine:
+                self.obj.ResumeLine = uploader.resumeLine
+            if self.obj.Start:
+                self.obj.Start = False
+            if self.obj.Pause:
+                self.obj.Pause = False
+        except ReferenceError:
+            pass
+
+    def latencyClockMsg(self):
+        msg = "No monotonic clock, command latency measured with the wall clock (time.time)\n"
+        FreeCAD.Console.PrintWarning(msg)
+
+    def uploadStatisticsMsg(self, statistics, cached):
+        msg = "{} file upload preprocessing{}: {}\n"
+        cache = " (from cache)" if cached else ""
+        FreeCAD.Console.PrintMessage(msg.format(self.obj.Label, cache, statistics))
+
+    def uploadResumeMsg(self, line, state):
+        msg = "{} file upload resume at line {}: {}\n"
+        FreeCAD.Console.PrintMessage(msg.format(self.obj.Label, line, state))
+
+    def uploadErrorMsg(self, e):
+        msg = "Error occurred in {} file upload: {}\n"
+        FreeCAD.Console.PrintError(msg.format(self.obj.Label, e))
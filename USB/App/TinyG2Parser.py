@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" TinyG2 response parser (run in the reactor thread) """
+from __future__ import unicode_literals
+
+import json
+
+
+dickey = {"r":{"unit":"unit",
+               "g54":{"x":"g54x","y":"g54y","z":"g54z","a":"g54a","b":"g54b","c":"g54c"},
+               "g55":{"x":"g55x","y":"g55y","z":"g55z","a":"g55a","b":"g55b","c":"g55c"},
+               "g56":{"x":"g56x","y":"g56y","z":"g56z","a":"g56a","b":"g56b","c":"g56c"},
+               "g57":{"x":"g57x","y":"g57y","z":"g57z","a":"g57a","b":"g57b","c":"g57c"},
+               "g58":{"x":"g58x","y":"g58y","z":"g58z","a":"g58a","b":"g58b","c":"g58c"},
+               "g59":{"x":"g59x","y":"g59y","z":"g59z","a":"g59a","b":"g59b","c":"g59c"},
+               "g92":{"x":"g92x","y":"g92y","z":"g92z","a":"g92a","b":"g92b","c":"g92c"},
+               "g28":{"x":"g28x","y":"g28y","z":"g28z","a":"g28a","b":"g28b","c":"g28c"},
+               "g30":{"x":"g30x","y":"g30y","z":"g30z","a":"g30a","b":"g30b","c":"g30c"},
+               "sys":{"fb":"fb","fbs":"fbs","fv":"fv","cv":"cv","hp":"hp",
+                      "hv":"hv","id":"id","ja":"ja","ct":"ct","sl":"sl",
+                      "lim":"lim","saf":"saf","mt":"mt","m48e":"m48e","mfoe":"mfoe",
+                      "mfo":"mfo","spep":"spep","spdp":"spdp","spph":"spph","spdw":"spdw",
+                      "cofp":"cofp","comp":"comp","coph":"coph","tv":"tv","ej":"ej",
+                      "jv":"jv","js":"js","qv":"qv","sv":"sv","si":"si",
+                      "gpl":"gpl","gun":"gun","gco":"gco","gpa":"gpa","gdi":"gdi"},
+               "p1":{"frq":"p1frq","csl":"p1csl","csh":"p1csh","cpl":"p1cpl","cph":"p1cph",
+                     "wsl":"p1wsl","wsh":"p1wsh","wpl":"p1wpl","wph":"p1wph","pof":"p1pof"},
+               "x":{"am":"xam","vm":"xvm","fr":"xfr","tn":"xtn","tm":"xtm",
+                    "jm":"xjm","jh":"xjh","jd":"xjd","hi":"xhi","hd":"xhd",
+                    "sv":"xsv","lv":"xlv","lb":"xlb","zb":"xzb"},
+               "y":{"am":"yam","vm":"yvm","fr":"yfr","tn":"ytn","tm":"ytm",
+                    "jm":"yjm","jh":"yjh","jd":"yjd","hi":"yhi","hd":"yhd",
+                    "sv":"ysv","lv":"ylv","lb":"ylb","zb":"yzb"},
+               "z":{"am":"zam","vm":"zvm","fr":"zfr","tn":"ztn","tm":"ztm",
+                    "jm":"zjm","jh":"zjh","jd":"zjd","hi":"zhi","hd":"zhd",
+                    "sv":"zsv","lv":"zlv","lb":"zlb","zb":"zzb"},
+               "a":{"am":"aam","vm":"avm","fr":"afr","tn":"atn","tm":"atm",
+                    "jm":"ajm","jh":"ajh","jd":"ajd","ra":"ara","hi":"ahi",
+                    "hd":"ahd","sv":"asv","lv":"alv","lb":"alb","zb":"azb"},
+               "b":{"am":"bam","vm":"bvm","fr":"bfr","tn":"btn","tm":"btm",
+                    "jm":"bjm","jh":"bjh","jd":"bjd","ra":"bra","hi":"bhi",
+                    "hd":"bhd","sv":"bsv","lv":"blv","lb":"blb","zb":"bzb"},
+               "c":{"am":"cam","vm":"cvm","fr":"cfr","tn":"ctn","tm":"ctm",
+                    "jm":"cjm","jh":"cjh","jd":"cjd","ra":"cra","hi":"chi",
+                    "hd":"chd","sv":"csv","lv":"clv","lb":"clb","zb":"czb"},
+               "1":{"ma":"1ma","sa":"1sa","tr":"1tr","mi":"1mi","po":"1po",
+                    "pm":"1pm","pl":"1pl"},
+               "2":{"ma":"2ma","sa":"2sa","tr":"2tr","mi":"2mi","po":"2po",
+                    "pm":"2pm","pl":"2pl"},
+               "3":{"ma":"3ma","sa":"3sa","tr":"3tr","mi":"3mi","po":"3po",
+                    "pm":"3pm","pl":"3pl"},
+               "4":{"ma":"4ma","sa":"4sa","tr":"4tr","mi":"4mi","po":"4po",
+                    "pm":"4pm","pl":"4pl"},
+               "5":{"ma":"5ma","sa":"5sa","tr":"5tr","mi":"5mi","po":"5po",
+                    "pm":"5pm","pl":"5pl"},
+               "6":{"ma":"6ma","sa":"6sa","tr":"6tr","mi":"6mi","po":"6po",
+                    "pm":"6pm","pl":"6pl"}}}
+
+
+def getDataDic(updates, dickey, data):
+    if type(data) is dict:
+        for k, value in data.items():
+            if type(dickey) is dict and k in dickey:
+                getDataDic(updates, dickey[k], value)
+    elif type(dickey) is not dict:
+        updates.append((dickey, data, "Value"))
+
+def getDataTxt(updates, txt):
+    if not txt or "]" not in txt:
+        return
+    i = txt.index("]")
+    key = txt[1:i]
+    value = txt[i+1:]
+    values = value.split("  ")
+    if len(values)>1:
+        description = values[0].strip()
+        unit = values[-1].strip()
+    else:
+        digits = [value.find(d) for d in "01" if d in value]
+        if not digits:
+            return
+        i = min(digits)
+        description = value[:i].strip()
+        unit = value[i:].strip()
+    updates.append((key, description, "Description"))
+    updates.append((key, unit, "Unit"))
+
+
+def classify(line):
+    """ Message type from the leading bytes, without decoding the line """
+    line = line.lstrip()
+    if not line.startswith("{"):
+        return "txt"
+    if line.startswith('{"r":'):
+        return "r"
+    if line.startswith('{"sr":'):
+        return "sr"
+    if line.startswith('{"qr":'):
+        return "qr"
+    if line.startswith('{"er":'):
+        return "er"
+    return "json"
+
+def parseQr(line):
+    """ Queue report fast path: {"qr":28} or triple {"qr":28,"qi":1,"qo":0} """
+    qr = {}
+    try:
+        for item in line.strip()[1:-1].split(","):
+            key, value = item.split(":")
+            qr[key.strip('" ')] = int(value)
+    except ValueError:
+        qr = json.loads(line)
+    return qr
+
+
+def parseFooter(line):
+    """ Bare footer fast path: {"r":{},"f":[1,0,8]} """
+    line = line.strip()
+    start = line.find('"f":[', 7)
+    end = line.find("]", start)
+    if not line.startswith('{"r":{},') or start == -1 or line[end:] != "]}":
+        return json.loads(line)
+    try:
+        return {"r": {}, "f": [int(v) for v in line[start + 5:end].split(",")]}
+    except ValueError:
+        return json.loads(line)
+
+
+class Parser(object):
+    """ Classify TinyG2 lines on their prefix and fully decode only the types
+        somebody subscribed to. Footers ("r") and text ($$ listings) are
+        flattened into (key, value, header) updates, header being one of the
+        model columns: "Value", "Description" or "Unit". Other types are
+        passed decoded to their listeners (called in the reactor thread). """
+
+    def __init__(self):
+        self.kinds = set(["r", "txt"])
+        self.listeners = {}
+        self.errors = 0
+        # Command round trip tracer, told of every footer
+        self.tracer = None
+
+    def subscribe(self, kind, listener=None):
+        # Listeners run in the reactor thread while other threads subscribe:
+        # lists are replaced, never modified in place
+        self.kinds.add(kind)
+        if listener is not None:
+            self.listeners[kind] = self.listeners.get(kind, []) + [listener]
+
+    def unsubscribe(self, kind, listener):
+        listeners = [l for l in self.listeners.get(kind, []) if l != listener]
+        self.listeners[kind] = listeners
+        if kind not in ("r", "txt") and not listeners:
+            self.kinds.discard(kind)
+
+    def parse(self, line):
+        updates = []
+        kind = classify(line)
+        if kind == "r" and self.tracer is not None:
+            self.tracer.onFooter(line)
+        if kind not in self.kinds:
+            return updates
+        if kind == "txt":
+            getDataTxt(updates, line)
+            return updates
+        # Bare footer of a streamed G-code line: nothing to update
+        footer = kind == "r" and line.lstrip().startswith('{"r":{}')
+        if footer and not self.listeners.get("r"):
+            return updates
+        try:
+            if kind == "qr":
+                d = parseQr(line)
+            elif footer:
+                d = parseFooter(line)
+            else:
+                d = json.loads(line)
+        except ValueError:
+            self.errors += 1
+            return updates
+        if kind == "r" and not footer:
+            getDataDic(updates, dickey["r"], d["r"])
+        for listener in self.listeners.get(kind, []):
+            listener(d)
+        return updates
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" TinyG2 G-code file uploader """
+from __future__ import unicode_literals
+
+from PySide import QtCore
+from App import GcodeFile, UsbTrace
+import collections, threading, time
+
+
+def getResumeFromLine(line):
+    """ ResumeLine (1 based, 0 from start) of file line (0 based) """
+    return line + 1
+
+def getLineFromResume(resume):
+    """ File line (0 based) an upload starts at for ResumeLine """
+    return max(0, resume - 1)
+
+
+class Uploader(QtCore.QRunnable):
+    """ Stream UploadFile on the data channel. Flow control uses the planner
+        free buffers of queue reports ({"qr":n}) minus the lines sent and not
+        yet acknowledged by a footer ({"r":...}), keeping Buffers slots free.
+        Only bare footers ({"r":{}}) ack G-code lines: on a single port the
+        footers of JSON commands (queue report polls, GUI) are not counted,
+        nor those of G-code lines written by other threads (terminal, GUI).
+        A job started at ResumeLine first restores the modal state. """
+
+    planner = 28    # TinyG2 planner buffers
+    inflight = 4    # max lines in the controller serial buffer (line mode)
+    period = 0.5    # progress report period (s)
+
+    def __init__(self, machine):
+        QtCore.QRunnable.__init__(self)
+        self.setAutoDelete(False)
+        self.machine = machine
+        obj = machine.obj
+        self.path = obj.UploadFile
+        self.buffers = obj.Buffers
+        self.timeout = max(obj.Timeout, 50) / 1000.0
+        self.state = obj.Proxy.getDataState(obj)
+        self.pipeline = obj.Proxy.getPipeline(obj)
+        self.cache = obj.Proxy.getJobCache(obj)
+        self.resume = obj.ResumeLine
+        self.resumeLine = self.resume
+        self.condition = threading.Condition()
+        self.free = None
+        self.sent = 0
+        self.acked = 0
+        self.foreign = 0    # G-code lines written by others, not yet acked
+        self.ident = None
+        self.pause = False
+        self.stop = False
+        self.report = time.time()
+        self.line = 0
+        self.total = 0
+        # Last lines sent, some may still be in the controller buffers
+        self.history = collections.deque(maxlen=self.planner + self.inflight)
+
+    def onQueueReport(self, qr):
+        with self.condition:
+            self.free = qr.get("qr", self.free)
+            self.report = time.time()
+            self.condition.notify()
+
+    def onResponse(self, r):
+        # Footer of a {"qr":null} request
+        if isinstance(r.get("r"), dict) and "qr" in r["r"]:
+            self.onQueueReport(r["r"])
+
+    def onFooter(self, r):
+        if not r.get("r"):
+            with self.condition:
+                if self.foreign:
+                    self.foreign -= 1
+                else:
+                    self.acked = min(self.sent, self.acked + 1)
+                self.report = time.time()
+                self.condition.notify()
+        self.onResponse(r)
+
+    def onWrite(self, data):
+        """ Lines written on the upload port by another thread """
+        if threading.current_thread().ident == self.ident:
+            return
+        count = sum(1 for l in data.splitlines() if l.strip() and not l.lstrip().startswith("{"))
+        if count:
+            with self.condition:
+                self.foreign += count
+
+    def setPause(self, pause):
+        with self.condition:
+            self.pause = pause
+            self.condition.notify()
+
+    def cancel(self):
+        with self.condition:
+            self.stop = True
+            self.condition.notify()
+
+    def isRunning(self):
+        return not self.stop and self.machine.run
+
+    def getPending(self):
+        return self.sent - self.acked
+
+    def getResumeLine(self):
+        """ Oldest line sent that may not have been executed yet """
+        with self.condition:
+            queued = self.getPending()
+            queued += self.planner if self.free is None else self.planner - self.free
+        if not self.history:
+            return self.resume
+        if not queued:
+            return self.history[-1] + 1
+        return self.history[max(0, len(self.history) - queued)]
+
+    def isReady(self):
+        return not self.pause and self.free is not None and\
+               self.getPending() < self.inflight and\
+               self.free - self.getPending() > self.buffers
+
+    def waitReady(self):
+        with self.condition:
+            while self.isRunning() and not self.isReady():
+                self.condition.wait(self.timeout)
+                if not self.pause and time.time() - self.report > self.timeout:
+                    # Nothing heard for Timeout: ask for a queue report
+                    self.report = time.time()
+                    self.machine.serialWrite('{"qr":null}')
+            return self.isRunning()
+
+    def run(self):
+        """ Upload the file with planner flow control """
+        # Footers come on the data channel, queue reports on both
+        parsers = [self.machine.getParser()]
+        if not self.state.isCtrlChannel():
+            parsers.append(self.machine.getDataParser())
+        for parser in parsers:
+            parser.subscribe("qr", self.onQueueReport)
+            parser.subscribe("r", self.onResponse if parser is not parsers[-1] else self.onFooter)
+        self.ident = threading.current_thread().ident
+        self.state.serialWrite.connect(self.onWrite, QtCore.Qt.DirectConnection)
+        self.machine.uploadStart.emit()
+        job, done = None, False
+        try:
+            # Preprocessed job from the cache, or recorded into it
+            job = self.cache.open(self.path, self.pipeline)
+            self.total = job.total
+            self.machine.serialWrite('{"qv":1}')
+            self.machine.serialWrite('{"qr":null}')
+            start, state = getLineFromResume(self.resume), None
+            if start:
+                state = self.restore(start)
+                if state is None:
+                    return
+            done = self.upload(job, start, state)
+        except Exception as e:
+            self.machine.uploadErrorMsg(e)
+        finally:
+            self.resumeLine = 0 if done else self.getResumeLine()
+            if job is not None:
+                job.close(done)
+                self.machine.uploadStatisticsMsg(self.pipeline.statistics, job.cached)
+            for parser in parsers:
+                parser.unsubscribe("qr", self.onQueueReport)
+                parser.unsubscribe("r", self.onResponse if parser is not parsers[-1] else self.onFooter)
+            self.state.serialWrite.disconnect(self.onWrite)
+            self.progress()
+            self.machine.uploadStop.emit()
+
+    def send(self, line):
+        if not self.waitReady():
+            return False
+        with self.condition:
+            self.sent += 1
+        self.state.serialWrite.emit(line)
+        return True
+
+    def restore(self, start):
+        """ Send the modal state of file line start (0 based), None if the
+            upload stopped """
+        with GcodeFile.GcodeFile(self.path) as f:
+            self.total = len(f)
+            state = f.getModalState(start)
+        self.line = start
+        self.machine.uploadResumeMsg(start + 1, state)
+        if not all(self.send(line) for line in state.getPreamble()):
+            return None
+        return state
+
+    def upload(self, job, first=0, state=None):
+        start, count = time.time(), 0
+        lines = job.getLines(first)
+        if state is not None:
+            lines = state.getLines(lines)
+        for index, line in lines:
+            self.line = index + 1
+            if not self.send(line.decode("utf-8", "replace")):
+                return False
+            self.history.append(self.line)
+            count += 1
+            now = time.time()
+            if now - start >= self.period:
+                self.progress(count / (now - start))
+                start, count = now, 0
+        return self.isRunning()
+
+    def progress(self, rate=0.0):
+        free = -1 if self.free is None else self.free - self.getPending()
+        UsbTrace.tracer.counter("upload", "upload", {"line": self.line, "rate": rate})
+        self.machine.uploadProgress.emit(self.line, self.total, rate, free)
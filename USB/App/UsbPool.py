@@ -24,8 +24,8 @@
 """ Usb Pool document object """
 from __future__ import unicode_literals
 
-import FreeCAD
-from App import UsbPoolMachine, PySerial
+import FreeCAD, os, time
+from App import UsbPoolMachine, PySerial, UsbTrace
 
 
 class Pool:
@@ -53,6 +53,35 @@ class Pool:
                             "End of line char (\\n, \\r, or \\r\\n)")
             obj.EndOfLine = self.getEndOfLine()
             #obj.EndOfLine = b"LF"
+        if "BatchDelay" not in obj.PropertiesList:
+            obj.addProperty("App::PropertyIntegerConstraint",
+                            "BatchDelay",
+                            "Base",
+                            "Received lines batching window before display (ms:0->1000)")
+            obj.BatchDelay = (16,0,1000,1)
+        if "BatchSize" not in obj.PropertiesList:
+            obj.addProperty("App::PropertyIntegerConstraint",
+                            "BatchSize",
+                            "Base",
+                            "Max received lines per batch (lines:1->10000)")
+            obj.BatchSize = (256,1,10000,1)
+        if "WriteQueue" not in obj.PropertiesList:
+            obj.addProperty("App::PropertyIntegerConstraint",
+                            "WriteQueue",
+                            "Base",
+                            "Max commands waiting to be written (commands:1->10000)")
+            obj.WriteQueue = (256,1,10000,1)
+        if "Trace" not in obj.PropertiesList:
+            obj.addProperty("App::PropertyBool",
+                            "Trace",
+                            "Base",
+                            "Record session events, dumped as Chrome trace when disabled")
+            obj.Trace = False
+        if "TraceFile" not in obj.PropertiesList:
+            obj.addProperty("App::PropertyFile",
+                            "TraceFile",
+                            "Base",
+                            "Chrome trace JSON file (default in USB/Trace user folder)")
         """ Link to PySerial document object """
         if "Serials" not in obj.PropertiesList:
             obj.addProperty("App::PropertyLinkList",
@@ -107,6 +136,48 @@ class Pool:
     def getCharEndOfLine(self, obj):
         return ["\n", "\r", "\r\n"][self.getIndexEndOfLine(obj)]
 
+    def getBatchDelay(self, obj):
+        # Documents saved before batching don't have these properties
+        return getattr(obj, "BatchDelay", 16) / 1000.0
+
+    def getBatchSize(self, obj):
+        return getattr(obj, "BatchSize", 256)
+
+    def getWriteQueue(self, obj):
+        return getattr(obj, "WriteQueue", 256)
+
+    def getTraceFile(self, obj):
+        path = getattr(obj, "TraceFile", "")
+        if path:
+            return path
+        folder = os.path.join(FreeCAD.getUserAppDataDir(), "USB", "Trace")
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        name = "{}-{}.json".format(obj.Name, time.strftime("%Y%m%d-%H%M%S"))
+        return os.path.join(folder, name)
+
+    def setTrace(self, obj):
+        tracer = UsbTrace.tracer
+        if obj.Trace:
+            tracer.start()
+            self.traceMsg(obj, "started")
+        elif tracer.enabled:
+            tracer.stop()
+            path = self.getTraceFile(obj)
+            try:
+                count = tracer.dump(path)
+            except (IOError, OSError) as e:
+                self.traceErrorMsg(obj, e)
+            else:
+                self.traceMsg(obj, "dumped {} events to {}".format(count, path))
+
+    def traceMsg(self, obj, msg):
+        FreeCAD.Console.PrintMessage("{} session trace {}\n".format(obj.Label, msg))
+
+    def traceErrorMsg(self, obj, e):
+        msg = "Error occurred in {} session trace dump: {}\n"
+        FreeCAD.Console.PrintError(msg.format(obj.Label, e))
+
     def getCtrlChannel(self, obj):
         return obj.Serials[0]
 
@@ -128,7 +199,8 @@ class Pool:
             self.Update = False            
 
     def onChanged(self, obj, prop):
-        pass
+        if prop == "Trace":
+            self.setTrace(obj)
 
 
 FreeCAD.Console.PrintLog("Loading UsbPool... done\n")
@@ -25,8 +25,8 @@
 from __future__ import unicode_literals
 
 from PySide import QtCore
-import FreeCAD
-from App import PySerialState
+import FreeCAD, threading, time
+from App import PySerialState, PySerialReactor
 
 
 class PoolMachine(QtCore.QStateMachine):
@@ -34,15 +34,21 @@ class PoolMachine(QtCore.QStateMachine):
     ctrlStart = QtCore.Signal()
     ctrlStop = QtCore.Signal()
     serialRead = QtCore.Signal(unicode)
+    serialReadBatch = QtCore.Signal(list)
+    serialParsed = QtCore.Signal(list)
     restart = QtCore.Signal(object)
+    stopTimeout = 5.0           # restart and shutdown wait bound (s)
 
     def __init__(self):
         QtCore.QStateMachine.__init__(self)
         self.pool = QtCore.QThreadPool(self)
         self.obj = None
-        self.run = False
+        self._run = False
         self.close = False
         self.plugin = None
+        # Set when the StateMachine stops: waiting threads don't poll
+        self.stopEvent = threading.Event()
+        self.stopEvent.set()
 
         On = OnState(QtCore.QState.ParallelStates, self)
         On.setObjectName("On")
@@ -58,6 +64,12 @@ class PoolMachine(QtCore.QStateMachine):
         self.setInitialState(On)
         self.Serials = [Serial0, Serial1]
         self.restart.connect(self.onRestart, QtCore.Qt.QueuedConnection)
+        self.finished.connect(self.onStop, QtCore.Qt.DirectConnection)
+        self.stopped.connect(self.onStop, QtCore.Qt.DirectConnection)
+
+    @QtCore.Slot()
+    def onStop(self):
+        self.stopEvent.set()
 
     @QtCore.Slot(object)
     def onRestart(self, obj):
@@ -74,6 +86,7 @@ class PoolMachine(QtCore.QStateMachine):
         obj.Document.recompute()
         self.setMachine(obj)
         self.run = True
+        self.stopEvent.clear()
         QtCore.QStateMachine.start(self)
 
     def setMachine(self, obj):
@@ -81,6 +94,40 @@ class PoolMachine(QtCore.QStateMachine):
         self.Serials[0].obj = obj.Serials[0]
         self.Serials[1].setParent(None)
 
+    @property
+    def run(self):
+        return self._run
+
+    @run.setter
+    def run(self, run):
+        self._run = run
+        # Reactor must see it to close our channels
+        if not run:
+            PySerialReactor.wakeup()
+
+    def waitForStop(self, timeout=None):
+        """ Wait for the StateMachine to stop and the reactors to close its
+            channels. Must not be called from the GUI thread: the Qt event
+            loop stops the StateMachine. """
+        deadline = None if timeout is None else time.time() + timeout
+        if not self.stopEvent.wait(timeout):
+            return False
+        if deadline is not None:
+            timeout = max(0, deadline - time.time())
+        return PySerialReactor.waitForDone(self, timeout)
+
+    def waitForDone(self, timeout=None):
+        """ Wait for the reactors and the threads of the pool, at most
+            timeout seconds (default stopTimeout) """
+        timeout = self.stopTimeout if timeout is None else timeout
+        start = time.time()
+        done = PySerialReactor.waitForDone(self, timeout)
+        msecs = max(0, int((timeout - time.time() + start) * 1000))
+        done = self.pool.waitForDone(msecs) and done
+        if not done:
+            self.stopTimeoutMsg("shutdown", timeout)
+        return done
+
     def halt(self):
         self.close = False
         self.run = False
@@ -88,21 +135,57 @@ class PoolMachine(QtCore.QStateMachine):
     def stop(self):
         self.close = True
         self.run = False
+        self.startThread(WaitMachine(self))
 
     @QtCore.Slot(unicode)
     def serialWrite(self, data):
         self.getCtrlState().serialWrite.emit(data)
 
+    def realtimeWrite(self, data):
+        """ Write data on the control channel ahead of any queued command """
+        if self.run:
+            self.getCtrlState().realtimeWrite(data)
+
     def getCtrlState(self):
         return self.obj.Proxy.getCtrlState(self.obj)
 
     def getCharEndOfLine(self):
         return self.obj.Proxy.getCharEndOfLine(self.obj)
 
+    def getParser(self):
+        # Plugin machines may return a parser run in the reactor thread
+        return None
+
+    def getDataParser(self):
+        # Parser of a data channel on its own port (DualPort)
+        return None
+
+    def getTracer(self):
+        # Plugin machines may time the commands of the control channel
+        return None
+
+    def getBatchDelay(self):
+        return self.obj.Proxy.getBatchDelay(self.obj)
+
+    def getBatchSize(self):
+        return self.obj.Proxy.getBatchSize(self.obj)
+
+    def getWriteQueue(self):
+        return self.obj.Proxy.getWriteQueue(self.obj)
+
     def machineErrorMsg(self, e):
         msg = "Error occurred in {} StateMachine: {}\n"
         FreeCAD.Console.PrintError(msg.format(self.obj.Label, e))
 
+    def stopTimeoutMsg(self, action, timeout=None):
+        msg = "{} StateMachine not stopped after {} s: {} aborted!!!\n"
+        timeout = self.stopTimeout if timeout is None else timeout
+        FreeCAD.Console.PrintWarning(msg.format(self.obj.Label, timeout, action))
+
+    def stopMsg(self):
+        msg = "{} StateMachine stop... done\n"
+        FreeCAD.Console.PrintLog(msg.format(self.obj.Label))
+
     def startThread(self, thread):
         if not self.pool.maxThreadCount() > self.pool.activeThreadCount():
             self.pool.setMaxThreadCount(self.pool.activeThreadCount() +1)
@@ -142,10 +225,11 @@ class WaitMachine(QtCore.QRunnable):
         self.machine = machine
 
     def run(self):
-        """ Wait for StateMachine stop"""
+        """ Wait for StateMachine stop """
         try:
-            while self.machine.running:
-                pass
-            print "WaitMachine.done"
+            if self.machine.waitForStop(self.machine.stopTimeout):
+                self.machine.stopMsg()
+            else:
+                self.machine.stopTimeoutMsg("stop")
         except Exception as e:
             self.machine.machineErrorMsg(e)
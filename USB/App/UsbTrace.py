@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" Usb session tracer: spans and events in a bounded ring, dumped as a
+    Chrome trace (chrome://tracing, Perfetto) """
+from __future__ import unicode_literals
+
+import collections, json, os, threading
+from App import PySerialMetrics
+
+
+# Monotonic clock of the latency metrics
+clock = PySerialMetrics.clock
+
+
+class Tracer(object):
+    """ Record events in a ring of size events, the oldest being dropped.
+        While off, call sites only pay for now() returning None:
+
+            start = tracer.now()
+            ...
+            if start is not None:
+                tracer.complete("read", "reactor", start, {"bytes": size})
+
+        Events are tuples appended to a deque (atomic), they are converted
+        to the Chrome trace format on dump. """
+
+    def __init__(self, size=65536):
+        self.enabled = False
+        self.events = collections.deque(maxlen=size)
+        self.threads = {}
+
+    def start(self, size=None):
+        if size is not None and size != self.events.maxlen:
+            self.events = collections.deque(maxlen=size)
+        self.events.clear()
+        self.threads = {}
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def now(self):
+        return clock() if self.enabled else None
+
+    def getThread(self):
+        thread = threading.current_thread()
+        if thread.ident not in self.threads:
+            self.threads[thread.ident] = thread.name
+        return thread.ident
+
+    def complete(self, name, cat, start, args=None):
+        """ Span from start (a now() value) to now """
+        if self.enabled:
+            self.events.append(("X", name, cat, start, clock() - start,
+                                self.getThread(), args))
+
+    def instant(self, name, cat, args=None):
+        if self.enabled:
+            self.events.append(("i", name, cat, clock(), 0,
+                                self.getThread(), args))
+
+    def counter(self, name, cat, values):
+        if self.enabled:
+            self.events.append(("C", name, cat, clock(), 0,
+                                self.getThread(), values))
+
+    def getEvents(self):
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                   "args": {"name": name}} for tid, name in list(self.threads.items())]
+        for ph, name, cat, ts, dur, tid, args in list(self.events):
+            event = {"name": name, "cat": cat, "ph": ph, "pid": pid,
+                     "tid": tid, "ts": ts * 1e6}
+            if ph == "X":
+                event["dur"] = dur * 1e6
+            elif ph == "i":
+                event["s"] = "t"
+            if args:
+                event["args"] = args
+            events.append(event)
+        return events
+
+    def dump(self, path):
+        """ Write the ring as a Chrome trace JSON file """
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.getEvents(),
+                       "displayTimeUnit": "ms"}, f)
+        return len(self.events)
+
+
+tracer = Tracer()
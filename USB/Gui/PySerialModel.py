@@ -26,6 +26,7 @@ from __future__ import unicode_literals
 
 from PySide import QtCore, QtGui
 import serial
+from App import PySerialMetrics
 
 
 class PySerialBaseModel(QtCore.QAbstractItemModel):
@@ -102,19 +103,42 @@ class PySerialModel(PySerialBaseModel):
         PySerialBaseModel.__init__(self)
         self.obj = obj
         self.obj.Proxy.initSerial(self.obj)
-        state = obj.Proxy.getMachineState(obj)
-        state.serialOpen.connect(self.updateModel)
-        state.serialClose.connect(self.updateModel)
-        state.serialError.connect(self.updateModel)
+        self.state = obj.Proxy.getMachineState(obj)
+        self.metrics = {}
+        # Metrics rows follow the port properties, refreshed while open
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.updateMetrics)
+        self.state.serialOpen.connect(self.updateModel)
+        self.state.serialClose.connect(self.updateModel)
+        self.state.serialError.connect(self.updateModel)
         self.updateModel()
 
     @QtCore.Slot()
     def updateModel(self):
-        properties = self.getProperties()
+        properties = self.getProperties() + PySerialMetrics.Metrics.names
         if self.rowCount() != len(properties):
             self.beginResetModel()
             self.properties = properties
             self.endResetModel()
+        self.updateMetrics()
+        if self.isOpen():
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    @QtCore.Slot()
+    def updateMetrics(self):
+        self.metrics = self.state.getMetrics()
+        first = len(self.properties) - len(PySerialMetrics.Metrics.names)
+        self.dataChanged.emit(self.index(first, 1), self.index(self.rowCount() - 1, 1))
+
+    def isOpen(self):
+        # Need to try: on close document serialClose is emited... and obj already deleted
+        try:
+            return self.obj.Proxy.Serial.is_open
+        except ReferenceError:
+            return False
 
     def getProperties(self):
         # Need to try: on close document serialClose is emited... and obj already deleted
@@ -128,7 +152,11 @@ class PySerialModel(PySerialBaseModel):
             return None
         if role == QtCore.Qt.DisplayRole:
             prop = self.properties[index.row()]
-            if index.column():
+            if index.column() and prop in self.metrics:
+                if prop == "Latency":
+                    return "{}".format(self.state.metrics.latency)
+                return "{}".format(self.metrics[prop])
+            elif index.column():
                 attr = getattr(self.obj.Proxy.Serial, prop)
                 if hasattr(attr, "__self__"):
                     try:
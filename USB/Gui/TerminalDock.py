@@ -111,7 +111,7 @@ class TerminalDock(QtGui.QDockWidget):
         obj = state.machine().obj
         self.setWindowTitle("{} terminal on {}".format(obj.Label, state.obj.Label))
         self.setObjectName("{}-{}".format(obj.Document.Name, obj.Name))
-        state.serialRead.connect(self.on_output)
+        state.serialReadBatch.connect(self.on_output)
         state.machine().finished.connect(self.finished)
         if obj.ViewObject.DualView:
             terminal = QtGui.QSplitter(QtCore.Qt.Vertical)
@@ -129,9 +129,9 @@ class TerminalDock(QtGui.QDockWidget):
             terminal.layout().addWidget(self.output)
         self.setWidget(terminal)
 
-    @QtCore.Slot(unicode)
-    def on_output(self, data):
-        self.output.insertPlainText(data)
+    @QtCore.Slot(list)
+    def on_output(self, lines):
+        self.output.insertPlainText("".join(lines))
         self.output.ensureCursorVisible()
 
     @QtCore.Slot()    
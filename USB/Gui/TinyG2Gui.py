@@ -24,19 +24,24 @@
 """ TinyG2 ViewProvider Plugin object """
 from __future__ import unicode_literals
 
-import FreeCADGui
+import FreeCAD, FreeCADGui, os
+from App import PositionStore, PathSimplify, GcodePreview, TinyG2Upload
 from Gui import UsbPoolGui, TinyG2Panel, TinyG2Model
 from pivy import coin
 
 
 class _ViewProviderPool(UsbPoolGui._ViewProviderPool):
 
+    pathName = b"TinyG2Path"
+    previewName = b"TinyG2Preview"
+
     def __init__(self, vobj): #mandatory
         self.Model = TinyG2Model.PoolModel(vobj.Object)
         self.Type = "Gui::UsbTinyG2"
         for p in vobj.PropertiesList:
             if vobj.getGroupOfProperty(p) in ["Drawing", "Terminal"]:
-                if p not in ["Buffers", "Color", "Draw", "Positions", "DualView", "EchoFilter"]:
+                if p not in ["Buffers", "Color", "Draw", "MaxPoints", "Positions", "Preview",
+                             "PreviewColor", "Tolerance", "DualView", "EchoFilter"]:
                     vobj.removeProperty(p)
         if "Buffers" not in vobj.PropertiesList:
             vobj.addProperty("App::PropertyInteger",
@@ -56,12 +61,36 @@ class _ViewProviderPool(UsbPoolGui._ViewProviderPool):
                              "Drawing",
                              "Draw positions received during upload")
             vobj.Draw = True
+        if "Tolerance" not in vobj.PropertiesList:
+            vobj.addProperty("App::PropertyFloat",
+                             "Tolerance",
+                             "Drawing",
+                             "Path simplification tolerance, 0 draws every position (mm)")
+            vobj.Tolerance = 0.0
+        if "MaxPoints" not in vobj.PropertiesList:
+            vobj.addProperty("App::PropertyInteger",
+                             "MaxPoints",
+                             "Drawing",
+                             "Max points drawn per level of detail (simplified further beyond) or preview")
+            vobj.MaxPoints = 1000000
+        if "Preview" not in vobj.PropertiesList:
+            vobj.addProperty("App::PropertyBool",
+                             "Preview",
+                             "Drawing",
+                             "Draw the toolpath of the upload file")
+            vobj.Preview = False
+        if "PreviewColor" not in vobj.PropertiesList:
+            vobj.addProperty("App::PropertyColor",
+                             "PreviewColor",
+                             "Drawing",
+                             "Upload file toolpath color")
+            vobj.PreviewColor = (0.0, 0.5, 1.0)
         if "Positions" not in vobj.PropertiesList:
             vobj.addProperty("App::PropertyPythonObject",
                              "Positions",
                              "Drawing",
-                             "List of positions acquired during upload")
-            vobj.Positions = []
+                             "Positions acquired during upload")
+            vobj.Positions = PositionStore.PositionStore()
         if "DualView" not in vobj.PropertiesList:
             vobj.addProperty("App::PropertyBool",
                              "DualView",
@@ -75,33 +104,214 @@ class _ViewProviderPool(UsbPoolGui._ViewProviderPool):
                              "Filter terminal echo during upload")
             vobj.EchoFilter = True
         self.Object = vobj.Object
+        self.setPositions(vobj)
+        self.setPreview(vobj)
         vobj.Proxy = self
 
     def attach(self, vobj):
         self.Model = TinyG2Model.PoolModel(vobj.Object)
         self.Type = "Gui::UsbTinyG2"
         self.Object = vobj.Object
+        self.setPositions(vobj)
+        self.setPreview(vobj)
+
+    def setPositions(self, vobj):
+        positions = vobj.Positions
+        if not isinstance(positions, PositionStore.PositionStore):
+            # Documents saved with a list of positions
+            positions = PositionStore.PositionStore()
+            positions.extend(vobj.Positions or [])
+            vobj.Positions = positions
+        self.View = PositionStore.PositionView(positions)
+        vobj.Object.Proxy.Machine.setPositions(positions)
+        if getattr(self, "Levels", None) is not None:
+            self.Levels.close()
+        self.Levels = None
+        if vobj.Tolerance > 0:
+            self.Levels = PathSimplify.Levels(positions, vobj.Tolerance, self.onLevels)
+        self.attachPath(vobj)
+        self.updatePositions(vobj, True)
+
+    def attachPath(self, vobj):
+        """ One polyline node for the whole path: its coordinates are
+            extended in place, their capacity growing geometrically. With a
+            Tolerance the path is drawn by levels of detail instead: one
+            polyline per level, chosen by camera distance (SoLOD). """
+        for i in reversed(range(vobj.RootNode.getNumChildren())):
+            if vobj.RootNode.getChild(i).getName().getString() == self.pathName:
+                vobj.RootNode.removeChild(i)
+        self.Coordinate = coin.SoCoordinate3()
+        self.Coordinate.point.setNum(0)
+        self.Material = coin.SoBaseColor()
+        self.Material.rgb = vobj.Color[0:3]
+        self.LineSet = coin.SoLineSet()
+        self.LineSet.numVertices.setValue(0)
+        raw = coin.SoSeparator()
+        raw.addChild(self.Coordinate)
+        raw.addChild(self.LineSet)
+        self.LevelNodes = []
+        self.LevelOfDetail = coin.SoLOD()
+        for simplifier in self.Levels.simplifiers if self.Levels else []:
+            level = coin.SoSeparator()
+            level.addChild(coin.SoCoordinate3())
+            level.addChild(coin.SoLineSet())
+            self.LevelOfDetail.addChild(level)
+            self.LevelNodes.append(level)
+        self.LevelCapacity = [0] * len(self.LevelNodes)
+        self.Switch = coin.SoSwitch()
+        self.Switch.addChild(raw)
+        self.Switch.addChild(self.LevelOfDetail)
+        self.Switch.whichChild = 0 if self.Levels is None else 1
+        self.Path = coin.SoSeparator()
+        self.Path.setName(self.pathName)
+        self.Path.addChild(self.Material)
+        self.Path.addChild(self.Switch)
+        vobj.RootNode.addChild(self.Path)
+        self.Capacity = 0
+
+    def onLevels(self, levels, bounds):
+        """ New points of every level, simplified in the thread pool: like
+            the raw path, coordinates are written from the first changed
+            point, their capacity growing geometrically """
+        for i, (node, level) in enumerate(zip(self.LevelNodes, levels)):
+            coordinate, lineset = node.getChild(0), node.getChild(1)
+            if level.reset:
+                self.LevelCapacity[i] = 0
+                coordinate.point.setNum(0)
+            if level.count > self.LevelCapacity[i]:
+                self.LevelCapacity[i] = max(level.count, 2 * self.LevelCapacity[i], 1024)
+                coordinate.point.setNum(self.LevelCapacity[i])
+            po = level.points
+            if hasattr(po, "tolist"):
+                po = po.tolist()
+            if po:
+                coordinate.point.setValues(level.start, len(po), po)
+            lineset.numVertices.setValue(level.count)
+        if not bounds:
+            return
+        # Coarser level each time the camera distance doubles the path size
+        low, high = bounds
+        size = max(1.0, sum((high[i] - low[i]) ** 2 for i in range(3)) ** 0.5)
+        self.LevelOfDetail.center.setValue([(low[i] + high[i]) / 2 for i in range(3)])
+        self.LevelOfDetail.range.setValues(0, len(levels) - 1,
+                                           [size * 2 ** (i + 1) for i in range(len(levels) - 1)])
+
+    def setPreview(self, vobj):
+        """ Toolpath of UploadFile, built off the GUI thread in its own node """
+        if not hasattr(self, "Previewer"):
+            self.Previewer = GcodePreview.Previewer(self.onPreview)
+            self.Observer = PreviewObserver(self)
+            self.ViewObject = vobj
+        self.Preview = None
+        self.attachPreview(vobj, [])
+        # Picking the path sets ResumeLine while a preview is drawn
+        FreeCADGui.Selection.removeObserver(self.Observer)
+        if vobj.Preview:
+            FreeCADGui.Selection.addObserver(self.Observer)
+        path = vobj.Object.UploadFile
+        # Work offsets read from the controller place the moves in other
+        # offsets (or G53) relative to the one the live path is reported in
+        self.Offsets = self.Model.getOffsets()
+        if vobj.Preview and os.path.isfile(path):
+            self.Previewer.update(path, offsets=self.Offsets, tolerance=vobj.Tolerance or 0.01)
+
+    def updateOffsets(self, vobj):
+        """ Build the preview again when the controller work offsets changed """
+        if hasattr(self, "Previewer") and vobj.Preview and self.Model.getOffsets() != self.Offsets:
+            self.setPreview(vobj)
+
+    def onPreview(self, preview, error):
+        vobj = self.ViewObject
+        if error is not None:
+            self.previewErrorMsg(vobj, error)
+            return
+        if not vobj.Preview or preview.path != vobj.Object.UploadFile:
+            return
+        self.Preview = preview
+        self.attachPreview(vobj, PathSimplify.thin(preview.points, vobj.MaxPoints))
+        self.previewMsg(vobj, preview)
+
+    def attachPreview(self, vobj, points):
+        for i in reversed(range(vobj.RootNode.getNumChildren())):
+            if vobj.RootNode.getChild(i).getName().getString() == self.previewName:
+                vobj.RootNode.removeChild(i)
+        if not len(points):
+            return
+        if hasattr(points, "tolist"):
+            points = points.tolist()
+        self.PreviewMaterial = coin.SoBaseColor()
+        self.PreviewMaterial.rgb = vobj.PreviewColor[0:3]
+        coordinate = coin.SoCoordinate3()
+        coordinate.point.setValues(0, len(points), points)
+        lineset = coin.SoLineSet()
+        lineset.numVertices.setValue(len(points))
+        node = coin.SoSeparator()
+        node.setName(self.previewName)
+        node.addChild(self.PreviewMaterial)
+        node.addChild(coordinate)
+        node.addChild(lineset)
+        vobj.RootNode.addChild(node)
+
+    def pick(self, vobj, point):
+        """ Resume the upload file at the line of the segment nearest to point """
+        if self.Preview is None or vobj.Object.Start:
+            return
+        found = self.Preview.pick(point)
+        if found is None or found[0] < 0:
+            return
+        line, offset, distance = found
+        vobj.Object.ResumeLine = TinyG2Upload.getResumeFromLine(line)
+        self.pickMsg(vobj, vobj.Object.ResumeLine, offset, distance)
+
+    def previewMsg(self, vobj, preview):
+        msg = "{} toolpath preview of {}: {} points\n"
+        FreeCAD.Console.PrintMessage(msg.format(vobj.Object.Label, preview.path, len(preview)))
+
+    def pickMsg(self, vobj, line, offset, distance):
+        msg = "{} resume line set to {} (byte {}, {:.3f} mm from pick)\n"
+        FreeCAD.Console.PrintMessage(msg.format(vobj.Object.Label, line, offset, distance))
+
+    def previewErrorMsg(self, vobj, e):
+        msg = "Error occurred in {} toolpath preview: {}\n"
+        FreeCAD.Console.PrintError(msg.format(vobj.Object.Label, e))
+
+    def updateData(self, obj, prop):
+        UsbPoolGui._ViewProviderPool.updateData(self, obj, prop)
+        if prop == "UploadFile" and hasattr(self, "Previewer"):
+            self.setPreview(obj.ViewObject)
 
     def onChanged(self, vobj, prop):
-        if prop == "Positions":
-            if not vobj.Draw:
-                return
-            if vobj.Proxy.indexPosition:
-                po = list(vobj.Positions[vobj.Proxy.indexPosition-1:])
-            else:
-                po = list(vobj.Positions[vobj.Proxy.indexPosition:])
-            vobj.Proxy.indexPosition = len(vobj.Positions)
-            co = coin.SoCoordinate3()
-            co.point.setValues(0, len(po), po)
-            ma = coin.SoBaseColor()
-            ma.rgb = vobj.Color[0:3]
-            li = coin.SoLineSet()
-            li.numVertices.setValue(len(po))
-            no = coin.SoSeparator()
-            no.addChild(co)
-            no.addChild(ma)
-            no.addChild(li)
-            vobj.RootNode.addChild(no)
+        if prop == "Positions" and hasattr(self, "View"):
+            # Set on document restore: positions are appended in place
+            if vobj.Positions is not self.View.store:
+                self.setPositions(vobj)
+        if prop == "Color" and hasattr(self, "Material"):
+            self.Material.rgb = vobj.Color[0:3]
+        if prop in ("Tolerance", "MaxPoints") and hasattr(self, "View"):
+            self.setPositions(vobj)
+        if prop in ("Preview", "Tolerance", "MaxPoints") and hasattr(self, "Previewer"):
+            self.setPreview(vobj)
+        if prop == "PreviewColor" and hasattr(self, "PreviewMaterial"):
+            self.PreviewMaterial.rgb = vobj.PreviewColor[0:3]
+
+    def updatePositions(self, vobj, force=False):
+        """ Append the positions stored since the last call to the path """
+        if not vobj.Draw or (not force and self.View.getPending() < vobj.Buffers):
+            return
+        start, po = self.View.take()
+        if self.Levels is not None:
+            self.Levels.update(vobj.MaxPoints)
+            return
+        if not len(po):
+            return
+        if hasattr(po, "tolist"):
+            po = po.tolist()
+        count = start + len(po)
+        if count > self.Capacity:
+            self.Capacity = max(count, 2 * self.Capacity, 1024)
+            self.Coordinate.point.setNum(self.Capacity)
+        self.Coordinate.point.setValues(start, len(po), po)
+        self.LineSet.numVertices.setValue(count)
 
     def setEdit(self, vobj, mode=0):
         # this is executed when the object is double-clicked in the tree
@@ -109,3 +319,15 @@ class _ViewProviderPool(UsbPoolGui._ViewProviderPool):
             return
         panel = TinyG2Panel.PoolTaskPanel(vobj.Object)
         FreeCADGui.Control.showDialog(panel)
+
+
+class PreviewObserver(object):
+    """ Selection observer: a point picked on the TinyG2 object """
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+
+    def addSelection(self, doc, obj, sub, pnt):
+        vobj = self.proxy.ViewObject
+        if doc == vobj.Object.Document.Name and obj == vobj.Object.Name:
+            self.proxy.pick(vobj, pnt)
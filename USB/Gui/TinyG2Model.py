@@ -27,6 +27,7 @@ from __future__ import unicode_literals
 from PySide import QtCore, QtGui
 import json
 import copy
+from App import TinyG2Parser
 
 
 class Node(object):
@@ -69,6 +70,11 @@ def makeData(data, tree, header):
     for child in tree.child:
         makeData(data, child, header)
 
+def makeNode(nodes, tree):
+    nodes[tree.key] = tree
+    for child in tree.child:
+        makeNode(nodes, child)
+
 def makeCmd(cmd, dic, path):
     if type(dic) is dict:
         for k, value in dic.iteritems():
@@ -83,6 +89,7 @@ class PoolBaseModel(QtCore.QAbstractItemModel):
 
     title = QtCore.Signal(unicode)
     rootIndex = QtCore.Signal(QtCore.QModelIndex)
+    upload = QtCore.Signal(int, int, float, int)
 
     def __init__(self):
         QtCore.QAbstractItemModel.__init__(self)
@@ -94,55 +101,7 @@ class PoolBaseModel(QtCore.QAbstractItemModel):
         self.initcmd = ['{"unit":n}','{"o":n}','{"sys":n}','{"p1":n}',
                         '{"q":n}','{"m":n}','{"r":n}', '$$']
 
-        self.dickey = {"r":{"unit":"unit",
-                            "g54":{"x":"g54x","y":"g54y","z":"g54z","a":"g54a","b":"g54b","c":"g54c"},
-                            "g55":{"x":"g55x","y":"g55y","z":"g55z","a":"g55a","b":"g55b","c":"g55c"},
-                            "g56":{"x":"g56x","y":"g56y","z":"g56z","a":"g56a","b":"g56b","c":"g56c"},
-                            "g57":{"x":"g57x","y":"g57y","z":"g57z","a":"g57a","b":"g57b","c":"g57c"},
-                            "g58":{"x":"g58x","y":"g58y","z":"g58z","a":"g58a","b":"g58b","c":"g58c"},
-                            "g59":{"x":"g59x","y":"g59y","z":"g59z","a":"g59a","b":"g59b","c":"g59c"},
-                            "g92":{"x":"g92x","y":"g92y","z":"g92z","a":"g92a","b":"g92b","c":"g92c"},
-                            "g28":{"x":"g28x","y":"g28y","z":"g28z","a":"g28a","b":"g28b","c":"g28c"},
-                            "g30":{"x":"g30x","y":"g30y","z":"g30z","a":"g30a","b":"g30b","c":"g30c"},
-                            "sys":{"fb":"fb","fbs":"fbs","fv":"fv","cv":"cv","hp":"hp",
-                                   "hv":"hv","id":"id","ja":"ja","ct":"ct","sl":"sl",
-                                   "lim":"lim","saf":"saf","mt":"mt","m48e":"m48e","mfoe":"mfoe",
-                                   "mfo":"mfo","spep":"spep","spdp":"spdp","spph":"spph","spdw":"spdw",
-                                   "cofp":"cofp","comp":"comp","coph":"coph","tv":"tv","ej":"ej",
-                                   "jv":"jv","js":"js","qv":"qv","sv":"sv","si":"si",
-                                   "gpl":"gpl","gun":"gun","gco":"gco","gpa":"gpa","gdi":"gdi"},
-                            "p1":{"frq":"p1frq","csl":"p1csl","csh":"p1csh","cpl":"p1cpl","cph":"p1cph",
-                                  "wsl":"p1wsl","wsh":"p1wsh","wpl":"p1wpl","wph":"p1wph","pof":"p1pof"},
-                            "x":{"am":"xam","vm":"xvm","fr":"xfr","tn":"xtn","tm":"xtm",
-                                 "jm":"xjm","jh":"xjh","jd":"xjd","hi":"xhi","hd":"xhd",
-                                 "sv":"xsv","lv":"xlv","lb":"xlb","zb":"xzb"},
-                            "y":{"am":"yam","vm":"yvm","fr":"yfr","tn":"ytn","tm":"ytm",
-                                 "jm":"yjm","jh":"yjh","jd":"yjd","hi":"yhi","hd":"yhd",
-                                 "sv":"ysv","lv":"ylv","lb":"ylb","zb":"yzb"},
-                            "z":{"am":"zam","vm":"zvm","fr":"zfr","tn":"ztn","tm":"ztm",
-                                 "jm":"zjm","jh":"zjh","jd":"zjd","hi":"zhi","hd":"zhd",
-                                 "sv":"zsv","lv":"zlv","lb":"zlb","zb":"zzb"},
-                            "a":{"am":"aam","vm":"avm","fr":"afr","tn":"atn","tm":"atm",
-                                 "jm":"ajm","jh":"ajh","jd":"ajd","ra":"ara","hi":"ahi",
-                                 "hd":"ahd","sv":"asv","lv":"alv","lb":"alb","zb":"azb"},
-                            "b":{"am":"bam","vm":"bvm","fr":"bfr","tn":"btn","tm":"btm",
-                                 "jm":"bjm","jh":"bjh","jd":"bjd","ra":"bra","hi":"bhi",
-                                 "hd":"bhd","sv":"bsv","lv":"blv","lb":"blb","zb":"bzb"},
-                            "c":{"am":"cam","vm":"cvm","fr":"cfr","tn":"ctn","tm":"ctm",
-                                 "jm":"cjm","jh":"cjh","jd":"cjd","ra":"cra","hi":"chi",
-                                 "hd":"chd","sv":"csv","lv":"clv","lb":"clb","zb":"czb"},
-                            "1":{"ma":"1ma","sa":"1sa","tr":"1tr","mi":"1mi","po":"1po",
-                                 "pm":"1pm","pl":"1pl"},
-                            "2":{"ma":"2ma","sa":"2sa","tr":"2tr","mi":"2mi","po":"2po",
-                                 "pm":"2pm","pl":"2pl"},
-                            "3":{"ma":"3ma","sa":"3sa","tr":"3tr","mi":"3mi","po":"3po",
-                                 "pm":"3pm","pl":"3pl"},
-                            "4":{"ma":"4ma","sa":"4sa","tr":"4tr","mi":"4mi","po":"4po",
-                                 "pm":"4pm","pl":"4pl"},
-                            "5":{"ma":"5ma","sa":"5sa","tr":"5tr","mi":"5mi","po":"5po",
-                                 "pm":"5pm","pl":"5pl"},
-                            "6":{"ma":"6ma","sa":"6sa","tr":"6tr","mi":"6mi","po":"6po",
-                                 "pm":"6pm","pl":"6pl"}}}
+        self.dickey = TinyG2Parser.dickey
 
         treekey = ["o",["g54",["g54x","g54y","g54z","g54a","g54b","g54c"],
                         "g55",["g55x","g55y","g55z","g55a","g55b","g55c"],
@@ -183,6 +142,8 @@ class PoolBaseModel(QtCore.QAbstractItemModel):
         self.dataKey = {}
         makeData(self.dataKey, self.treeKey, self._header)
         self.dataKey["unit"][self._header.index("Value")] = unit
+        self.nodeKey = {}
+        makeNode(self.nodeKey, self.treeKey)
         self.cmdKey = {}
         makeCmd(self.cmdKey, self.dickey["r"], ["r"])
 
@@ -249,6 +210,19 @@ class PoolBaseModel(QtCore.QAbstractItemModel):
     def getUnit(self):
         return self.dataKey["unit"][self._header.index("Value")]
 
+    def getOffsets(self):
+        """ Known G54-G59 work offsets of the controller: {54.0: (x, y, z)} in mm """
+        scale = 25.4 if self.getUnit() == 0 else 1.0
+        value = self._header.index("Value")
+        offsets = {}
+        for code in range(54, 60):
+            try:
+                offsets[float(code)] = tuple(float(self.dataKey["g{}{}".format(code, a)][value]) * scale
+                                             for a in "xyz")
+            except (TypeError, ValueError):
+                continue
+        return offsets
+
     @QtCore.Slot(QtCore.QPoint, int)
     def onUnit(self, pos, index):
         pass
@@ -269,7 +243,9 @@ class PoolModel(PoolBaseModel):
         PoolBaseModel.__init__(self)
         self.obj = obj
         obj.Proxy.Machine.ctrlStart.connect(self.onCtrlStart)
-        obj.Proxy.Machine.serialRead.connect(self.onSerialRead)
+        obj.Proxy.Machine.serialParsed.connect(self.onSerialParsed)
+        obj.Proxy.Machine.uploadProgress.connect(self.upload)
+        obj.Proxy.Machine.positionsAdded.connect(self.onPositionsAdded)
 
     @QtCore.Slot()    
     def onCtrlStart(self):
@@ -277,47 +253,37 @@ class PoolModel(PoolBaseModel):
         eol = self.obj.Proxy.getCharEndOfLine(self.obj)
         self.obj.Proxy.Machine.serialWrite(eol.join(self.initcmd))      
         
-    @QtCore.Slot(unicode)    
-    def onSerialRead(self, data):
-        try:
-            d = json.loads(data)
-        except ValueError:
-            self.onDataTxt(data)
-        else:
-            if d.has_key("r"):
-                self.getDataDic(self.dickey["r"], d["r"])
-
-    def onDataTxt(self, txt):
-        if not txt or "]" not in txt:
-            return
-        i = txt.index("]")
-        key = txt[1:i]
-        if not self.dataKey.has_key(key):
-            return
-        value = txt[i+1:]
-        values = value.split("  ")
-        if len(values)>1:
-            description = values[0].strip()
-            unit = values[-1].strip()
-        else:
-            i = min(value.index("0"), value.index("1"))
-            description = value[:i].strip()
-            unit = value[i:].strip()
-        self.setDataKey(key, description, "Description")
-        self.setDataKey(key, unit, ("Unit (inches)", "Unit (mm)"))
-
-    def getDataDic(self, dickey, data):
-        if type(data) is dict:
-            for k, value in data.iteritems():
-                if type(dickey) is dict and dickey.has_key(k):
-                    self.getDataDic(dickey[k], value)
-        else:
-            self.setDataKey(dickey, data, "Value")
+    @QtCore.Slot(int)
+    def onPositionsAdded(self, count):
+        vobj = self.obj.ViewObject
+        vobj.Proxy.updatePositions(vobj)
+
+    @QtCore.Slot(list)
+    def onSerialParsed(self, updates):
+        """ Apply updates computed by TinyG2Parser in the reactor thread """
+        rows, offsets = {}, False
+        for key, value, header in updates:
+            if not self.setDataKey(key, value, header):
+                continue
+            offsets = offsets or key[:3] in ("g54", "g55", "g56", "g57", "g58", "g59")
+            node = self.nodeKey[key]
+            first, last = rows.get(node.parent, (node.row(), node.row()))
+            rows[node.parent] = (min(first, node.row()), max(last, node.row()))
+        for parent, (first, last) in rows.items():
+            top = self.createIndex(first, 1, parent.child[first])
+            bottom = self.createIndex(last, len(self._header) -1, parent.child[last])
+            self.dataChanged.emit(top, bottom)
+        if offsets:
+            vobj = self.obj.ViewObject
+            vobj.Proxy.updateOffsets(vobj)
 
     def setDataKey(self, key, value, header):
         if not self.dataKey.has_key(key):
-            return
+            return False
+        if header == "Unit":
+            header = self._header[-1]
         self.dataKey[key][self._header.index(header)] = value
+        return True
 
     @QtCore.Slot()
     def onInches(self):
@@ -381,35 +347,6 @@ class PoolModel(PoolBaseModel):
         self.obj.Proxy.Machine.serialWrite(json.dumps(value["r"]))
         return True
 
-    def report(self, report):
-        for key, value in report.items():
-            if key == "line":
-                self.nline.emit(str(value))
-            if key == "qr":
-                self.buffers.emit(str(value))
-            if key == "posx":
-                self.posx.emit(str(value))
-                self.lastposition[0] = value
-            if key == "posy":
-                self.posy.emit(str(value))
-                self.lastposition[1] = value
-            if key == "posz":
-                self.posz.emit(str(value))
-                self.lastposition[2] = value
-            if key == "vel":
-                self.vel.emit(str(value))
-            if key == "feed":
-                self.feed.emit(str(value))
-            #if key == "stat":
-            #    self.stat.emit("{}".format(value))
-        self.positions.append(list(self.lastposition))
-        if not self.obj.ViewObject.Draw:
-            return
-        if len(self.positions) < self.obj.ViewObject.Buffers:
-            return
-        self.obj.ViewObject.Positions += list(self.positions)
-        self.positions = []
-
 
 class PoolDelegate(QtGui.QStyledItemDelegate):
 
@@ -26,7 +26,7 @@ from __future__ import unicode_literals
 
 from PySide import QtCore, QtGui
 import FreeCADGui
-from App import Script as AppScript
+from App import Script as AppScript, TinyG2Upload
 from Gui import UsbPoolPanel, TinyG2Model, Script as GuiScript
 
 
@@ -77,19 +77,17 @@ class PoolPanel(QtGui.QTabWidget):
         monitor = QtGui.QWidget()
         monitor.setLayout(QtGui.QGridLayout())
         monitor.layout().addWidget(QtGui.QLabel("Line/N:"), 0, 0, 1, 1)
-        line = QtGui.QLabel()
-        monitor.layout().addWidget(line, 0, 1, 1, 1)
+        self.line = QtGui.QLabel()
+        monitor.layout().addWidget(self.line, 0, 1, 1, 1)
         monitor.layout().addWidget(QtGui.QLabel("/"), 0, 2, 1, 1)
-        nline = QtGui.QLabel()
-        monitor.layout().addWidget(nline, 0, 3, 1, 1)
-        #model.nline.connect(nline.setText)
+        self.nline = QtGui.QLabel()
+        monitor.layout().addWidget(self.nline, 0, 3, 1, 1)
         monitor.layout().addWidget(QtGui.QLabel("GCode:"), 1, 0, 1, 1)
         gcode = QtGui.QLabel()
         monitor.layout().addWidget(gcode, 1, 1, 1, 3)
         monitor.layout().addWidget(QtGui.QLabel("Buffers:"), 2, 0, 1, 1)
-        buffers = QtGui.QLabel()
-        monitor.layout().addWidget(buffers, 2, 1, 1, 3)
-        #model.buffers.connect(buffers.setText)
+        self.buffers = QtGui.QLabel()
+        monitor.layout().addWidget(self.buffers, 2, 1, 1, 3)
         monitor.layout().addWidget(QtGui.QLabel("PosX:"), 3, 0, 1, 1)
         posx = QtGui.QLabel()
         monitor.layout().addWidget(posx, 3, 1, 1, 3)
@@ -114,10 +112,17 @@ class PoolPanel(QtGui.QTabWidget):
         stat = QtGui.QLabel()
         monitor.layout().addWidget(stat, 8, 1, 1, 3)
         #model.stat.connect(stat.setText)
+        monitor.layout().addWidget(QtGui.QLabel("Rate:"), 9, 0, 1, 1)
+        self.rate = QtGui.QLabel()
+        monitor.layout().addWidget(self.rate, 9, 1, 1, 3)
         self.addTab(monitor, "Upload monitor")
+        self.latency = LatencyView(self)
+        self.addTab(self.latency, "Latency")
 
     def setModel(self, model):
+        self.latency.setModel(model)
         self.tabbar.tabIndex.connect(model.setRootIndex)
+        model.upload.connect(self.onUpload)
         model.title.connect(self.onTitle)
         model.title.emit("test")
         self.tableview.setModel(model)
@@ -126,6 +131,87 @@ class PoolPanel(QtGui.QTabWidget):
     def onTitle(self, title):
         self.setWindowTitle(title)
 
+    @QtCore.Slot(int, int, float, int)
+    def onUpload(self, line, total, rate, free):
+        self.line.setText("{}".format(line))
+        self.nline.setText("{}".format(total))
+        self.rate.setText("{:.0f} lines/s".format(rate))
+        if free < 0:
+            self.buffers.setText("")
+        else:
+            fill = TinyG2Upload.Uploader.planner - free
+            self.buffers.setText("{} free (planner fill {})".format(free, fill))
+
+
+class LatencyView(QtGui.QWidget):
+    """ Command round trip latency per command type (TinyG2Latency) """
+
+    def __init__(self, parent):
+        QtGui.QWidget.__init__(self, parent)
+        self.model = None
+        self.setLayout(QtGui.QVBoxLayout())
+        self.table = QtGui.QTreeWidget(self)
+        self.table.setRootIsDecorated(False)
+        self.table.setHeaderLabels(["Command", "Count", "p50 ms", "p90 ms",
+                                    "p99 ms", "Max ms"])
+        self.layout().addWidget(self.table)
+        buttons = QtGui.QHBoxLayout()
+        reset = QtGui.QPushButton("Reset")
+        reset.clicked.connect(self.onReset)
+        buttons.addWidget(reset)
+        export = QtGui.QPushButton("Export...")
+        export.clicked.connect(self.onExport)
+        buttons.addWidget(export)
+        self.layout().addLayout(buttons)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.updateView)
+
+    def setModel(self, model):
+        self.model = model
+        self.updateView()
+
+    def getTracer(self):
+        if self.model is None or self.model.obj is None:
+            return None
+        return getattr(self.model.obj.Proxy.Machine, "tracer", None)
+
+    def showEvent(self, event):
+        self.timer.start()
+        self.updateView()
+
+    def hideEvent(self, event):
+        self.timer.stop()
+
+    @QtCore.Slot()
+    def updateView(self):
+        tracer = self.getTracer()
+        self.table.clear()
+        if tracer is None:
+            return
+        ms = lambda v: "{:.3f}".format(v * 1000)
+        for kind, s in sorted(tracer.snapshot().items()):
+            self.table.addTopLevelItem(QtGui.QTreeWidgetItem([kind,
+                "{}".format(s["count"]), ms(s["p50"]), ms(s["p90"]),
+                ms(s["p99"]), ms(s["max"])]))
+
+    @QtCore.Slot()
+    def onReset(self):
+        tracer = self.getTracer()
+        if tracer is not None:
+            tracer.reset()
+            self.updateView()
+
+    @QtCore.Slot()
+    def onExport(self):
+        tracer = self.getTracer()
+        if tracer is None:
+            return
+        path, f = QtGui.QFileDialog.getSaveFileName(self, "Export latency",
+                                                    "latency.json", "JSON (*.json)")
+        if path:
+            tracer.export(path)
+
 
 class UsbPoolView(QtGui.QTreeView):
     
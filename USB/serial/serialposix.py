@@ -14,6 +14,7 @@
 
 import errno
 import fcntl
+import io
 import os
 import select
 import struct
@@ -25,6 +26,15 @@ import serial
 from serial.serialutil import SerialBase, SerialException, to_bytes, portNotOpenError, writeTimeoutError
 
 
+if hasattr(os, 'readv'):
+    def readv(fd, buffers):
+        return os.readv(fd, buffers)
+else:
+    def readv(fd, buffers):
+        # Python 2 has no os.readv: fill the first buffer only
+        return io.FileIO(fd, closefd=False).readinto(buffers[0])
+
+
 class PlatformSpecificBase(object):
     BAUDRATE_CONSTANTS = {}
 
@@ -511,6 +521,30 @@ class Serial(SerialBase, PlatformSpecific):
                     raise SerialException('read failed: %s' % (e,))
         return bytes(read)
 
+    def read_available_into(self, buffers):
+        """\
+        Read the bytes waiting in the input buffer straight into the
+        writable buffers (bytearray or memoryview, filled in order) without
+        waiting: one system call and no copy, for callers that know the
+        port is readable (select/poll). Return the number of bytes read, 0 if
+        nothing was waiting.
+        """
+        if not self.is_open:
+            raise portNotOpenError
+        try:
+            n = readv(self.fd, buffers)
+        except (IOError, OSError) as e:
+            if e.errno == errno.EAGAIN:
+                return 0
+            raise SerialException('read failed: %s' % (e,))
+        if n is None:
+            return 0
+        if not n and any(len(b) for b in buffers):
+            # Disconnected devices, at least on Linux, are always ready to
+            # read but reading returns nothing.
+            raise SerialException('device reports readiness to read but returned no data (device disconnected or multiple access on port?)')
+        return n
+
     def write(self, data):
         """Output the given byte string over the serial port."""
         if not self.is_open:
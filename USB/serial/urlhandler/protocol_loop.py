@@ -10,20 +10,20 @@
 #
 # SPDX-License-Identifier:    BSD-3-Clause
 #
-# URL format:    loop://[option[/option...]]
+# URL format:    loop://[name/endpoint][?logging={debug|info|warning|error}]
+# - without name the port receives itself what it sent
+# - "loop://name/0" and "loop://name/1" are a crossed pair: each endpoint
+#   receives what the other sent (a stand in for a dual port device)
 # options:
-# - "debug" print diagnostic messages
+# - "logging" print diagnostic messages
 import logging
 import numbers
+import threading
 import time
 try:
     import urlparse
 except ImportError:
     import urllib.parse as urlparse
-try:
-    import queue
-except ImportError:
-    import Queue as queue
 
 from serial.serialutil import *
 
@@ -36,6 +36,38 @@ LOGGER_LEVELS = {
         }
 
 
+class Buffer(object):
+    """\
+    Bytes in flight in one direction, at most size of them. Reads and writes
+    move whole blocks under one lock, a full buffer blocks the writer.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.data = bytearray()
+        self.condition = threading.Condition()
+
+    def wait(self, deadline):
+        """wait for a change until deadline (None: forever), False on timeout"""
+        if deadline is None:
+            self.condition.wait()
+            return True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        self.condition.wait(remaining)
+        return True
+
+    def clear(self):
+        with self.condition:
+            del self.data[:]
+            self.condition.notify_all()
+
+
+pairs = {}
+pairs_lock = threading.Lock()
+
+
 class Serial(SerialBase):
     """Serial port implementation that simulates a loop back connection in plain software."""
 
@@ -43,10 +75,13 @@ class Serial(SerialBase):
                  9600, 19200, 38400, 57600, 115200)
 
     def __init__(self, *args, **kwargs):
-        super(Serial, self).__init__(*args, **kwargs)
+        # set before SerialBase opens the port when given one
         self.buffer_size = 4096
-        self.queue = None
+        self.rx = None
+        self.tx = None
+        self.pair = None
         self.logger = None
+        super(Serial, self).__init__(*args, **kwargs)
 
     def open(self):
         """\
@@ -56,13 +91,22 @@ class Serial(SerialBase):
         if self.is_open:
             raise SerialException("Port is already open.")
         self.logger = None
-        self.queue = queue.Queue(self.buffer_size)
 
         if self._port is None:
             raise SerialException("Port must be configured before it can be used.")
         # not that there is anything to open, but the function applies the
         # options found in the URL
-        self.from_url(self.port)
+        name, endpoint = self.from_url(self.port)
+        if name is None:
+            self.rx = self.tx = Buffer(self.buffer_size)
+        else:
+            with pairs_lock:
+                if name not in pairs:
+                    pairs[name] = [Buffer(self.buffer_size), Buffer(self.buffer_size), 0]
+                pair = pairs[name]
+                pair[2] += 1
+            self.pair = name
+            self.rx, self.tx = pair[endpoint], pair[1 - endpoint]
 
         # not that there anything to configure...
         self._reconfigure_port()
@@ -78,10 +122,16 @@ class Serial(SerialBase):
     def close(self):
         if self.is_open:
             self.is_open = False
-            try:
-                self.queue.put_nowait(None)
-            except queue.Full:
-                pass
+            # wake up a read or write blocked in another thread
+            for buf in (self.rx, self.tx):
+                with buf.condition:
+                    buf.condition.notify_all()
+            if self.pair is not None:
+                with pairs_lock:
+                    pair = pairs[self.pair]
+                    pair[2] -= 1
+                    if not pair[2]:
+                        del pairs[self.pair]
         super(Serial, self).close()
 
     def _reconfigure_port(self):
@@ -99,8 +149,13 @@ class Serial(SerialBase):
         """extract host and port from an URL string"""
         parts = urlparse.urlsplit(url)
         if parts.scheme != "loop":
-            raise SerialException('expected a string in the form "loop://[?logging={debug|info|warning|error}]": not starting with loop:// (%r)' % (parts.scheme,))
+            raise SerialException('expected a string in the form "loop://[name/endpoint][?logging={debug|info|warning|error}]": not starting with loop:// (%r)' % (parts.scheme,))
         try:
+            name, endpoint = None, 0
+            if parts.netloc:
+                name, endpoint = parts.netloc, int(parts.path.strip('/') or 0)
+                if endpoint not in (0, 1):
+                    raise ValueError('endpoint must be 0 or 1')
             # process options now, directly altering self
             for option, values in urlparse.parse_qs(parts.query, True).items():
                 if option == 'logging':
@@ -111,7 +166,8 @@ class Serial(SerialBase):
                 else:
                     raise ValueError('unknown option: %r' % (option,))
         except ValueError as e:
-            raise SerialException('expected a string in the form "loop://[?logging={debug|info|warning|error}]": %s' % e)
+            raise SerialException('expected a string in the form "loop://[name/endpoint][?logging={debug|info|warning|error}]": %s' % e)
+        return name, endpoint
 
     #  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -
 
@@ -120,11 +176,12 @@ class Serial(SerialBase):
         """Return the number of bytes currently in the input buffer."""
         if not self.is_open:
             raise portNotOpenError
+        size = len(self.rx.data)
         if self.logger:
             # attention the logged value can differ from return value in
             # threaded environments...
-            self.logger.debug('in_waiting -> %d' % (self.queue.qsize(),))
-        return self.queue.qsize()
+            self.logger.debug('in_waiting -> %d' % (size,))
+        return size
 
     def read(self, size=1):
         """\
@@ -134,29 +191,24 @@ class Serial(SerialBase):
         """
         if not self.is_open:
             raise portNotOpenError
-        if self._timeout is not None and self._timeout != 0:
-            timeout = time.time() + self._timeout
+        if self._timeout is not None:
+            deadline = time.time() + self._timeout
         else:
-            timeout = None
+            deadline = None
+        buf = self.rx
         data = bytearray()
-        while size > 0 and self.is_open:
-            try:
-                b = self.queue.get(timeout=self._timeout)  # XXX inter char timeout
-            except queue.Empty:
-                if self._timeout == 0:
+        with buf.condition:
+            while self.is_open and len(data) < size:
+                if buf.data:
+                    # more than the buffer holds comes in several blocks
+                    count = size - len(data)
+                    data += buf.data[:count]
+                    del buf.data[:count]
+                    buf.condition.notify_all()
+                elif not buf.wait(deadline):
+                    if self.logger:
+                        self.logger.info('read timeout')
                     break
-            else:
-                if data is not None:
-                    data += b
-                    size -= 1
-                else:
-                    break
-            # check for timeout now, after data has been read.
-            # useful for timeout = 0 (non blocking) read
-            if timeout and time.time() > timeout:
-                if self.logger:
-                    self.logger.info('read timeout')
-                break
         return bytes(data)
 
     def write(self, data):
@@ -175,8 +227,23 @@ class Serial(SerialBase):
         if self._write_timeout is not None and time_used_to_send > self._write_timeout:
             time.sleep(self._write_timeout)  # must wait so that unit test succeeds
             raise writeTimeoutError
-        for byte in iterbytes(data):
-            self.queue.put(byte, timeout=self._write_timeout)
+        if self._write_timeout is not None:
+            deadline = time.time() + self._write_timeout
+        else:
+            deadline = None
+        buf = self.tx
+        start = 0
+        with buf.condition:
+            while start < len(data):
+                if not self.is_open:
+                    raise portNotOpenError
+                space = buf.size - len(buf.data)
+                if space > 0:
+                    buf.data += data[start:start + space]
+                    start += space
+                    buf.condition.notify_all()
+                elif not buf.wait(deadline):
+                    raise writeTimeoutError
         return len(data)
 
     def reset_input_buffer(self):
@@ -185,11 +252,7 @@ class Serial(SerialBase):
             raise portNotOpenError
         if self.logger:
             self.logger.info('reset_input_buffer()')
-        try:
-            while self.queue.qsize():
-                self.queue.get_nowait()
-        except queue.Empty:
-            pass
+        self.rx.clear()
 
     def reset_output_buffer(self):
         """\
@@ -200,11 +263,7 @@ class Serial(SerialBase):
             raise portNotOpenError
         if self.logger:
             self.logger.info('reset_output_buffer()')
-        try:
-            while self.queue.qsize():
-                self.queue.get_nowait()
-        except queue.Empty:
-            pass
+        self.tx.clear()
 
     def _update_break_state(self):
         """\
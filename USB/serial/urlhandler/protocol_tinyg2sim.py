@@ -0,0 +1,481 @@
+#! python
+#
+# This module implements a simulated TinyG2 controller.
+#
+# The device answers JSON requests like the firmware does (with the signature
+# checked by USBTerminal), queues G-code moves in a planner consumed at a
+# simulated motion rate, sends queue reports ({"qr":n}) and status reports
+# ({"sr":{...}}), handles the real time commands (! ~ % Ctrl-X) and has two
+# endpoints (control and data) sharing the same device, like the native USB
+# port of a TinyG2 (DualPort).
+#
+# This file is part of USBTerminal.
+# (C) 2015 Pierre Vacher <prrvchr@gmail.com>
+#
+# SPDX-License-Identifier:    LGPL-2.0-or-later
+#
+# URL format:    tinyg2sim://[name][/endpoint][?option[&option...]]
+# endpoint: 0 control (default), 1 data: the same name is the same device
+# options:
+# - "rate=<lines/s>" simulated motion rate (default 1000, 0 for instant)
+# - "sr=<ms>" status report interval when running (default 250, 0 disables)
+# - "planner=<n>" planner buffers (default 28)
+# - "logging={debug|info|warning|error}" print diagnostic messages
+import collections
+import json
+import logging
+import numbers
+import re
+import threading
+import time
+try:
+    import urlparse
+except ImportError:
+    import urllib.parse as urlparse
+
+from serial.serialutil import *
+
+# map log level names to constants. used in from_url()
+LOGGER_LEVELS = {
+        'debug': logging.DEBUG,
+        'info': logging.INFO,
+        'warning': logging.WARNING,
+        'error': logging.ERROR,
+        }
+
+SIGNATURE = {'fb': 83.09, 'fv': 0.98, 'hp': 3, 'hv': 0, 'msg': 'SYSTEM READY'}
+REALTIME = re.compile(br'[!~%\x18]')
+WORD = re.compile(br'([NnXxYyZz])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+AXES = {b'X': 'posx', b'Y': 'posy', b'Z': 'posz'}
+
+# machine states reported in sr "stat"
+STAT_READY, STAT_STOP, STAT_RUN, STAT_HOLD = 1, 3, 5, 6
+
+
+def dumps(value):
+    return json.dumps(value, separators=(',', ':'), sort_keys=True)
+
+
+class Device(object):
+    """\
+    Simulated controller shared by the endpoints of a same name. All methods
+    are called with the lock held. The simulation is lazy: the planner is
+    consumed and reports are produced when an endpoint looks at the device,
+    so an idle device costs nothing.
+    """
+
+    def __init__(self, name, rate, interval, planner):
+        self.name = name
+        self.rate = rate
+        self.interval = interval
+        self.size = planner
+        self.lock = threading.Condition()
+        self.outputs = [bytearray(), bytearray()]
+        self.inputs = [bytearray(), bytearray()]
+        self.endpoints = [0, 0]
+        self.reset()
+
+    def reset(self):
+        self.planner = collections.deque()
+        self.hold = False
+        self.stat = STAT_READY
+        self.clock = time.time()
+        self.report = self.clock
+        self.qv = 0
+        self.reported = None
+        self.count = 0
+        self.status = {'line': 0, 'posx': 0.0, 'posy': 0.0, 'posz': 0.0,
+                       'vel': 0.0, 'stat': self.stat}
+        self.config = {}
+        for buf in self.inputs:
+            del buf[:]
+
+    def getSignature(self):
+        r = dict(SIGNATURE)
+        r['id'] = 'SIM-{}'.format(self.name)
+        return r
+
+    def send(self, endpoint, data):
+        self.outputs[endpoint] += data
+        self.lock.notify_all()
+
+    def banner(self):
+        self.footer(0, self.getSignature(), 0)
+
+    def open(self, endpoint):
+        self.endpoints[endpoint] += 1
+        if endpoint == 0 and self.endpoints[0] == 1:
+            self.banner()
+
+    def close(self, endpoint):
+        self.endpoints[endpoint] -= 1
+        del self.outputs[endpoint][:]
+        del self.inputs[endpoint][:]
+        return not any(self.endpoints)
+
+    # - - - input - - -
+
+    def receive(self, endpoint, data):
+        """Real time commands are handled at once, lines are queued"""
+        start = 0
+        for match in REALTIME.finditer(data):
+            self.inputs[endpoint] += data[start:match.start()]
+            self.realtime(match.group())
+            start = match.end()
+        self.inputs[endpoint] += data[start:]
+        self.process(endpoint)
+
+    def realtime(self, command):
+        if command == b'!':
+            self.update(time.time())
+            self.hold = True
+        elif command == b'~':
+            self.hold = False
+            self.clock = time.time()
+        elif command == b'%':
+            if self.hold:
+                self.planner.clear()
+                self.hold = False
+                for endpoint in (0, 1):
+                    self.process(endpoint)
+        else:
+            self.reset()
+            self.banner()
+        self.setStat()
+
+    def process(self, endpoint):
+        """Execute the complete lines of endpoint until the planner is full"""
+        buf = self.inputs[endpoint]
+        start = 0
+        while True:
+            end = buf.find(b'\n', start)
+            if end == -1:
+                break
+            line = bytes(buf[start:end]).strip()
+            if line and not line.startswith((b'{', b'$', b'?')) and len(self.planner) >= self.size:
+                # a full planner stops reading the serial buffer
+                break
+            self.execute(endpoint, line, end + 1 - start)
+            start = end + 1
+        del buf[:start]
+
+    def execute(self, endpoint, line, size):
+        if not line:
+            return
+        if line.startswith(b'{'):
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError:
+                self.footer(endpoint, {}, size, 108)    # JSON syntax error
+                return
+            r = dict((key, self.query(key, value)) for key, value in request.items())
+            self.footer(endpoint, r, size)
+        elif line.startswith((b'$', b'?')):
+            self.footer(endpoint, {}, size)
+        else:
+            self.move(line)
+            self.footer(endpoint, {}, size)
+
+    def footer(self, endpoint, r, size, status=0):
+        # "r" first: hosts classify responses on their first key
+        self.send(endpoint, ('{"r":%s,"f":[1,%d,%d]}\n' % (dumps(r), status, size)).encode('ascii'))
+
+    def query(self, key, value):
+        if key == 'qr':
+            return self.size - len(self.planner)
+        if key == 'qv':
+            if value is not None:
+                self.qv = int(value)
+            return self.qv
+        if key == 'sr':
+            return self.getStatus()
+        if key == 'sys':
+            r = self.getSignature()
+            r.update(self.config)
+            return r
+        signature = self.getSignature()
+        if key in signature:
+            return signature[key]
+        if value is None or value == '':
+            return self.config.get(key, 0)
+        self.config[key] = value
+        return value
+
+    def move(self, line):
+        self.count += 1
+        move = {'line': self.count}
+        for letter, value in WORD.findall(line):
+            letter = letter.upper()
+            if letter == b'N':
+                move['line'] = int(float(value))
+            else:
+                move[AXES[letter]] = float(value)
+        if not self.planner:
+            self.clock = time.time()
+        self.planner.append(move)
+        self.setStat()
+
+    # - - - simulation - - -
+
+    def setStat(self):
+        if self.hold:
+            stat = STAT_HOLD
+        elif self.planner:
+            stat = STAT_RUN
+        else:
+            stat = STAT_STOP if self.stat != STAT_READY else STAT_READY
+        if stat != self.stat:
+            self.stat = stat
+            self.status['stat'] = stat
+            self.status['vel'] = float(self.rate) if stat == STAT_RUN else 0.0
+            if self.interval:
+                self.sendStatus()
+
+    def getStatus(self):
+        return dict(self.status)
+
+    def sendStatus(self):
+        self.report = time.time()
+        self.send(0, (dumps({'sr': self.getStatus()}) + '\n').encode('ascii'))
+
+    def update(self, now):
+        """Run the simulation up to now"""
+        if self.planner and not self.hold:
+            if self.rate:
+                count = min(int((now - self.clock) * self.rate), len(self.planner))
+                self.clock += float(count) / self.rate
+            else:
+                count = len(self.planner)
+            for i in range(count):
+                self.status.update(self.planner.popleft())
+            if count:
+                for endpoint in (0, 1):
+                    self.process(endpoint)
+                self.setStat()
+        if not self.planner or self.hold:
+            self.clock = now
+        free = self.size - len(self.planner)
+        if self.qv and free != self.reported:
+            self.reported = free
+            self.send(0, (dumps({'qr': free}) + '\n').encode('ascii'))
+        if self.interval and self.stat == STAT_RUN and now - self.report >= self.interval:
+            self.sendStatus()
+
+    def getNextEvent(self, now):
+        """Time of the next output the simulation may produce"""
+        events = []
+        if self.planner and not self.hold and self.rate:
+            events.append(self.clock + 1.0 / self.rate)
+        if self.interval and self.stat == STAT_RUN:
+            events.append(self.report + self.interval)
+        return min(events) if events else None
+
+
+devices = {}
+devices_lock = threading.Lock()
+
+
+class Serial(SerialBase):
+    """Serial port implementation of a simulated TinyG2 endpoint."""
+
+    BAUDRATES = (50, 75, 110, 134, 150, 200, 300, 600, 1200, 1800, 2400, 4800,
+                 9600, 19200, 38400, 57600, 115200, 230400, 460800, 921600)
+
+    def __init__(self, *args, **kwargs):
+        # set before SerialBase opens the port when given one
+        self.device = None
+        self.endpoint = 0
+        self.logger = None
+        super(Serial, self).__init__(*args, **kwargs)
+
+    def open(self):
+        """\
+        Open port with current settings. This may throw a SerialException
+        if the port cannot be opened.
+        """
+        if self.is_open:
+            raise SerialException("Port is already open.")
+        self.logger = None
+        if self._port is None:
+            raise SerialException("Port must be configured before it can be used.")
+        name, settings = self.from_url(self.port)
+        with devices_lock:
+            if name not in devices:
+                devices[name] = Device(name, *settings)
+            self.device = devices[name]
+            with self.device.lock:
+                self.device.open(self.endpoint)
+        self._reconfigure_port()
+        self.is_open = True
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            with devices_lock:
+                with self.device.lock:
+                    if self.device.close(self.endpoint):
+                        devices.pop(self.device.name, None)
+                    self.device.lock.notify_all()
+        super(Serial, self).close()
+
+    def _reconfigure_port(self):
+        """\
+        Set communication parameters on opened port. For the tinyg2sim://
+        protocol all settings are ignored!
+        """
+        if not isinstance(self._baudrate, numbers.Integral) or not 0 < self._baudrate < 2**32:
+            raise ValueError("invalid baudrate: %r" % (self._baudrate))
+        if self.logger:
+            self.logger.info('_reconfigure_port()')
+
+    def from_url(self, url):
+        """extract device name, endpoint and simulation settings from an URL string"""
+        parts = urlparse.urlsplit(url)
+        if parts.scheme != "tinyg2sim":
+            raise SerialException('expected a string in the form "tinyg2sim://[name][/endpoint][?options]": not starting with tinyg2sim:// (%r)' % (parts.scheme,))
+        rate, interval, planner = 1000.0, 0.25, 28
+        try:
+            path = parts.path.strip('/')
+            self.endpoint = int(path) if path else 0
+            if self.endpoint not in (0, 1):
+                raise ValueError('endpoint must be 0 or 1')
+            for option, values in urlparse.parse_qs(parts.query, True).items():
+                if option == 'logging':
+                    logging.basicConfig()   # XXX is that good to call it here?
+                    self.logger = logging.getLogger('pySerial.tinyg2sim')
+                    self.logger.setLevel(LOGGER_LEVELS[values[0]])
+                    self.logger.debug('enabled logging')
+                elif option == 'rate':
+                    rate = float(values[0])
+                elif option == 'sr':
+                    interval = float(values[0]) / 1000.0
+                elif option == 'planner':
+                    planner = int(values[0])
+                else:
+                    raise ValueError('unknown option: %r' % (option,))
+        except (ValueError, KeyError) as e:
+            raise SerialException('expected a string in the form "tinyg2sim://[name][/endpoint][?options]": %s' % e)
+        return parts.netloc or 'tinyg2', (rate, interval, planner)
+
+    #  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -
+
+    @property
+    def in_waiting(self):
+        """Return the number of bytes currently in the input buffer."""
+        if not self.is_open:
+            raise portNotOpenError
+        with self.device.lock:
+            self.device.update(time.time())
+            return len(self.device.outputs[self.endpoint])
+
+    def read(self, size=1):
+        """\
+        Read size bytes from the serial port. If a timeout is set it may
+        return less characters as requested. With no timeout it will block
+        until the requested number of bytes is read.
+        """
+        if not self.is_open:
+            raise portNotOpenError
+        deadline = None if self._timeout is None else time.time() + self._timeout
+        device = self.device
+        with device.lock:
+            output = device.outputs[self.endpoint]
+            while self.is_open:
+                now = time.time()
+                device.update(now)
+                if len(output) >= size or (deadline is not None and now >= deadline):
+                    break
+                wait = [t - now for t in (deadline, device.getNextEvent(now)) if t is not None]
+                device.lock.wait(max(0.0, min(wait)) if wait else None)
+            data = bytes(output[:size])
+            del output[:size]
+        return data
+
+    def write(self, data):
+        """\
+        Output the given byte string over the serial port. Lines are
+        acknowledged as the firmware does, a full planner delays the
+        acknowledgements of the next G-code lines.
+        """
+        if not self.is_open:
+            raise portNotOpenError
+        data = to_bytes(data)
+        if self.logger:
+            self.logger.debug('write(%r)' % (data,))
+        with self.device.lock:
+            self.device.update(time.time())
+            self.device.receive(self.endpoint, data)
+        return len(data)
+
+    def reset_input_buffer(self):
+        """Clear input buffer, discarding all that is in the buffer."""
+        if not self.is_open:
+            raise portNotOpenError
+        if self.logger:
+            self.logger.info('reset_input_buffer()')
+        with self.device.lock:
+            del self.device.outputs[self.endpoint][:]
+
+    def reset_output_buffer(self):
+        """\
+        Clear output buffer, aborting the current output and
+        discarding all that is in the buffer.
+        """
+        if not self.is_open:
+            raise portNotOpenError
+        if self.logger:
+            self.logger.info('reset_output_buffer()')
+        with self.device.lock:
+            del self.device.inputs[self.endpoint][:]
+
+    def _update_break_state(self):
+        if self.logger:
+            self.logger.info('_update_break_state(%r)' % (self._break_state,))
+
+    def _update_rts_state(self):
+        if self.logger:
+            self.logger.info('_update_rts_state(%r)' % (self._rts_state,))
+
+    def _update_dtr_state(self):
+        if self.logger:
+            self.logger.info('_update_dtr_state(%r)' % (self._dtr_state,))
+
+    @property
+    def cts(self):
+        """Read terminal status line: Clear To Send"""
+        if not self.is_open:
+            raise portNotOpenError
+        return True
+
+    @property
+    def dsr(self):
+        """Read terminal status line: Data Set Ready"""
+        if not self.is_open:
+            raise portNotOpenError
+        return True
+
+    @property
+    def ri(self):
+        """Read terminal status line: Ring Indicator"""
+        if not self.is_open:
+            raise portNotOpenError
+        return False
+
+    @property
+    def cd(self):
+        """Read terminal status line: Carrier Detect"""
+        if not self.is_open:
+            raise portNotOpenError
+        return True
+
+
+# simple client test
+if __name__ == '__main__':
+    import sys
+    s = Serial('tinyg2sim://?rate=100')
+    sys.stdout.write('%s\n' % s)
+    sys.stdout.write('signature: %s' % s.readline())
+    s.write(b'{"qv":1}\n{"qr":null}\nG1 X1 Y2\nG1 X2 Y3\n')
+    time.sleep(0.1)
+    sys.stdout.write('read: %s\n' % s.read(s.in_waiting))
+    s.close()
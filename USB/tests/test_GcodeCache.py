@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" Preprocessed upload job cache tests """
+from __future__ import unicode_literals
+
+import io, json, os, shutil, tempfile, unittest
+from App import GcodeCache, GcodeFilter
+
+
+class JobCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = GcodeCache.JobCache(os.path.join(self.folder, "Cache"), 1 << 20)
+        self.pipeline = GcodeFilter.Pipeline(["Comments", "Whitespace"])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def getFile(self, name, data):
+        path = os.path.join(self.folder, name)
+        with io.open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def upload(self, path):
+        job = self.cache.open(path, self.pipeline)
+        lines = list(job.getLines())
+        job.close(True)
+        return job.cached, lines
+
+    def getRegistry(self):
+        with io.open(self.cache.registry, "rb") as f:
+            return json.loads(f.read().decode("utf-8"))
+
+    def testRecordThenRead(self):
+        path = self.getFile("a.nc", b"G0 X1 (move)\nG1 Y2\n")
+        self.assertEqual(self.upload(path), (False, [(0, b"G0X1"), (1, b"G1Y2")]))
+        self.assertEqual(self.upload(path), (True, [(0, b"G0X1"), (1, b"G1Y2")]))
+
+    def testHashesPruned(self):
+        first = self.getFile("a.nc", b"G0 X1\n" * 1000)
+        second = self.getFile("b.nc", b"G0 X2\n" * 1000)
+        self.upload(first)
+        self.assertEqual(list(self.getRegistry()), [first])
+        # The first job no longer fits: its hash is dropped with it
+        self.cache.size = 20000
+        self.upload(second)
+        self.assertEqual(list(self.getRegistry()), [second])
+        self.assertEqual(len(self.cache.getEntries()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" Memory mapped G-code file and line index tests """
+from __future__ import unicode_literals
+
+import io, os, shutil, tempfile, unittest
+from App import GcodeFile
+
+
+class GcodeFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "job.nc")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, data):
+        with io.open(self.path, "wb") as f:
+            f.write(data)
+
+    def getLines(self, data):
+        self.write(data)
+        with GcodeFile.GcodeFile(self.path) as f:
+            return len(f), [bytes(line) for line in f.getLines()]
+
+    def testEmpty(self):
+        self.assertEqual(self.getLines(b""), (0, []))
+
+    def testLines(self):
+        self.assertEqual(self.getLines(b"G0 X1\nG1 Y2\n"), (2, [b"G0 X1\n", b"G1 Y2\n"]))
+
+    def testNoTrailingNewline(self):
+        self.assertEqual(self.getLines(b"G0 X1\nG1 Y2"), (2, [b"G0 X1\n", b"G1 Y2"]))
+
+    def testCrLf(self):
+        self.assertEqual(self.getLines(b"G0 X1\r\n\r\nG1 Y2\r\n"),
+                         (3, [b"G0 X1\r\n", b"\r\n", b"G1 Y2\r\n"]))
+
+    def testLine(self):
+        self.write(b"".join("G1 X{}\n".format(i).encode("ascii") for i in range(1000)))
+        with GcodeFile.GcodeFile(self.path) as f:
+            self.assertEqual(bytes(f.getLine(999)), b"G1 X999\n")
+            self.assertEqual([bytes(l) for l in f.getLines(998)], [b"G1 X998\n", b"G1 X999\n"])
+
+    def testIndexReused(self):
+        self.write(b"G0 X1\nG1 Y2\n")
+        GcodeFile.GcodeFile(self.path).close()
+        self.assertTrue(os.path.isfile(self.path + GcodeFile.LineIndex.ext))
+        build = GcodeFile.LineIndex.build
+        def fail(*args):
+            raise AssertionError("index built again")
+        GcodeFile.LineIndex.build = fail
+        try:
+            with GcodeFile.GcodeFile(self.path) as f:
+                self.assertEqual(len(f), 2)
+        finally:
+            GcodeFile.LineIndex.build = build
+
+    def testIndexRebuilt(self):
+        self.write(b"G0 X1\nG1 Y2\n")
+        GcodeFile.GcodeFile(self.path).close()
+        # Another size: the index is stale
+        self.assertEqual(self.getLines(b"G0 X1\n"), (1, [b"G0 X1\n"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" G-code preprocessing stages tests """
+from __future__ import unicode_literals
+
+import unittest
+from App import GcodeFilter
+
+
+def dropModal(*lines):
+    return list(GcodeFilter.dropModal(line.encode("ascii") for line in lines))
+
+
+class DropModalTest(unittest.TestCase):
+
+    def testRepeatedMotionAndFeed(self):
+        self.assertEqual(dropModal("G1X1Y1F100", "G1X2Y2F100"), [b"G1X1Y1F100", b"X2Y2"])
+
+    def testMotionAfterMachineMove(self):
+        # G53 G0 makes G0 the motion mode: the next G1 must be kept
+        lines = dropModal("G1 X1 Y1 F100", "G53 G0 Z0", "G1 X10 Y10")
+        self.assertEqual(lines, [b"G1 X1 Y1 F100", b"G53 G0 Z0", b"G1 X10 Y10"])
+
+    def testMotionAfterProbe(self):
+        # G38.2 is in the motion group: X2 alone would be a probe move
+        lines = dropModal("G1 X1 F100", "G38.2 Z-5 F10", "G1 X2 F100")
+        self.assertEqual(lines, [b"G1 X1 F100", b"G38.2 Z-5 F10", b"G1 X2 F100"])
+
+    def testMotionAfterCannedCycle(self):
+        lines = dropModal("G1 X1 F100", "G81 X5 Z-1 R1", "G80", "G1 X2")
+        self.assertEqual(lines, [b"G1 X1 F100", b"G81 X5 Z-1 R1", b"G80", b"G1 X2"])
+
+    def testFeedAfterExpression(self):
+        lines = dropModal("G1 X1 F100", "F[#1]", "G1 X2 F100")
+        self.assertEqual(lines, [b"G1 X1 F100", b"F[#1]", b"G1 X2 F100"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" G-code modal state (resume from line) tests """
+from __future__ import unicode_literals
+
+import unittest
+from App import GcodeModal
+
+
+def getPreamble(program):
+    state = GcodeModal.ModalState()
+    state.update(program.encode("ascii"))
+    return state.getPreamble()
+
+
+class PreambleTest(unittest.TestCase):
+
+    def testPositioningBeforeSpindle(self):
+        lines = getPreamble("G21 G90 G54\nG0 Z5\nG0 X10 Y20\nS1000 M3\nM8\nG1 Z-1 F300\nG1 X15\n")
+        self.assertEqual(lines, ["G21 G54 G90 G94", "G0 Z5", "G0 X15 Y20",
+                                 "S1000 M3", "M8", "G1 Z-1 F300", "G1"])
+
+    def testNoBareArc(self):
+        lines = getPreamble("G21 G90\nG0 Z2\nG0 X0 Y0\nG1 Z0 F100\nG2 X10 Y0 I5 J0\n")
+        self.assertNotIn("G2", " ".join(lines).split())
+        self.assertEqual(lines[-1], "G1 Z0 F100")
+
+    def testRelativeResume(self):
+        # Positioning is absolute, G91 is set again afterwards
+        lines = getPreamble("G20 G90\nG0 Z1\nG0 X1 Y1\nG91\nG1 X1 Z-0.5 F10\n")
+        self.assertEqual(lines, ["G20 G90 G94", "G0 Z1", "G0 X2 Y1", "G1 Z0.5 F10", "G91 G1"])
+
+    def testUnknownPosition(self):
+        lines = getPreamble("G21 G91\nG1 X1 Z-1 F100\nS100 M3\n")
+        self.assertEqual(lines, ["G21 G90 G94", "S100 M3", "F100", "G91 G1"])
+        lines = getPreamble("G21 G90\nG0 Z5 X1\nG28\n")
+        self.assertFalse(any(l.startswith("G0 X") for l in lines))
+
+
+class ResumeTest(unittest.TestCase):
+
+    def getLines(self, program, start):
+        lines = program.encode("ascii").splitlines(True)
+        state = GcodeModal.ModalState()
+        state.update(b"".join(lines[:start]))
+        resumed = state.getLines(enumerate(lines[start:], start))
+        return state.getPreamble(), [l.rstrip(b"\n") for i, l in resumed]
+
+    def testMiddleOfArcs(self):
+        program = "G21 G90\nG0 Z2\nG0 X0 Y0\nG1 Z0 F100\nG2 X10 Y0 I5 J0\nX0 Y0 I-5 J0\nX10 Y0 I5 J0\n"
+        preamble, lines = self.getLines(program, 5)
+        # The plunge leaves G1: the first resumed move is an arc again
+        self.assertEqual(preamble[-1], "G1 Z0 F100")
+        self.assertEqual(lines, [b"G2 X0 Y0 I-5 J0", b"X10 Y0 I5 J0"])
+
+    def testArcAfterOtherLines(self):
+        program = "G21 G90\nG0 Z2\nG1 Z0 F100\nG3X10Y0I5J0\nM8\nG4 P1\nX0Y0I-5J0\n"
+        preamble, lines = self.getLines(program, 4)
+        self.assertEqual(lines, [b"M8", b"G4 P1", b"G3 X0Y0I-5J0"])
+
+    def testMotionWordKept(self):
+        program = "G21 G90\nG0 Z2\nG1 Z0 F100\nG2 X10 Y0 I5 J0\nG1 X0\nX5\n"
+        preamble, lines = self.getLines(program, 4)
+        self.assertEqual(lines, [b"G1 X0", b"X5"])
+
+    def testNoArc(self):
+        program = "G21 G90\nG0 Z2\nG1 Z0 F100\nX5\nX6\n"
+        preamble, lines = self.getLines(program, 4)
+        self.assertEqual(lines, [b"X6"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" Toolpath preview and pick to resume tests (need numpy and PySide) """
+from __future__ import unicode_literals
+
+import io, os, shutil, tempfile, unittest
+try:
+    from App import GcodePreview, TinyG2Upload
+except ImportError:
+    GcodePreview = None
+
+
+program = """G21 G90 G17
+G0 X0 Y0 Z5
+G1 Z0 F100
+G1 X10
+G3 X20 Y0 I5 J0
+G1 Y10
+"""
+
+
+@unittest.skipIf(GcodePreview is None or GcodePreview.numpy is None, "needs numpy and PySide")
+class PickTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "job.nc")
+        with io.open(self.path, "w") as f:
+            f.write(program)
+        self.preview = GcodePreview.Preview(self.path, processes=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def getResumedLine(self, point):
+        """ File line an upload resumed from a pick at point starts with """
+        line, offset, distance = self.preview.pick(point)
+        start = TinyG2Upload.getLineFromResume(TinyG2Upload.getResumeFromLine(line))
+        with io.open(self.path, "rb") as f:
+            data = f.read()
+        self.assertEqual(data.splitlines()[start], data[offset:].splitlines()[0])
+        return data.splitlines()[start]
+
+    def testPickLine(self):
+        self.assertEqual(self.getResumedLine((5.0, 0.01, 0.0)), b"G1 X10")
+
+    def testPickArc(self):
+        # The G3 from (10, 0) to (20, 0) around (15, 0) goes through (15, -5)
+        self.assertEqual(self.getResumedLine((15.0, -5.0, 0.0)), b"G3 X20 Y0 I5 J0")
+
+    def testPickLastLine(self):
+        self.assertEqual(self.getResumedLine((20.0, 9.0, 0.0)), b"G1 Y10")
+
+
+@unittest.skipIf(GcodePreview is None or GcodePreview.numpy is None, "needs numpy and PySide")
+class OffsetTest(unittest.TestCase):
+
+    offsets = {54.0: (100.0, 0.0, -50.0), 55.0: (200.0, 10.0, -50.0)}
+
+    def getPoints(self, program):
+        folder = tempfile.mkdtemp()
+        try:
+            path = os.path.join(folder, "job.nc")
+            with io.open(path, "w") as f:
+                f.write(program)
+            preview = GcodePreview.Preview(path, offsets=self.offsets, processes=1)
+            return preview.points[1:].tolist()
+        finally:
+            shutil.rmtree(folder)
+
+    def testWorkCoordinates(self):
+        # Drawn as the live path positions: in the offset the program runs in
+        self.assertEqual(self.getPoints("G21 G90\nG0 X1 Y2 Z3\n"), [[1.0, 2.0, 3.0]])
+        self.assertEqual(self.getPoints("G21 G90 G55\nG0 X1 Y2 Z3\n"), [[1.0, 2.0, 3.0]])
+
+    def testOtherOffsets(self):
+        points = self.getPoints("G21 G90 G54\nG0 X1 Y0 Z0\nG55 G0 X1 Y0 Z0\nG53 G0 X0 Y0 Z0\n")
+        self.assertEqual(points, [[1.0, 0.0, 0.0], [101.0, 10.0, 0.0], [-100.0, 0.0, 50.0]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" Segment index (toolpath pick) tests (need numpy) """
+from __future__ import unicode_literals
+
+import unittest
+from App import PathIndex
+numpy = PathIndex.numpy
+
+
+def getRaster(rows, count, step):
+    """ Back and forth lines along X, step mm apart """
+    points = []
+    for row in range(rows):
+        xs = numpy.arange(count) * step
+        if row % 2:
+            xs = xs[::-1]
+        points.append(numpy.column_stack((xs, numpy.full(count, row * step), numpy.zeros(count))))
+    return numpy.vstack(points)
+
+def getNearest(points, point):
+    """ Brute force (index, distance) """
+    distances = PathIndex.getDistances(numpy.asarray(point, numpy.float64)[None, :],
+                                       points[:-1], points[1:])
+    return int(distances.argmin()) + 1, float(distances.min())
+
+
+@unittest.skipIf(numpy is None, "needs numpy")
+class SegmentIndexTest(unittest.TestCase):
+
+    def assertNearest(self, index, point):
+        found = index.query(point)
+        self.assertIsNotNone(found)
+        self.assertAlmostEqual(found[1], getNearest(index.points, point)[1])
+        return found
+
+    def testEmpty(self):
+        self.assertIsNone(PathIndex.SegmentIndex(numpy.zeros((1, 3))).query((0.0, 0.0, 0.0)))
+
+    def testOnPath(self):
+        index = PathIndex.SegmentIndex(getRaster(20, 50, 0.1))
+        i, distance = self.assertNearest(index, (1.05, 0.0, 0.0))
+        self.assertEqual(i, 11)
+        self.assertAlmostEqual(distance, 0.0)
+
+    def testOffPath(self):
+        # Far from the short segments, next to a long one
+        points = numpy.vstack((getRaster(20, 50, 0.1), [(100.0, 0.0, 0.0), (100.0, 100.0, 0.0)]))
+        index = PathIndex.SegmentIndex(points)
+        for point in ((2.5, 5.0, 3.0), (-3.0, -3.0, 0.0), (97.0, 50.0, 0.0), (60.0, 60.0, 60.0)):
+            self.assertNearest(index, point)
+        i, distance = self.assertNearest(index, (97.0, 50.0, 0.0))
+        self.assertEqual(i, len(points) - 1)
+        self.assertAlmostEqual(distance, 3.0)
+
+    def testRandom(self):
+        random = numpy.random.RandomState(1)
+        points = numpy.cumsum(random.normal(0.0, 0.5, (5000, 3)), axis=0)
+        points[::100] = random.uniform(-50.0, 50.0, (50, 3))
+        index = PathIndex.SegmentIndex(points)
+        for point in random.uniform(-60.0, 60.0, (50, 3)):
+            self.assertNearest(index, point)
+
+
+if __name__ == "__main__":
+    unittest.main()
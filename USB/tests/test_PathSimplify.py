@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" Toolpath simplification tests (need PySide) """
+from __future__ import unicode_literals
+
+import math, unittest
+from App import PositionStore
+try:
+    from App import PathSimplify
+except ImportError:
+    PathSimplify = None
+
+
+def getStore(count, amplitude=10.0):
+    """ A wave of count positions, 1 mm apart along X """
+    store = PositionStore.PositionStore()
+    store.extend((float(i), amplitude * math.sin(i / 20.0), 0.0) for i in range(count))
+    return store
+
+def getLine(count):
+    store = PositionStore.PositionStore()
+    store.extend((float(i), 0.0, 0.0) for i in range(count))
+    return store
+
+def getCount(levels):
+    return [level.count for level in levels]
+
+
+@unittest.skipIf(PathSimplify is None, "needs PySide")
+class SimplifierTest(unittest.TestCase):
+
+    def testLine(self):
+        points = getLine(10).getPoints()
+        self.assertEqual(PathSimplify.simplify(points, 0.01), [0, 9])
+
+    def testTolerance(self):
+        store = PositionStore.PositionStore()
+        store.extend([(0.0, 0.0, 0.0), (1.0, 0.5, 0.0), (2.0, 0.0, 0.0)])
+        points = store.getPoints()
+        self.assertEqual(PathSimplify.simplify(points, 0.1), [0, 1, 2])
+        self.assertEqual(PathSimplify.simplify(points, 1.0), [0, 2])
+
+    def testBlocks(self):
+        block = PathSimplify.Simplifier.block
+        store = getLine(2 * block + 10)
+        simplifier = PathSimplify.Simplifier(store, 0.01)
+        parts = simplifier.update()
+        # A straight line keeps the first point of every complete block
+        self.assertEqual(simplifier.count, 2)
+        self.assertEqual(sum(len(p) for p in parts), 2)
+        self.assertEqual(len(simplifier.getTail()), 10)
+        self.assertEqual(simplifier.update(), [])
+
+    def testThin(self):
+        points = getLine(100).getPoints()
+        thinned = PathSimplify.thin(points, 10)
+        self.assertTrue(len(thinned) <= 10)
+        self.assertEqual(list(thinned[0]), [0.0, 0.0, 0.0])
+        self.assertEqual(list(thinned[-1]), [99.0, 0.0, 0.0])
+
+
+@unittest.skipIf(PathSimplify is None, "needs PySide")
+class LevelsTest(unittest.TestCase):
+
+    def getLevels(self, store, maxPoints, tolerance=0.01):
+        levels = PathSimplify.Levels(store, tolerance, lambda levels, bounds: None)
+        levels.maxPoints = maxPoints
+        return levels
+
+    def testIncremental(self):
+        block = PathSimplify.Simplifier.block
+        store = getStore(block + 10)
+        levels = self.getLevels(store, 0)
+        first = levels.getLevels()
+        counts = [simplifier.count for simplifier in levels.simplifiers]
+        self.assertEqual(getCount(first), [count + 10 for count in counts])
+        store.extend((float(i), 0.0, 0.0) for i in range(block))
+        second = levels.getLevels()
+        # Only the points after the first complete block are written again
+        self.assertEqual([level.start for level in second], counts)
+        self.assertFalse(any(level.reset for level in second))
+
+    def testMaxPoints(self):
+        block = PathSimplify.Simplifier.block
+        store = getStore(3 * block + 1)
+        levels = self.getLevels(store, 1000)
+        result = levels.getLevels()
+        for level in result:
+            self.assertTrue(level.count <= 1000)
+        # The finest level is simplified again with a larger tolerance
+        self.assertTrue(result[0].reset)
+        self.assertTrue(levels.simplifiers[0].tolerance > 0.01)
+
+    def testMaxPointsBelowBlocks(self):
+        # Every block keeps its first point, the tolerance cannot go under
+        # one point per block: the levels are thinned instead
+        block = PathSimplify.Simplifier.block
+        store = getLine(30 * block)
+        levels = self.getLevels(store, 10)
+        for level in levels.getLevels():
+            self.assertTrue(level.count <= 10)
+            self.assertEqual(level.count, len(level.points))
+        for simplifier in levels.simplifiers:
+            self.assertTrue(simplifier.floored)
+            self.assertFalse(math.isinf(simplifier.tolerance))
+        store.extend((float(i), 0.0, 0.0) for i in range(block))
+        for level in levels.getLevels():
+            self.assertTrue(level.reset)
+            self.assertTrue(level.count <= 10)
+
+    def testBounds(self):
+        store = getLine(10)
+        levels = self.getLevels(store, 0)
+        self.assertEqual(levels.getBounds(), [[0.0, 0.0, 0.0], [9.0, 0.0, 0.0]])
+        store.append((-1.0, 5.0, 2.0))
+        self.assertEqual(levels.getBounds(), [[-1.0, 0.0, 0.0], [9.0, 5.0, 2.0]])
+
+
+if __name__ == "__main__":
+    unittest.main()
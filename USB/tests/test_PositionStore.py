@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" Toolpath position store tests """
+from __future__ import unicode_literals
+
+import json, pickle, unittest
+from App import PositionStore
+
+
+class SmallStore(PositionStore.PositionStore):
+
+    chunk = 4   # several chunks with a few positions
+
+
+def getList(points):
+    points = points.tolist() if hasattr(points, "tolist") else points
+    return [list(p) for p in points]
+
+def getStore(count, cls=SmallStore):
+    store = cls()
+    store.extend((float(i), float(-i), 0.5) for i in range(count))
+    return store
+
+
+class PositionStoreTest(unittest.TestCase):
+
+    def testAppend(self):
+        store = getStore(10)
+        self.assertEqual(len(store), 10)
+        self.assertEqual(len(store.chunks), 3)
+        self.assertEqual(getList(store.getPoints(3, 6)),
+                         [[3.0, -3.0, 0.5], [4.0, -4.0, 0.5], [5.0, -5.0, 0.5]])
+        self.assertEqual(getList(store.getPoints(9)), [[9.0, -9.0, 0.5]])
+        self.assertEqual(getList(store.getPoints(10)), [])
+
+    def testPickle(self):
+        store = getStore(10)
+        copy = pickle.loads(pickle.dumps(store))
+        self.assertEqual(len(copy), 10)
+        self.assertEqual(copy.start, store.start)
+        self.assertEqual(getList(copy.getPoints()), getList(store.getPoints()))
+        # Appending goes on after the restored positions
+        copy.append((10.0, -10.0, 0.5))
+        self.assertEqual(getList(copy.getPoints(9)), [[9.0, -9.0, 0.5], [10.0, -10.0, 0.5]])
+
+    def testJsonState(self):
+        # PropertyPythonObject saves the state as JSON
+        store = getStore(5, PositionStore.PositionStore)
+        copy = PositionStore.PositionStore()
+        copy.__setstate__(json.loads(json.dumps(store.__getstate__())))
+        self.assertEqual(getList(copy.getRows()), getList(store.getRows()))
+
+    def testEmpty(self):
+        copy = pickle.loads(pickle.dumps(SmallStore()))
+        self.assertEqual(len(copy), 0)
+        self.assertEqual(getList(copy.getPoints()), [])
+
+    def testClear(self):
+        store = getStore(10)
+        store.clear()
+        self.assertEqual(len(store), 0)
+        store.append((1.0, 2.0, 3.0))
+        self.assertEqual(getList(store.getPoints()), [[1.0, 2.0, 3.0]])
+
+
+class PositionViewTest(unittest.TestCase):
+
+    def testTake(self):
+        store = getStore(3)
+        view = PositionStore.PositionView(store)
+        self.assertEqual(view.getPending(), 3)
+        start, points = view.take()
+        self.assertEqual((start, len(points)), (0, 3))
+        self.assertEqual(view.getPending(), 0)
+        self.assertEqual(len(view.take()[1]), 0)
+        store.extend([(3.0, -3.0, 0.5), (4.0, -4.0, 0.5)])
+        start, points = view.take()
+        self.assertEqual(start, 3)
+        self.assertEqual(getList(points), [[3.0, -3.0, 0.5], [4.0, -4.0, 0.5]])
+        view.reset()
+        self.assertEqual(view.take()[0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
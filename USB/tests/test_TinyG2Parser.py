@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" TinyG2 response parser tests """
+from __future__ import unicode_literals
+
+import unittest
+from App import TinyG2Parser
+
+
+class ClassifyTest(unittest.TestCase):
+
+    def testTypes(self):
+        self.assertEqual(TinyG2Parser.classify('{"r":{},"f":[1,0,8]}'), "r")
+        self.assertEqual(TinyG2Parser.classify('  {"sr":{"posx":1.0}}'), "sr")
+        self.assertEqual(TinyG2Parser.classify('{"qr":28}'), "qr")
+        self.assertEqual(TinyG2Parser.classify('{"er":{"fb":100}}'), "er")
+        self.assertEqual(TinyG2Parser.classify('{"rx":254}'), "json")
+        self.assertEqual(TinyG2Parser.classify("[fb] firmware build  100.26"), "txt")
+        self.assertEqual(TinyG2Parser.classify(""), "txt")
+
+    def testQueueReport(self):
+        self.assertEqual(TinyG2Parser.parseQr('{"qr":28}\n'), {"qr": 28})
+        self.assertEqual(TinyG2Parser.parseQr('{"qr":27,"qi":1,"qo":0}'), {"qr": 27, "qi": 1, "qo": 0})
+        # Not the compact form: decoded as JSON
+        self.assertEqual(TinyG2Parser.parseQr('{ "qr" : { "x" : 1 } }'), {"qr": {"x": 1}})
+
+
+class ParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = TinyG2Parser.Parser()
+        self.received = []
+
+    def testUnsubscribedType(self):
+        self.assertEqual(self.parser.parse('{"sr":{"posx":1.0}}'), [])
+        self.parser.subscribe("sr", self.received.append)
+        self.assertEqual(self.parser.parse('{"sr":{"posx":1.0}}'), [])
+        self.assertEqual(self.received, [{"sr": {"posx": 1.0}}])
+        self.parser.unsubscribe("sr", self.received.append)
+        self.parser.parse('{"sr":{"posx":2.0}}')
+        self.assertEqual(len(self.received), 1)
+
+    def testFooterUpdates(self):
+        updates = self.parser.parse('{"r":{"g54":{"x":10.5,"y":0}},"f":[1,0,8]}')
+        self.assertEqual(sorted(updates), [("g54x", 10.5, "Value"), ("g54y", 0, "Value")])
+        self.assertEqual(self.parser.parse('{"r":{},"f":[1,0,8]}'), [])
+
+    def testText(self):
+        updates = self.parser.parse("[ja] junction acceleration  100000 mm")
+        self.assertEqual(updates, [("ja", "junction acceleration", "Description"),
+                                   ("ja", "100000 mm", "Unit")])
+
+    def testInvalid(self):
+        self.parser.subscribe("json", self.received.append)
+        self.assertEqual(self.parser.parse('{"rx":'), [])
+        self.assertEqual(self.received, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2015 Pierre Vacher <prrvchr@gmail.com>                  *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+""" loop:// serial url handler tests """
+from __future__ import unicode_literals
+
+import threading, time, unittest
+import serial
+
+
+def getPort(url, **kwargs):
+    kwargs.setdefault("timeout", 1.0)
+    return serial.serial_for_url(url, **kwargs)
+
+
+class LoopTest(unittest.TestCase):
+
+    def testLoopback(self):
+        port = getPort("loop://")
+        try:
+            port.write(b"G0 X1\n")
+            self.assertEqual(port.in_waiting, 6)
+            self.assertEqual(port.read(6), b"G0 X1\n")
+            # Timeout: what was there
+            port.timeout = 0.05
+            port.write(b"ok")
+            self.assertEqual(port.read(10), b"ok")
+        finally:
+            port.close()
+
+    def testPair(self):
+        first, second = getPort("loop://test/0"), getPort("loop://test/1")
+        try:
+            first.write(b"ping")
+            second.write(b"pong")
+            self.assertEqual(second.read(4), b"ping")
+            self.assertEqual(first.read(4), b"pong")
+        finally:
+            first.close()
+            second.close()
+
+    def testBounded(self):
+        port = getPort("loop://", baudrate=1000000, write_timeout=0.1)
+        try:
+            size = port.buffer_size
+            self.assertRaises(serial.SerialTimeoutException, port.write, b"x" * (size + 10))
+            # The buffer is full, not over
+            self.assertEqual(port.in_waiting, size)
+        finally:
+            port.close()
+
+    def testBlockedWriter(self):
+        first, second = getPort("loop://stream/0"), getPort("loop://stream/1")
+        data = bytes(bytearray(i % 251 for i in range(10 * first.buffer_size)))
+        writer = threading.Thread(target=first.write, args=(data,))
+        try:
+            writer.start()
+            self.assertEqual(second.read(len(data)), data)
+            writer.join(1.0)
+            self.assertFalse(writer.is_alive())
+        finally:
+            first.close()
+            second.close()
+
+    def testCloseWakesReader(self):
+        port = getPort("loop://", timeout=None)
+        received = []
+        reader = threading.Thread(target=lambda: received.append(port.read(1)))
+        reader.start()
+        time.sleep(0.05)
+        port.close()
+        reader.join(1.0)
+        self.assertFalse(reader.is_alive())
+        self.assertEqual(received, [b""])
+
+
+if __name__ == "__main__":
+    unittest.main()